@@ -1,68 +1,243 @@
 # Imports for setting up the app
 import os
+import signal
+import threading
+import time
 from datetime import timedelta
 
-from flask import Flask, send_from_directory
+import click
+from flask import Flask, current_app, send_from_directory
 from flask_jwt_extended import (
     JWTManager
 )
 from flask_cors import CORS
-from flask_migrate import Migrate
+from flask_migrate import Migrate, stamp, upgrade
 
+from database.db_interface import db, DATABASE_URI
+from database.pool import engine_options
+from scheduler import scheduler
 
-app = Flask(
-    __name__,
-    static_folder="./static",
-    static_url_path="",
-)
+jwt = JWTManager()
+migrate = Migrate()
 
-logger = app.logger
+# What a process started from this app runs:
+#   web        - serves requests, with the background workers that requests hand work to
+#   scheduler  - runs scheduled jobs (distractor backfill, sheet syncs)
+#   all        - both of the above, in one process. Handy in development.
+#   none       - nothing in the background
+# The scheduler should only run in one process, so the default is "web". Use
+# `flask run-scheduler` to run it on its own.
+#
+# CLI commands build the app with "none" (see FLASK_APP in the Dockerfile), so a
+# one-off `flask setup-db` doesn't start any threads. run-scheduler starts the
+# scheduler itself.
+APP_ROLES = ('web', 'scheduler', 'all', 'none')
 
-# Configuration
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+# Request metrics, served at /metrics. See utils/metrics.py
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
 
-jwt_access_expires = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 15))
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=jwt_access_expires)
 
-jwt_refresh_expires = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRES', 30))
-app.config['JWT_REFRESH_TOKEN_EXPIRES'] =  timedelta(days=jwt_refresh_expires)
+def get_app_role():
+    role = os.getenv('APP_ROLE') or 'web'
+    if role not in APP_ROLES:
+        raise ValueError(f"APP_ROLE must be one of {', '.join(APP_ROLES)}, not {role!r}")
+    return role
 
-logger.info(f"JWT_ACCESS_TOKEN_EXPIRES: {app.config['JWT_ACCESS_TOKEN_EXPIRES']}")
-logger.info(f"JWT_REFRESH_TOKEN_EXPIRES: {app.config['JWT_REFRESH_TOKEN_EXPIRES']}")
 
+def create_app(role=None, background_workers=True):
+    """Build the app. This doesn't touch the schema - run `flask setup-db` once per deploy for that.
 
-if not app.config['JWT_SECRET_KEY']:
-    raise ValueError("JWT_SECRET_KEY environment variable not set")
+    Pass background_workers=False when the app is built before forking, as gunicorn does with
+    preload_app, and call start_background_workers in each child instead (see gunicorn.conf.py).
+    """
+    started = time.perf_counter()
+    role = role or get_app_role()
 
-jwt = JWTManager(app)
+    app = Flask(
+        __name__,
+        static_folder="./static",
+        static_url_path="",
+    )
 
+    logger = app.logger
 
-# CORS needs to allow traffic from the frontend dev instance, which is running on localhost:3000
-CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+    # Configuration
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
 
+    jwt_access_expires = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 15))
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=jwt_access_expires)
+
+    jwt_refresh_expires = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRES', 30))
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] =  timedelta(days=jwt_refresh_expires)
+
+    logger.info(f"JWT_ACCESS_TOKEN_EXPIRES: {app.config['JWT_ACCESS_TOKEN_EXPIRES']}")
+    logger.info(f"JWT_REFRESH_TOKEN_EXPIRES: {app.config['JWT_REFRESH_TOKEN_EXPIRES']}")
+
+
+    if not app.config['JWT_SECRET_KEY']:
+        raise ValueError("JWT_SECRET_KEY environment variable not set")
+
+    jwt.init_app(app)
+
+
+    # CORS needs to allow traffic from the frontend dev instance, which is running on localhost:3000
+    CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+
+
+    # Configuration for SQLAlchemy
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URI)
+    logger.info(f"Database engine options: {app.config['SQLALCHEMY_ENGINE_OPTIONS']}")
+
+    # Initialize the database with the Flask app
+    db.init_app(app)
+    migrate.init_app(app, db)
+
+    register_routes(app)
+    register_commands(app)
+    register_query_counting(app)
+    if METRICS_ENABLED:
+        register_metrics(app)
+
+    if role in ('web', 'all') and background_workers:
+        start_background_workers(app)
+    if role in ('scheduler', 'all'):
+        start_scheduler(app)
+
+    startup_seconds = time.perf_counter() - started
+    app.config['APP_ROLE'] = role
+    app.config['STARTUP_SECONDS'] = startup_seconds
+    logger.info(f"App created in {startup_seconds * 1000:.0f}ms with role: {role}")
+
+    return app
 
-# Further imports for database setup
-from database.db_interface import db, DATABASE_URI
 
+def start_background_workers(app):
+    """Threads that requests hand work off to. Every process that serves requests needs its own."""
+    # Incorrect answers are generated in the background, never on the request path
+    from llm.distractor_worker import distractor_worker
+    distractor_worker.init_app(app)
 
-# Configuration for SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Answers are buffered in memory and written out in batches
+    from study.answer_buffer import answer_buffer
+    answer_buffer.init_app(app)
 
-# Initialize the database with the Flask app
-db.init_app(app)
-migrate = Migrate(app, db)
 
-# Create the database tables
-with app.app_context():
+def start_scheduler(app):
+    """Start running scheduled jobs. Only one process per deployment should do this."""
+    from llm.distractor_worker import distractor_worker
+    from llm.distractors import backfill_distractors_job, DISTRACTOR_BACKFILL_INTERVAL
+    from data_imports.sheet_scheduler import init_sheet_sync_scheduler
+    from database.sync_log import prune_sync_log_job, SYNC_LOG_PRUNE_INTERVAL
+
+    # A scheduler-only process serves no requests, so its metrics reach /metrics through METRICS_DIR
+    from utils.metrics import start_snapshot_writer
+    start_snapshot_writer()
+
+    # The backfill job generates distractors itself, so needs the worker even if this process serves nothing
+    if distractor_worker.app is None:
+        distractor_worker.init_app(app)
+
+    with app.app_context():
+        scheduler.init_app(app)
+        scheduler.start()
+
+        scheduler.add_job(
+            id="backfill_distractors",
+            func=backfill_distractors_job,
+            trigger="interval",
+            seconds=DISTRACTOR_BACKFILL_INTERVAL,
+            replace_existing=True,
+        )
+
+        # Tombstones and membership events only need keeping as long as a sync cursor can be
+        scheduler.add_job(
+            id="prune_sync_log",
+            func=prune_sync_log_job,
+            trigger="interval",
+            seconds=SYNC_LOG_PRUNE_INTERVAL,
+            replace_existing=True,
+        )
+
+        # Google Sheet syncs are stored in the database, and each run on their own schedule
+        init_sheet_sync_scheduler()
+
+
+def register_query_counting(app):
+    import database.query_count as query_count
+
+    app.before_request(query_count.start_request_counter)
+    app.after_request(query_count.check_request_counter)
+
+
+def register_metrics(app):
+    import routes.metrics_endpoints as metrics_endpoints
+
+    app.before_request(metrics_endpoints.start_request_timer)
+    app.after_request(metrics_endpoints.record_request)
+    app.add_url_rule("/metrics", view_func=metrics_endpoints.get_metrics, methods=['GET'])
+
+
+def setup_database():
+    """Bring the schema up to date. Needs an app context."""
+    if not db.inspect(db.engine).has_table('user'):
+        # A fresh database gets the current schema in one go
+        db.create_all()
+        stamp()
+        return
+
+    upgrade()
+    # New tables aren't in the migrations, they're created straight from the models
     db.create_all()
 
-# Start the scheduler
-from scheduler import scheduler
 
-with app.app_context():
-    scheduler.init_app(app)
-    scheduler.start()
+def register_commands(app):
+    @app.cli.command('setup-db')
+    def setup_db_command():
+        """Apply migrations and create any new tables. Run once per deploy, before starting servers."""
+        started = time.perf_counter()
+        setup_database()
+        click.echo(f"Database is up to date ({time.perf_counter() - started:.1f}s)")
+
+    @app.cli.command('uuid-backfill')
+    @click.option('--batch-size', default=1000, help="Primary keys per batch")
+    @click.option('--pause', default=0.0, help="Seconds to wait between batches")
+    def uuid_backfill_command(batch_size, pause):
+        """Copy UUID columns to BINARY(16) on MySQL, ahead of the migration that switches to them.
+
+        Safe to run while the app is serving, and to run again. See database/uuid_migration.py.
+        """
+        from database.uuid_migration import backfill, prepare
+
+        with db.engine.connect() as connection:
+            if connection.dialect.name not in ('mysql', 'mariadb'):
+                click.echo("Only MySQL stores UUIDs as CHAR(32), there's nothing to do")
+                return
+
+            started = time.perf_counter()
+            prepare(connection)
+            connection.commit()
+            updated = backfill(connection, batch_size=batch_size, pause=pause)
+            click.echo(f"Backfilled {updated} rows ({time.perf_counter() - started:.1f}s). Run setup-db to finish.")
+
+    @app.cli.command('run-scheduler')
+    def run_scheduler_command():
+        """Run scheduled jobs in the foreground until stopped."""
+        if not scheduler.running:
+            start_scheduler(current_app._get_current_object())
+
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        click.echo(f"Scheduler running with {len(scheduler.get_jobs())} jobs")
+        try:
+            while not stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+        scheduler.shutdown()
+
 
 # TODO: This implementation is broken - or my credentials are.
 # I get missing fields client_id, refresh_token, client_secret.
@@ -80,78 +255,93 @@ with app.app_context():
 #     print(f"Rows:\n{rows}")
 
 
-### USER ENDPOINTS ###
-import routes.user_endpoints as user_endpoints
+def register_routes(app):
+    ### USER ENDPOINTS ###
+    import routes.user_endpoints as user_endpoints
+
+    app.add_url_rule("/api/register", view_func=user_endpoints.register, methods=['POST'])
+    app.add_url_rule("/api/login", view_func=user_endpoints.login, methods=['POST'])
+    app.add_url_rule("/api/refresh", view_func=user_endpoints.refresh_token, methods=['POST'])
+    # app.add_url_rule("/api/logout", view_func=user_endpoints.logout, methods=['POST']) # TODO: Implement serverside logout & token revocation
+    app.add_url_rule("/api/protected", view_func=user_endpoints.protected, methods=['GET'])
+    app.add_url_rule("/api/user/groups", view_func=user_endpoints.get_user_groups, methods=['GET'])
+    app.add_url_rule("/api/user/details", view_func=user_endpoints.get_user_details, methods=['GET', 'POST'])
 
-app.add_url_rule("/api/register", view_func=user_endpoints.register, methods=['POST'])
-app.add_url_rule("/api/login", view_func=user_endpoints.login, methods=['POST'])
-app.add_url_rule("/api/refresh", view_func=user_endpoints.refresh_token, methods=['POST'])
-# app.add_url_rule("/api/logout", view_func=user_endpoints.logout, methods=['POST']) # TODO: Implement serverside logout & token revocation
-app.add_url_rule("/api/protected", view_func=user_endpoints.protected, methods=['GET'])
-app.add_url_rule("/api/user/groups", view_func=user_endpoints.get_user_groups, methods=['GET'])
-# TODO: This should be a GET with a query parameter
-app.add_url_rule("/api/user/details", view_func=user_endpoints.get_user_details, methods=['POST'])
 
+    ### CARD ENDPOINTS ###
+    import routes.card_endpoints as card_endpoints
 
-### CARD ENDPOINTS ###
-import routes.card_endpoints as card_endpoints
+    app.add_url_rule("/api/cards", view_func=card_endpoints.create_card, methods=['POST'])
+    app.add_url_rule("/api/cards/bulk", view_func=card_endpoints.create_bulk_cards, methods=['POST'])
+    app.add_url_rule("/api/cards", view_func=card_endpoints.get_cards, methods=['GET'])
+    app.add_url_rule("/api/cards/search", view_func=card_endpoints.search_cards, methods=['GET'])
+    app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.get_card, methods=['GET'])
+    app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.update_card, methods=['PUT'])
+    app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.delete_card, methods=['DELETE'])
+    app.add_url_rule("/api/cards/flashcard", view_func=card_endpoints.get_random_card, methods=['GET'])
+    app.add_url_rule("/api/cards/session", view_func=card_endpoints.get_study_batch, methods=['GET'])
+    app.add_url_rule("/api/cards/<uuid:card_id>/answer", view_func=card_endpoints.answer_card, methods=['POST'])
+    app.add_url_rule("/api/cards/answers", view_func=card_endpoints.answer_cards, methods=['POST'])
+    app.add_url_rule("/api/sync", view_func=card_endpoints.sync_cards, methods=['GET'])
 
-app.add_url_rule("/api/cards", view_func=card_endpoints.create_card, methods=['POST'])
-app.add_url_rule("/api/cards/bulk", view_func=card_endpoints.create_bulk_cards, methods=['POST'])
-app.add_url_rule("/api/cards", view_func=card_endpoints.get_cards, methods=['GET'])
-app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.get_card, methods=['GET'])
-app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.update_card, methods=['PUT'])
-app.add_url_rule("/api/cards/<uuid:card_id>", view_func=card_endpoints.delete_card, methods=['DELETE'])
-app.add_url_rule("/api/cards/flashcard", view_func=card_endpoints.get_random_card, methods=['GET'])
 
+    ### GROUP ENDPOINTS ###
+    import routes.group_endpoints as group_endpoints
 
-### GROUP ENDPOINTS ###
-import routes.group_endpoints as group_endpoints
+    app.add_url_rule("/api/groups", view_func=group_endpoints.create_group, methods=['POST'])
 
-app.add_url_rule("/api/groups", view_func=group_endpoints.create_group, methods=['POST'])
+    # List all groups
+    app.add_url_rule("/api/groups", view_func=group_endpoints.get_groups, methods=['GET'])
 
-# List all groups
-app.add_url_rule("/api/groups", view_func=group_endpoints.get_groups, methods=['GET'])
+    # Get group
+    app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.get_group_info, methods=['GET'])
+    # Update group
+    app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.update_group, methods=['PUT'])
+    # Delete Group
+    app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.delete_group, methods=['DELETE'])
 
-# Get group
-app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.get_group_info, methods=['GET'])
-# Update group
-app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.update_group, methods=['PUT'])
-# Delete Group
-app.add_url_rule("/api/groups/<uuid:group_id>", view_func=group_endpoints.delete_group, methods=['DELETE'])
+    # Search for groups
+    app.add_url_rule("/api/groups/search", view_func=group_endpoints.search_groups, methods=['GET'])
 
-# Search for groups
-app.add_url_rule("/api/groups/search", view_func=group_endpoints.search_groups, methods=['GET'])
+    # Join or Leave group
+    app.add_url_rule("/api/groups/<uuid:group_id>/join", view_func=group_endpoints.add_user_to_group, methods=['POST'])
+    app.add_url_rule("/api/groups/<uuid:group_id>/leave", view_func=group_endpoints.remove_user_from_group, methods=['POST'])
+    app.add_url_rule("/api/groups/<uuid:group_id>/cards", view_func=group_endpoints.get_group_cards, methods=['GET'])
 
-# Join or Leave group
-app.add_url_rule("/api/groups/<uuid:group_id>/join", view_func=group_endpoints.add_user_to_group, methods=['POST'])
-app.add_url_rule("/api/groups/<uuid:group_id>/leave", view_func=group_endpoints.remove_user_from_group, methods=['POST'])
-app.add_url_rule("/api/groups/<uuid:group_id>/cards", view_func=group_endpoints.get_group_cards, methods=['GET'])
+    # WIP: Google sheets creation
+    app.add_url_rule("/api/groups/google-sheets", view_func=group_endpoints.create_group_from_google_sheet, methods=['POST'])
 
-# WIP: Google sheets creation
-app.add_url_rule("/api/groups/google-sheets", view_func=group_endpoints.create_group_from_google_sheet, methods=['POST'])
 
+    ### DEV ENDPOINTS ###
+    import routes.dev_endpoints as dev_endpoints
 
-### DEV ENDPOINTS ###
-import routes.dev_endpoints as dev_endpoints
+    app.add_url_rule("/api/dev/users", view_func=dev_endpoints.get_usernames, methods=['GET'])
+    app.add_url_rule("/api/dev/distractors", view_func=dev_endpoints.get_distractor_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/answers", view_func=dev_endpoints.get_answer_buffer_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/membership-cache", view_func=dev_endpoints.get_membership_cache_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/profile-cache", view_func=dev_endpoints.get_profile_cache_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/render-cache", view_func=dev_endpoints.get_render_cache_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/study-sessions", view_func=dev_endpoints.get_study_session_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/card-index", view_func=dev_endpoints.get_card_index_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/startup", view_func=dev_endpoints.get_startup_stats, methods=['GET'])
+    app.add_url_rule("/api/dev/db-pool", view_func=dev_endpoints.get_db_pool_stats, methods=['GET'])
 
-app.add_url_rule("/api/dev/users", view_func=dev_endpoints.get_usernames, methods=['GET'])
+    @app.route('/api/dev/health')
+    def ping():
+        return "ok", 200
 
-@app.route('/api/dev/health')
-def ping():
-    return "ok", 200
+    ### Static files
+    # Catch-all route to support client-side routing in React
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        # If a static file exists for the requested path, serve it.
+        if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
+            return send_from_directory(app.static_folder, path)
 
-### Static files
-# Catch-all route to support client-side routing in React
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    # If a static file exists for the requested path, serve it.
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+        # Otherwise, serve index.html for React Router to handle routing.
+        return send_from_directory(app.static_folder, 'index.html')
 
-    # Otherwise, serve index.html for React Router to handle routing.
-    return send_from_directory(app.static_folder, 'index.html')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app('all').run(debug=True)
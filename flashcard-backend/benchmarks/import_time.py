@@ -0,0 +1,90 @@
+"""Import-time profile of creating the app, from `python -X importtime`.
+
+Prints the slowest top-level packages by cumulative import time, and fails if
+the total goes over a budget or if an optional SDK gets imported on startup:
+
+    python benchmarks/import_time.py --budget-ms 1500 --forbid openai gspread google_auth_oauthlib
+
+The app is created with the web role unless --role says otherwise, since
+that's the role that starts the background workers on startup.
+
+Needs the same environment variables as the app itself.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Integrations that should only be imported when they're used
+OPTIONAL_PACKAGES = ["openai", "gspread", "google_auth_oauthlib", "googleapiclient"]
+
+# e.g. "import time:       394 |       1015 |   flask.app"
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def profile_imports(role):
+    """Returns {module: (self_us, cumulative_us, depth)} for everything imported while creating the app"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"from app import create_app; create_app({role!r})"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Creating the app failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        # Nesting is shown by indenting two spaces per level
+        depth = (len(indent) - 1) // 2
+        modules[module] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--role", default="web", help="APP_ROLE to create the app with")
+    parser.add_argument("--top", type=int, default=15, help="How many packages to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail if imports take longer than this in total")
+    parser.add_argument("--forbid", nargs="*", default=OPTIONAL_PACKAGES, help="Fail if any of these packages are imported")
+    args = parser.parse_args()
+
+    modules = profile_imports(args.role)
+
+    # Only top-level imports count towards the total, the rest are included in their cumulative times
+    total_us = sum(cumulative for _, cumulative, depth in modules.values() if depth == 0)
+
+    by_package = defaultdict(int)
+    for module, (self_us, _, _) in modules.items():
+        by_package[module.split(".")[0]] += self_us
+
+    print(f"Total import time: {total_us / 1000:.0f}ms over {len(modules)} modules\n")
+    print(f"{'package':<30} {'ms':>8}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<30} {self_us / 1000:>8.1f}")
+
+    failures = []
+    imported_packages = {module.split(".")[0] for module in modules}
+    for package in args.forbid:
+        if package in imported_packages:
+            failures.append(f"{package} was imported on startup")
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        failures.append(f"Imports took {total_us / 1000:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Requests per second and latency of the backend under concurrent load.
+
+Point it at a running server:
+
+    python benchmarks/load_test.py --url http://localhost:5000/api/dev/health
+
+or have it start each server in turn and compare them, e.g. the development
+server against gunicorn:
+
+    python benchmarks/load_test.py --path /api/dev/health \\
+        --server "flask=flask --app app run --port 5000" \\
+        --server "gunicorn=gunicorn -c gunicorn.conf.py app:app"
+
+Servers are started from the backend directory, with the current environment,
+so the database and JWT settings need to be exported first. Pass --token to
+load-test an authenticated endpoint.
+"""
+import argparse
+import http.client
+import os
+import shlex
+import signal
+import statistics
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEALTH_PATH = "/api/dev/health"
+
+
+def percentile(latencies, percentile):
+    if not latencies:
+        return 0.0
+    index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+    return latencies[index]
+
+
+def client_loop(url, headers, deadline, latencies, errors):
+    """One simulated client, making requests back to back over a keep-alive connection"""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    connection = http.client.HTTPConnection(parts.netloc, timeout=30)
+
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection(parts.netloc, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+    connection.close()
+
+
+def run_load(url, concurrency, duration, token=None):
+    headers = {"Connection": "keep-alive"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client_loop, args=(url, headers, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def wait_until_up(base_url, timeout=60):
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.netloc, timeout=2)
+            connection.request("GET", HEALTH_PATH)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} didn't come up within {timeout}s")
+
+
+def run_server(command, base_url, path, concurrency, duration, token):
+    process = subprocess.Popen(
+        shlex.split(command),
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        wait_until_up(base_url)
+        # Warm up, so lazy imports and connection pools aren't part of the measurement
+        run_load(base_url + path, concurrency, min(duration, 2), token)
+        return run_load(base_url + path, concurrency, duration, token)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load-test an already running server at this URL")
+    parser.add_argument("--server", action="append", default=[], help="name=command to start a server and load-test it")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000", help="Where started servers listen")
+    parser.add_argument("--path", default=HEALTH_PATH, help="Path to request on started servers")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--token", help="JWT access token to send")
+    args = parser.parse_args()
+
+    if not args.url and not args.server:
+        parser.error("Pass --url, or at least one --server")
+
+    if args.url:
+        print(f"{args.url}: {run_load(args.url, args.concurrency, args.duration, args.token)}")
+
+    for server in args.server:
+        name, _, command = server.partition("=")
+        result = run_server(command, args.base_url, args.path, args.concurrency, args.duration, args.token)
+        print(f"{name}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Check that the queries behind each endpoint use an index.
+
+Calls each endpoint in database/query_plans.py through the app's test client,
+records every statement it runs, and EXPLAINs them against the database the
+app is configured for. Exits non-zero if any of them reads a whole table -
+type ALL on MySQL, a plain SCAN on SQLite - unless that's listed in
+ALLOWED_SCANS. tests/test_query_plans.py runs the same check on every test
+run, against a small seeded database; this is for checking other databases,
+and bigger ones.
+
+Point it at a scratch database, as --seed fills it with synthetic users,
+groups and cards (and the endpoints change it, e.g. deleting a card):
+
+    python benchmarks/query_plans.py --seed --cards 20000
+
+Plans depend on table sizes, so seed at least a few thousand cards. Without
+--seed, it uses whatever the database already holds, and needs a user with
+some cards to run as: pass --user.
+"""
+import argparse
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="Fill the database with synthetic data first")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--cards", type=int, default=20000)
+    parser.add_argument("--subscriptions", type=int, default=10, help="Groups each seeded user is subscribed to")
+    parser.add_argument("--user", type=uuid.UUID, help="Run as this user, instead of a seeded one")
+    parser.add_argument("--verbose", action="store_true", help="Print every statement, not just the ones that scan")
+    args = parser.parse_args()
+
+    from app import create_app, setup_database
+    from database.query_plans import ENDPOINTS, call_endpoints, explain_statements, seed
+
+    app = create_app("none")
+
+    with app.app_context():
+        setup_database()
+        user_id = args.user
+        if args.seed:
+            seeded_user_id = seed(args.users, args.groups, args.cards, args.subscriptions)
+            user_id = user_id or seeded_user_id
+        if user_id is None:
+            raise SystemExit("Pass --seed, or --user to run as an existing user")
+
+    try:
+        statements, errors = call_endpoints(app, user_id)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for error in errors:
+        print(error)
+
+    failures = 0
+    for endpoint, statement, scans in explain_statements(app, statements):
+        if scans:
+            failures += 1
+        if scans or args.verbose:
+            summary = " ".join(statement.split())[:160]
+            status = f"FULL SCAN of {', '.join(sorted(scans))}" if scans else "ok"
+            print(f"{endpoint}: {status}\n    {summary}")
+
+    print(f"{len(statements)} statements from {len(ENDPOINTS)} endpoints, {failures} with full table scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
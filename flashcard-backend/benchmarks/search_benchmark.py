@@ -0,0 +1,117 @@
+"""Latency of card search at different deck sizes.
+
+By default this benchmarks the in-process inverted index (the fallback used
+off MySQL) against synthetic cards:
+
+    python benchmarks/search_benchmark.py --sizes 100000 1000000
+
+With --app, it instead times search_card_ids against the database the app
+is configured for, searching across every group. Seed that database first.
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search.inverted_index import InvertedIndex
+
+VOCABULARY_SIZE = 50_000
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def make_vocabulary(rng):
+    return list({
+        "".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 12)))
+        for _ in range(VOCABULARY_SIZE)
+    })
+
+
+def make_queries(vocabulary, rng):
+    """Typeahead-style prefixes of common and less common words, alone and in pairs"""
+    queries = []
+    for rank in (10, 100, 1000, 10000):
+        word = vocabulary[rank]
+        queries.append(word[:3])
+        queries.append(word[:5])
+        queries.append(f"{vocabulary[rank + 1]} {word[:4]}")
+    return queries
+
+
+def synthetic_cards(count, vocabulary, groups=100, seed=0):
+    """Cards whose words follow a Zipf-like distribution, like natural text"""
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    group_ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(groups)]
+    for _ in range(count):
+        question = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(4, 12)))
+        answer = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 4)))
+        yield uuid.UUID(int=rng.getrandbits(128)), f"{question} {answer}", rng.choice(group_ids)
+
+
+def time_queries(search, queries, repeats):
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(latencies[int(0.99 * (len(latencies) - 1))] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+def benchmark_index(size, repeats):
+    rng = random.Random(0)
+    vocabulary = make_vocabulary(rng)
+    queries = make_queries(vocabulary, rng)
+
+    index = InvertedIndex()
+    started = time.perf_counter()
+    index.build(synthetic_cards(size, vocabulary))
+    build_time = time.perf_counter() - started
+
+    # Search across half of the groups, as a user subscribed to a lot of decks would
+    group_ids = {extra for _, extra in list(index.documents.values())[:1000]}
+    group_ids = set(list(group_ids)[:len(group_ids) // 2])
+
+    result = time_queries(lambda query: index.search(query, 50, lambda group_id: group_id in group_ids), queries, repeats)
+    result.update({'cards': size, 'vocabulary': len(index.vocabulary), 'build_s': round(build_time, 2)})
+    return result
+
+
+def benchmark_app(queries, repeats):
+    from app import create_app
+    from database.db_interface import db
+    from database.db_types import Group
+    from search.search import search_card_ids
+
+    app = create_app("none")
+    with app.app_context():
+        group_ids = [row.group_id for row in db.session.query(Group.group_id)]
+        # The first search may build the fallback index, so don't time it
+        search_card_ids(queries[0], group_ids)
+        return time_queries(lambda query: search_card_ids(query, group_ids), queries, repeats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--app", action="store_true", help="Benchmark against the app's configured database")
+    parser.add_argument("--query", nargs="+", help="Search terms to use with --app")
+    args = parser.parse_args()
+
+    if args.app:
+        print(benchmark_app(args.query or ["the", "what is", "capital"], args.repeats))
+    else:
+        for size in args.sizes:
+            print(benchmark_index(size, args.repeats))
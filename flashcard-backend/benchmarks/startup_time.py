@@ -0,0 +1,59 @@
+"""Cold start time of the app, i.e. how long a new worker or replica takes to be ready.
+
+Each run is a fresh interpreter, timing the imports and create_app() separately:
+
+    python benchmarks/startup_time.py --runs 10 --role web
+
+Needs the same environment variables as the app itself. The database isn't
+touched unless the role starts the scheduler.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a child process, so nothing is already imported
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app(sys.argv[1])
+created = time.perf_counter()
+print(json.dumps({"import": imported - started, "create_app": created - imported}))
+"""
+
+
+def measure(role):
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, role],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Logging can end up on stdout too, the timings are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--role", default="web", help="APP_ROLE to create the app with")
+    args = parser.parse_args()
+
+    runs = [measure(args.role) for _ in range(args.runs)]
+    for phase in ("import", "create_app"):
+        timings = [run[phase] * 1000 for run in runs]
+        print(f"{phase}: median {statistics.median(timings):.0f}ms, max {max(timings):.0f}ms")
+
+    totals = [(run["import"] + run["create_app"]) * 1000 for run in runs]
+    print(f"total: median {statistics.median(totals):.0f}ms, max {max(totals):.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""High-volume card imports.
+
+Rows are validated one at a time and inserted in chunks, with one Core
+executemany INSERT per chunk (which SQLAlchemy sends as multi-row statements)
+and a commit after each one. The ORM is skipped entirely. Input can be streamed
+straight from the request body as NDJSON or CSV, so memory use stays flat
+however large the import is.
+"""
+import csv
+import json
+import os
+from datetime import datetime
+
+from database.db_interface import db
+from database.db_types import Card
+from database.uuids import uuid7
+from llm.distractor_worker import distractor_worker
+from study.card_index import card_index
+
+# Rows per INSERT statement, and per commit
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv('BULK_IMPORT_CHUNK_SIZE', 1000))
+# Only this many row errors are reported back in full, the rest are just counted
+BULK_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+CSV_HEADER = ['question', 'correct_answer']
+
+
+class BulkCardImporter:
+    def __init__(self, group_id, user_id, chunk_size=BULK_IMPORT_CHUNK_SIZE, keep_card_ids=False):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+
+        # Holding on to every ID defeats the point for huge imports, so it's optional
+        self.card_ids = [] if keep_card_ids else None
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+
+        self._chunk = []
+
+    def add(self, row_number, question, correct_answer):
+        if not isinstance(question, str) or not question.strip():
+            return self.add_error(row_number, 'Missing question')
+        if not isinstance(correct_answer, str) or not correct_answer.strip():
+            return self.add_error(row_number, 'Missing correct_answer')
+
+        now = datetime.now()
+        self._chunk.append({
+            # IDs are generated here, so they're known without reading anything back
+            'card_id': uuid7(),
+            'question': question,
+            'correct_answer': correct_answer,
+            'group_id': self.group_id,
+            'creator_id': self.user_id,
+            'updated_by_id': self.user_id,
+            'time_created': now,
+            'time_updated': now,
+        })
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < BULK_IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'message': message})
+
+    def flush(self):
+        if not self._chunk:
+            return
+
+        chunk, self._chunk = self._chunk, []
+        db.session.execute(Card.__table__.insert(), chunk)
+        db.session.commit()
+
+        card_ids = [row['card_id'] for row in chunk]
+        card_index.add(self.group_id, card_ids, chunk[-1]['time_created'])
+        self.created += len(card_ids)
+        if self.card_ids is not None:
+            self.card_ids.extend(card_ids)
+
+        distractor_worker.enqueue(card_ids)
+
+    def result(self):
+        result = {
+            'created': self.created,
+            'errors': self.errors,
+            'error_count': self.error_count,
+        }
+        if self.card_ids is not None:
+            result['card_ids'] = self.card_ids
+        return result
+
+
+def import_cards(importer, rows):
+    """Feed (row_number, question, correct_answer) rows into the importer.
+
+    A row may instead be (row_number, None, error message), for rows that couldn't be parsed.
+    """
+    for row_number, question, correct_answer in rows:
+        if question is None:
+            importer.add_error(row_number, correct_answer)
+        else:
+            importer.add(row_number, question, correct_answer)
+    importer.flush()
+    return importer.result()
+
+
+def json_rows(cards):
+    for row_number, card in enumerate(cards, start=1):
+        if not isinstance(card, dict):
+            yield row_number, None, 'Expected an object'
+            continue
+        yield row_number, card.get('question'), card.get('correct_answer')
+
+
+def ndjson_rows(lines):
+    """One JSON object per line, e.g. {"question": "...", "correct_answer": "..."}"""
+    for row_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            card = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        yield from ((row_number, question, answer) for _, question, answer in json_rows([card]))
+
+
+def csv_rows(lines):
+    """Two columns, question then correct_answer. A header row with those names is skipped."""
+    lines = (line.decode('utf-8', errors='replace') if isinstance(line, bytes) else line for line in lines)
+    reader = csv.reader(lines)
+    for row in reader:
+        row_number = reader.line_num
+        if row_number == 1 and [cell.strip().lower() for cell in row] == CSV_HEADER:
+            continue
+        if not row:
+            continue
+        if len(row) != 2:
+            yield row_number, None, f'Expected 2 columns, got {len(row)}'
+            continue
+        yield row_number, row[0], row[1]
@@ -1,21 +1,31 @@
 import os
+from logging import getLogger
 
 import gspread
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from uuid import UUID
 
-from database.db_interface import db
-from database.db_types import SheetSyncJob, Card
+from database.db_types import SheetSyncJob
+from data_imports.sheet_sync import SheetSource, sync_sheet
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+logger = getLogger()
+
+# For the last-modified time of a sheet, so unchanged sheets aren't downloaded. Tokens
+# granted before this was added don't have it, and sheets are downloaded on every sync
+# until they're authorized again.
+DRIVE_METADATA_SCOPE = "https://www.googleapis.com/auth/drive.metadata.readonly"
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    DRIVE_METADATA_SCOPE,
+]
 GOOGLE_OAUTH2_CREDS_FILE = os.getenv("GOOGLE_OAUTH2_CREDS_FILE", None)
-if not GOOGLE_OAUTH2_CREDS_FILE:
-    raise ValueError("GOOGLE_OAUTH2_CREDS_FILE environment variable not set")
 
 def get_google_creds():
     # TODO: This is not tested, just some boilerplate code. SET UP CREDENTIALS CORRECTLY
+    # Checked here rather than on import, so the app runs without Google Sheets configured
+    if not GOOGLE_OAUTH2_CREDS_FILE:
+        raise ValueError("GOOGLE_OAUTH2_CREDS_FILE environment variable not set")
     if not os.path.exists(GOOGLE_OAUTH2_CREDS_FILE):
         raise ValueError(f"Google OAuth2 credentials file not found: {GOOGLE_OAUTH2_CREDS_FILE}")
 
@@ -24,7 +34,9 @@ def get_google_creds():
     # created automatically when the authorization flow completes for the first
     # time.
     if os.path.exists(GOOGLE_OAUTH2_CREDS_FILE):
-        creds = Credentials.from_authorized_user_file(GOOGLE_OAUTH2_CREDS_FILE, SCOPES)
+        # With the scopes the token was granted, not SCOPES - refreshing a token with
+        # scopes it wasn't granted fails with invalid_scope
+        creds = Credentials.from_authorized_user_file(GOOGLE_OAUTH2_CREDS_FILE)
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -40,60 +52,57 @@ def get_google_creds():
     return creds
 
 
+class GoogleSheetSource(SheetSource):
+    """Rows of one worksheet of a Google Sheet"""
+
+    def __init__(self, job: SheetSyncJob, creds: Credentials):
+        self.job = job
+        self.creds = creds
+        self._spreadsheet = None
+
+    @property
+    def spreadsheet(self):
+        if self._spreadsheet is None:
+            client = gspread.authorize(self.creds)
+            self._spreadsheet = client.open_by_key(self.job.sheet_id)
+        return self._spreadsheet
+
+    def revision(self):
+        # Modified time of the whole spreadsheet, from the Drive API. Edits to other
+        # worksheets move it too, which just means the odd sync that finds nothing to do.
+        if self.creds.scopes and not self.creds.has_scopes([DRIVE_METADATA_SCOPE]):
+            logger.info(f"No access to the revision of sheet {self.job.sheet_id}, syncing anyway. "
+                        "Authorize Google Sheets again to skip unchanged sheets.")
+            return None
+        try:
+            return self.spreadsheet.get_lastUpdateTime()
+        except Exception as e:
+            logger.warning(f"Couldn't get the revision of sheet {self.job.sheet_id}, syncing anyway: {e}")
+            return None
+
+    def rows(self):
+        worksheet = self.spreadsheet.worksheet(self.job.sheet_range)
+        return worksheet.get_all_values()  # returns a list of lists
+
+
 def get_data_from_sheet(job: SheetSyncJob, creds: Credentials):
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(job.sheet_id)
-    worksheet = sheet.worksheet(job.sheet_range)
-    rows = worksheet.get_all_values()  # returns a list of lists
-    return rows
+    return GoogleSheetSource(job, creds).rows()
 
-def sync_cards_from_sheet(job_id: str):
+def sync_cards_from_sheet(job_id: str, force: bool = False):
     """
     Periodic task that:
     - Looks up the SheetSyncJob by job_id
-    - Connects to the Google Sheet
-    - Iterates over each row in the defined range
-    - Creates/updates Card records in the database
+    - Checks whether the Google Sheet has changed since the last sync
+    - If it has, creates/updates/deletes only the Card records that need it
     """
     job = SheetSyncJob.query.filter_by(job_id=job_id).first()
     if not job:
-        print(f"No sync job found for job_id: {job_id}")
+        logger.warning(f"No sync job found for job_id: {job_id}")
         return
 
     # Connect to the sheet
     creds = get_google_creds()
-    rows = get_data_from_sheet(job, creds)
-
-    group_id = UUID(job.group_id)
-    creator_id = UUID(job.creator_id)
-
-    existing_cards = Card.query.filter_by(group_id=group_id).all()
-    # Convert to a dict for quick lookups by question later.
-    existing_cards_dict = {c.question: c for c in existing_cards}
-
-    # check every row has exactly 2 columns
-    if any(len(row) != 2 for row in rows):
-        raise ValueError("Each row must have exactly 2 columns")
-
-    for row in rows:
-        question, correct_answer = row[0], row[1]
-
-        # update, if there's an existing card with this question
-        if question in existing_cards_dict:
-            # Update existing card
-            card = existing_cards_dict[question]
-            card.correct_answer = correct_answer
-            card.updated_by_id = creator_id
-        else:
-            # Create new card
-            card = Card(
-                question=question,
-                correct_answer=correct_answer,
-                group_id=group_id,
-                creator_id=creator_id,
-                updated_by_id=creator_id
-            )
-            db.session.add(card)
+    result = sync_sheet(job, GoogleSheetSource(job, creds), force=force)
 
-    db.session.commit()
-    print(f"Sync complete for job {job_id}")
+    logger.info(f"Sync complete for job {job_id}: {result}")
+    return result
@@ -0,0 +1,262 @@
+"""Scheduling of Google Sheet syncs.
+
+Every SheetSyncJob is loaded into the app's APScheduler instance on startup,
+on its own cron schedule. Syncs run on a small dedicated thread pool, with
+random jitter on each run so that many sheets on the same schedule don't all
+fire at once. When several replicas of the app are running, a lock row in the
+database makes sure each sync only happens on one of them. The scheduler's
+other interval jobs use the same locks, see run_on_one_replica.
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from database.db_interface import db
+from database.db_types import SheetSyncJob, SheetSyncLock
+from scheduler import scheduler
+from utils.metrics import Counter, Histogram
+
+logger = getLogger()
+
+# Syncs that can run at once, per process
+SHEET_SYNC_MAX_WORKERS = int(os.getenv('SHEET_SYNC_MAX_WORKERS', 4))
+# Each run is delayed by a random number of seconds up to this
+SHEET_SYNC_JITTER = int(os.getenv('SHEET_SYNC_JITTER', 60))
+# How often, in seconds, to pick up jobs that were added or changed since startup
+SHEET_SYNC_RELOAD_INTERVAL = int(os.getenv('SHEET_SYNC_RELOAD_INTERVAL', 60))
+# A lock held longer than this is assumed to belong to a replica that died mid-sync
+SHEET_SYNC_LOCK_TTL = timedelta(seconds=int(os.getenv('SHEET_SYNC_LOCK_TTL', 600)))
+
+SHEET_SYNC_EXECUTOR = 'sheet_sync'
+# Identifies this process as the holder of a lock
+LOCK_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Cron string each scheduled job was last scheduled with, by scheduler job ID
+_scheduled_cron_strings = {}
+
+SHEET_SYNC_SECONDS = Histogram(
+    'sheet_sync_duration_seconds',
+    'Time taken by scheduled sheet syncs, by outcome (synced, skipped as unchanged, missing or failed)',
+    ['outcome'],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+SHEET_SYNC_ROWS = Counter(
+    'sheet_sync_rows_total',
+    'Cards changed by sheet syncs, by change (inserted, updated or deleted)',
+    ['change'],
+)
+
+
+def sheet_sync_scheduler_id(job_id):
+    return f"sheet_sync:{job_id}"
+
+
+def parse_cron_string(cron_string):
+    """A trigger for a standard five-field crontab expression, e.g. "*/5 * * * *".
+
+    As with APScheduler's own from_crontab, day of week 0 is Monday, not Sunday.
+    """
+    fields = cron_string.split()
+    if len(fields) != 5:
+        raise ValueError(f"Expected 5 fields in cron string, got {len(fields)}: {cron_string!r}")
+
+    minute, hour, day, month, day_of_week = fields
+    return CronTrigger(
+        minute=minute,
+        hour=hour,
+        day=day,
+        month=month,
+        day_of_week=day_of_week,
+        jitter=SHEET_SYNC_JITTER,
+    )
+
+
+def init_sheet_sync_scheduler():
+    """Add the sync thread pool to the scheduler, and schedule every stored job. Needs an app context."""
+    scheduler.scheduler.add_executor(ThreadPoolExecutor(SHEET_SYNC_MAX_WORKERS), alias=SHEET_SYNC_EXECUTOR)
+
+    scheduled = reload_sheet_syncs()
+    logger.info(f"Scheduled {scheduled} sheet sync jobs")
+
+    # Jobs are created by the web processes, so the scheduler has to go looking for them
+    scheduler.add_job(
+        id="reload_sheet_syncs",
+        func=reload_sheet_syncs_job,
+        trigger="interval",
+        seconds=SHEET_SYNC_RELOAD_INTERVAL,
+        replace_existing=True,
+    )
+    return scheduled
+
+
+def reload_sheet_syncs():
+    """Make the scheduled syncs match the stored jobs. Returns how many are scheduled."""
+    stored = {
+        sheet_sync_scheduler_id(job.job_id): job
+        for job in SheetSyncJob.query.filter(SheetSyncJob.cron_string.isnot(None))
+    }
+
+    for scheduler_id, job in stored.items():
+        if _scheduled_cron_strings.get(scheduler_id) != job.cron_string:
+            schedule_sheet_sync(job)
+
+    for scheduler_id in list(_scheduled_cron_strings):
+        if scheduler_id not in stored:
+            unschedule_sheet_sync(scheduler_id)
+
+    return sum(1 for scheduler_id in stored if scheduler.get_job(scheduler_id))
+
+
+def reload_sheet_syncs_job():
+    """Scheduled job wrapper - APScheduler runs jobs outside of the app context"""
+    with scheduler.app.app_context():
+        reload_sheet_syncs()
+
+
+def schedule_sheet_sync(job):
+    """(Re)schedule one sync job. Returns False if it has no valid schedule."""
+    scheduler_id = sheet_sync_scheduler_id(job.job_id)
+    # Remembered even if it's invalid, so the same error isn't logged on every reload
+    _scheduled_cron_strings[scheduler_id] = job.cron_string
+
+    if not job.cron_string:
+        _remove_job(scheduler_id)
+        return False
+
+    try:
+        trigger = parse_cron_string(job.cron_string)
+    except ValueError as e:
+        logger.error(f"Not scheduling sheet sync job {job.job_id}: {e}")
+        _remove_job(scheduler_id)
+        return False
+
+    scheduler.add_job(
+        id=scheduler_id,
+        func=run_sheet_sync,
+        args=[job.job_id],
+        trigger=trigger,
+        executor=SHEET_SYNC_EXECUTOR,
+        # A slow sync shouldn't pile up runs behind it, and runs missed while busy are folded into one
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=SHEET_SYNC_JITTER + 60,
+        replace_existing=True,
+    )
+    return True
+
+
+def unschedule_sheet_sync(scheduler_id):
+    _scheduled_cron_strings.pop(scheduler_id, None)
+    _remove_job(scheduler_id)
+
+
+def _remove_job(scheduler_id):
+    if scheduler.get_job(scheduler_id):
+        scheduler.remove_job(scheduler_id)
+
+
+def run_sheet_sync(job_id):
+    """Scheduled job - sync one sheet, if no other replica is already doing it"""
+    # Imported here, so the Google client libraries are only loaded by processes that sync sheets
+    from data_imports.google_sheets import sync_cards_from_sheet
+
+    with scheduler.app.app_context():
+        if not acquire_sync_lock(job_id):
+            logger.debug(f"Sheet sync job {job_id} is locked by another replica, skipping")
+            return
+
+        started = time.perf_counter()
+        outcome = 'failed'
+        try:
+            result = sync_cards_from_sheet(job_id)
+            if result is None:
+                outcome = 'missing'
+            elif result['skipped']:
+                outcome = 'skipped'
+            else:
+                outcome = 'synced'
+                for change in ('inserted', 'updated', 'deleted'):
+                    SHEET_SYNC_ROWS.inc(result[change], change=change)
+        except Exception as e:
+            logger.exception(f"Sheet sync job {job_id} failed: {e}")
+            db.session.rollback()
+        finally:
+            SHEET_SYNC_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+            release_sync_lock(job_id)
+
+
+def acquire_sync_lock(job_id, ttl=SHEET_SYNC_LOCK_TTL):
+    """Take the lock for a job, if it's free, expired, or already ours. Returns whether we got it."""
+    locks = SheetSyncLock.__table__
+    now = datetime.now()
+
+    # Compare-and-set on the lock row, so two replicas can't both win
+    result = db.session.execute(
+        locks.update()
+        .where(locks.c.job_id == job_id)
+        .where(or_(locks.c.locked_until < now, locks.c.owner == LOCK_OWNER))
+        .values(owner=LOCK_OWNER, locked_until=now + ttl)
+    )
+    if result.rowcount == 0:
+        # Either someone else holds it, or there's no row yet. Only one insert can succeed.
+        try:
+            db.session.execute(locks.insert().values(job_id=job_id, owner=LOCK_OWNER, locked_until=now + ttl))
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    db.session.commit()
+    return True
+
+
+def release_sync_lock(job_id, locked_until=None):
+    """Hand the lock back once a sync is done.
+
+    Other replicas fire the same run up to SHEET_SYNC_JITTER seconds later, so
+    by default the lock is held for that long after finishing, to stop them
+    repeating it.
+    """
+    if locked_until is None:
+        locked_until = datetime.now() + timedelta(seconds=SHEET_SYNC_JITTER)
+
+    locks = SheetSyncLock.__table__
+    db.session.execute(
+        locks.update()
+        .where(locks.c.job_id == job_id)
+        .where(locks.c.owner == LOCK_OWNER)
+        .values(locked_until=locked_until)
+    )
+    db.session.commit()
+
+
+def scheduled_job_lock_id(name):
+    """The lock row for a scheduled job that isn't a sheet sync. They share the table."""
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"flashcards:scheduled-job:{name}")
+
+
+def run_on_one_replica(name, interval, func):
+    """Call func, unless another replica already ran this interval job in the last interval.
+
+    Each replica's scheduler fires interval jobs on its own clock, so the lock is
+    held for a whole interval from when the run started, not just while it runs.
+    Returns what func did, or None if it was skipped. Needs an app context.
+    """
+    lock_id = scheduled_job_lock_id(name)
+    if not acquire_sync_lock(lock_id, ttl=max(SHEET_SYNC_LOCK_TTL, interval)):
+        logger.debug(f"Scheduled job {name} already ran on another replica, skipping")
+        return None
+
+    started = datetime.now()
+    try:
+        return func()
+    finally:
+        db.session.rollback()
+        release_sync_lock(lock_id, locked_until=started + interval)
@@ -0,0 +1,206 @@
+"""Incremental sync of cards from a spreadsheet.
+
+Each sync job remembers the revision of the sheet it last saw, and a hash of
+every row it turned into a card. A sync is skipped outright when the revision
+hasn't moved, and otherwise only writes the rows that were added, changed or
+removed since last time.
+
+Where the rows come from is abstracted behind SheetSource, so the engine can
+be run against a FakeSheetSource without any Google credentials.
+"""
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import tuple_, update
+
+from database.db_interface import db
+from database.group_versions import mark_group_changed
+from database.sync_log import record_deleted_cards
+from database.uuids import uuid7
+from database.db_types import (
+    Card, CardDistractor, SheetSyncRow, UserCardData, card_content_hash
+)
+from llm.distractor_worker import distractor_worker
+from study.card_index import card_index
+
+
+class SheetSource:
+    """Somewhere a sync job can read rows of (question, correct_answer) from"""
+
+    def revision(self):
+        """An opaque marker that changes whenever the sheet does, or None if it can't be known cheaply"""
+        return None
+
+    def rows(self):
+        raise NotImplementedError
+
+
+class FakeSheetSource(SheetSource):
+    """An in-memory sheet, for running syncs locally"""
+
+    def __init__(self, rows, revision=None):
+        self._rows = [list(row) for row in rows]
+        self._revision = revision
+        self.fetches = 0
+
+    def set_rows(self, rows, revision=None):
+        self._rows = [list(row) for row in rows]
+        self._revision = revision
+
+    def revision(self):
+        return self._revision
+
+    def rows(self):
+        self.fetches += 1
+        return [list(row) for row in self._rows]
+
+
+def question_hash(question):
+    return hashlib.sha256(question.encode("utf-8")).hexdigest()
+
+
+def sync_sheet(job, source, force=False):
+    """Bring the cards of a job's group in line with its sheet.
+
+    Rows are matched to cards by question. Cards made from rows that have since
+    been removed from the sheet are deleted; cards that were added some other
+    way are left alone.
+
+    Returns counts of what was done, for logging.
+    """
+    result = {'skipped': False, 'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    revision = source.revision()
+    if not force and revision is not None and revision == job.last_revision:
+        result['skipped'] = True
+        return result
+
+    rows = source.rows()
+    # check every row has exactly 2 columns
+    if any(len(row) != 2 for row in rows):
+        raise ValueError("Each row must have exactly 2 columns")
+
+    # If a question appears more than once, the last row wins
+    sheet = {question_hash(question): (question, correct_answer) for question, correct_answer in rows}
+
+    tracked = {
+        row.question_hash: (row.card_id, row.content_hash)
+        for row in db.session.query(SheetSyncRow.question_hash, SheetSyncRow.card_id, SheetSyncRow.content_hash)
+        .filter(SheetSyncRow.job_id == job.job_id)
+    }
+    if not tracked:
+        tracked = adopt_existing_cards(job, sheet)
+
+    new_cards = []
+    new_rows = []
+    card_updates = []
+    row_updates = []
+    for key, (question, correct_answer) in sheet.items():
+        content_hash = card_content_hash(question, correct_answer)
+
+        if key not in tracked:
+            card_id = uuid7()
+            new_cards.append({
+                'card_id': card_id,
+                'question': question,
+                'correct_answer': correct_answer,
+                'group_id': job.group_id,
+                'creator_id': job.creator_id,
+                'updated_by_id': job.creator_id,
+            })
+            new_rows.append({
+                'job_id': job.job_id,
+                'question_hash': key,
+                'card_id': card_id,
+                'content_hash': content_hash,
+            })
+            continue
+
+        card_id, last_hash = tracked[key]
+        if last_hash == content_hash:
+            result['unchanged'] += 1
+            continue
+
+        card_updates.append({
+            'card_id': card_id,
+            'correct_answer': correct_answer,
+            'updated_by_id': job.creator_id,
+        })
+        row_updates.append({
+            'job_id': job.job_id,
+            'question_hash': key,
+            'content_hash': content_hash,
+        })
+
+    removed_card_ids = [card_id for key, (card_id, _) in tracked.items() if key not in sheet]
+
+    if new_cards:
+        db.session.execute(Card.__table__.insert(), new_cards)
+        db.session.execute(SheetSyncRow.__table__.insert(), new_rows)
+
+    if card_updates:
+        # Bulk UPDATEs by primary key skip the ORM events, so clear out stale distractors here
+        db.session.execute(update(Card), card_updates)
+        db.session.execute(update(SheetSyncRow), row_updates)
+        current = [(card['card_id'], row['content_hash']) for card, row in zip(card_updates, row_updates)]
+        db.session.execute(
+            CardDistractor.__table__.delete()
+            .where(CardDistractor.card_id.in_([card_id for card_id, _ in current]))
+            .where(tuple_(CardDistractor.card_id, CardDistractor.content_hash).not_in(current))
+        )
+
+    if removed_card_ids:
+        delete_cards(removed_card_ids)
+        mark_group_changed(job.group_id)
+
+    job.last_revision = revision
+    job.last_synced = datetime.now()
+    db.session.commit()
+    if new_cards or removed_card_ids:
+        card_index.invalidate(job.group_id)
+
+    result['inserted'] = len(new_cards)
+    result['updated'] = len(card_updates)
+    result['deleted'] = len(removed_card_ids)
+
+    # New and edited cards need fresh incorrect answers
+    distractor_worker.enqueue(
+        [card['card_id'] for card in new_cards] + [card['card_id'] for card in card_updates]
+    )
+
+    return result
+
+
+def adopt_existing_cards(job, sheet):
+    """On a job's first sync, take ownership of cards in the group that already match a row.
+
+    Without this, jobs that were synced before rows were tracked would duplicate every card.
+    """
+    existing = (
+        db.session.query(Card.card_id, Card.question, Card.correct_answer)
+        .filter(Card.group_id == job.group_id)
+    )
+
+    tracked = {}
+    for card in existing:
+        key = question_hash(card.question)
+        if key in sheet and key not in tracked:
+            tracked[key] = (card.card_id, card_content_hash(card.question, card.correct_answer))
+
+    if tracked:
+        db.session.execute(SheetSyncRow.__table__.insert(), [{
+            'job_id': job.job_id,
+            'question_hash': key,
+            'card_id': card_id,
+            'content_hash': content_hash,
+        } for key, (card_id, content_hash) in tracked.items()])
+
+    return tracked
+
+
+def delete_cards(card_ids):
+    """Delete cards, and everything that hangs off them, without loading them into the session"""
+    record_deleted_cards(card_ids)
+    for table in (CardDistractor.__table__, SheetSyncRow.__table__, UserCardData.__table__):
+        db.session.execute(table.delete().where(table.c.card_id.in_(card_ids)))
+    db.session.execute(Card.__table__.delete().where(Card.card_id.in_(card_ids)))
@@ -1,30 +1,28 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-import uuid
+import hashlib
 
-from llm.llm import get_incorrect_answer
+from database.uuids import BinaryUUID, uuid7
 
-# Initialize the SQLAlchemy object without an app
-db = SQLAlchemy(
-    engine_options={
-        "pool_recycle": 3600,
-    }
-)
+# Initialize the SQLAlchemy object without an app. Engine options are set by create_app, see database/pool.py
+db = SQLAlchemy()
 
 # Association table for the many-to-many relationship between Users and Groups
 user_group = db.Table('user_group',
-    db.Column('user_id', db.UUID, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('group_id', db.UUID, db.ForeignKey('group.group_id'), primary_key=True)
+    db.Column('user_id', BinaryUUID, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('group_id', BinaryUUID, db.ForeignKey('group.group_id'), primary_key=True),
+    # The primary key covers a user's groups. This covers a group's subscribers.
+    db.Index('ix_user_group_group_id', 'group_id'),
 )
 
 class User(db.Model):
     __tablename__ = 'user'
-    id = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
+    id = db.Column(BinaryUUID, primary_key=True, default=uuid7)
     username = db.Column(db.String(256), unique=True, nullable=False)
     email = db.Column(db.String(256), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
-    time_created = db.Column(db.DateTime, default=lambda: datetime.now().isoformat())
-    time_updated = db.Column(db.DateTime, default=lambda: datetime.now().isoformat(), onupdate=lambda: datetime.now().isoformat())
+    time_created = db.Column(db.DateTime, default=datetime.now)
+    time_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
     # Relationships
     cards_created = db.relationship('Card', backref='creator', lazy=True, foreign_keys='Card.creator_id')
@@ -34,10 +32,18 @@ class User(db.Model):
 
 class Group(db.Model):
     __tablename__ = 'group'
-    group_id = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
-    creator_id = db.Column(db.UUID, db.ForeignKey('user.id'), nullable=False)
-    time_created = db.Column(db.DateTime, default=lambda: datetime.now().isoformat())
-    time_updated = db.Column(db.DateTime, default=lambda: datetime.now().isoformat(), onupdate=lambda: datetime.now().isoformat())
+    __table_args__ = (
+        # Backs group search on MySQL. Elsewhere, search uses an in-process index instead.
+        db.Index('ft_group_group_name', 'group_name', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        # Exact and prefix matches on the name, e.g. checking a name is free
+        db.Index('ix_group_group_name', 'group_name'),
+        db.Index('ix_group_creator_id', 'creator_id'),
+    )
+
+    group_id = db.Column(BinaryUUID, primary_key=True, default=uuid7)
+    creator_id = db.Column(BinaryUUID, db.ForeignKey('user.id'), nullable=False)
+    time_created = db.Column(db.DateTime, default=datetime.now)
+    time_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     group_name = db.Column(db.String(256), nullable=False)
 
     # Relationships
@@ -46,46 +52,160 @@ class Group(db.Model):
 
 class Card(db.Model):
     __tablename__ = 'card'
-    card_id = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
+    __table_args__ = (
+        db.Index('ft_card_question_correct_answer', 'question', 'correct_answer', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        # A group's cards, and those changed since a point in time (group versions, delta sync)
+        db.Index('ix_card_group_id_time_updated', 'group_id', 'time_updated'),
+        db.Index('ix_card_creator_id', 'creator_id'),
+    )
+
+    card_id = db.Column(BinaryUUID, primary_key=True, default=uuid7)
     question = db.Column(db.Text, nullable=False)
     correct_answer = db.Column(db.Text, nullable=False)
     # incorrect_answer = db.Column(db.Text)
-    group_id = db.Column(db.UUID, db.ForeignKey('group.group_id'), nullable=False)
-    creator_id = db.Column(db.UUID, db.ForeignKey('user.id'), nullable=False)
-    time_created = db.Column(db.DateTime, default=lambda: datetime.now().isoformat())
-    time_updated = db.Column(db.DateTime, default=lambda: datetime.now().isoformat(), onupdate=lambda: datetime.now().isoformat())
-    updated_by_id = db.Column(db.UUID, db.ForeignKey('user.id'))
+    group_id = db.Column(BinaryUUID, db.ForeignKey('group.group_id'), nullable=False)
+    creator_id = db.Column(BinaryUUID, db.ForeignKey('user.id'), nullable=False)
+    time_created = db.Column(db.DateTime, default=datetime.now)
+    time_updated = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    updated_by_id = db.Column(BinaryUUID, db.ForeignKey('user.id'))
 
     # Relationships
     updated_by = db.relationship('User', foreign_keys=[updated_by_id], backref='cards_updated')
-    user_data = db.relationship('UserCardData', backref='card', lazy='dynamic')
+    user_data = db.relationship('UserCardData', backref='card', lazy='dynamic', cascade='all, delete-orphan')
+    distractors = db.relationship('CardDistractor', backref='card', lazy='dynamic', cascade='all, delete-orphan')
+    sheet_rows = db.relationship('SheetSyncRow', backref='card', lazy='dynamic', cascade='all, delete-orphan')
+
+    @property
+    def content_hash(self):
+        return card_content_hash(self.question, self.correct_answer)
 
-    # Property to generate incorrect_answer dynamically
+    # Incorrect answers are generated ahead of time and stored in the distractor table.
+    # Reading this never calls out to the LLM - if nothing has been generated yet, it's empty.
     @property
     def incorrect_answer(self):
-        try:
-            return get_incorrect_answer(self.question, self.correct_answer)
-        except Exception as e:
+        distractor = self.distractors.filter_by(content_hash=self.content_hash).first()
+        if not distractor:
             return ""
+        return distractor.incorrect_answer
+
+
+def card_content_hash(question, correct_answer):
+    """Hash of the parts of a card that a distractor depends on"""
+    content = f"{question}\0{correct_answer}".encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class CardDistractor(db.Model):
+    __tablename__ = 'card_distractor'
+    card_id = db.Column(BinaryUUID, db.ForeignKey('card.card_id'), primary_key=True)
+    content_hash = db.Column(db.String(64), primary_key=True)
+    incorrect_answer = db.Column(db.Text, nullable=False)
+    time_created = db.Column(db.DateTime, default=datetime.now)
+
+
+# When the question or answer of a card changes, any stored distractors are stale.
+@db.event.listens_for(Card, 'after_update')
+def invalidate_card_distractors(mapper, connection, card):
+    state = db.inspect(card)
+    if not (state.attrs.question.history.has_changes() or state.attrs.correct_answer.history.has_changes()):
+        return
+
+    distractors = CardDistractor.__table__
+    connection.execute(
+        distractors.delete()
+        .where(distractors.c.card_id == card.card_id)
+        .where(distractors.c.content_hash != card.content_hash)
+    )
 
 class UserCardData(db.Model):
     __tablename__ = 'user_card_data'
-    user_id = db.Column(db.UUID, db.ForeignKey('user.id'), primary_key=True, default=uuid.uuid4)
-    card_id = db.Column(db.UUID, db.ForeignKey('card.card_id'), primary_key=True)
-    times_answered = db.Column(db.UUID, default=0)
-    times_answered_incorrectly = db.Column(db.UUID, default=0)
+    __table_args__ = (
+        # Finding a user's next due card is a range scan on this
+        db.Index('ix_user_card_data_user_id_due_at', 'user_id', 'due_at'),
+        # The primary key leads with user_id. Deleting a card finds its rows with this.
+        db.Index('ix_user_card_data_card_id', 'card_id'),
+    )
+
+    user_id = db.Column(BinaryUUID, db.ForeignKey('user.id'), primary_key=True, default=uuid7)
+    card_id = db.Column(BinaryUUID, db.ForeignKey('card.card_id'), primary_key=True)
+    times_answered = db.Column(db.Integer, default=0)
+    times_answered_incorrectly = db.Column(db.Integer, default=0)
     last_seen = db.Column(db.DateTime)
 
+    # Spaced repetition (SM-2) schedule
+    ease_factor = db.Column(db.Float, default=2.5)
+    interval_days = db.Column(db.Float, default=0)
+    repetitions = db.Column(db.Integer, default=0)
+    due_at = db.Column(db.DateTime)
+
 class SheetSyncJob(db.Model):
     __tablename__ = 'sheet_sync_job'
+    __table_args__ = (
+        db.Index('ix_sheet_sync_job_group_id', 'group_id'),
+    )
 
-    job_id = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
-    group_id = db.Column(db.UUID, db.ForeignKey('group.group_id'), nullable=False)
-    creator_id = db.Column(db.UUID, db.ForeignKey('user.id'), nullable=False)
+    job_id = db.Column(BinaryUUID, primary_key=True, default=uuid7)
+    group_id = db.Column(BinaryUUID, db.ForeignKey('group.group_id'), nullable=False)
+    creator_id = db.Column(BinaryUUID, db.ForeignKey('user.id'), nullable=False)
 
     sheet_id = db.Column(db.Text, nullable=False)
     sheet_range = db.Column(db.Text, nullable=False)
 
     cron_string = db.Column(db.Text, nullable=True)
 
-    time_created = db.Column(db.DateTime, default=lambda: datetime.now().isoformat())
+    # Revision of the sheet as of the last sync. If it hasn't moved, there's nothing to do.
+    last_revision = db.Column(db.Text, nullable=True)
+    last_synced = db.Column(db.DateTime, nullable=True)
+
+    time_created = db.Column(db.DateTime, default=datetime.now)
+
+    rows = db.relationship('SheetSyncRow', backref='job', lazy='dynamic', cascade='all, delete-orphan')
+
+
+# The card each row of a synced sheet became, and the content it had at the last sync.
+# Rows are keyed on a hash of the question, since that's how rows are matched to cards.
+class SheetSyncRow(db.Model):
+    __tablename__ = 'sheet_sync_row'
+    __table_args__ = (
+        # Deleting a card finds its rows with this
+        db.Index('ix_sheet_sync_row_card_id', 'card_id'),
+    )
+    job_id = db.Column(BinaryUUID, db.ForeignKey('sheet_sync_job.job_id'), primary_key=True)
+    question_hash = db.Column(db.String(64), primary_key=True)
+    card_id = db.Column(BinaryUUID, db.ForeignKey('card.card_id'), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+
+
+# Held by whichever replica is running a sheet sync, so only one of them does
+class SheetSyncLock(db.Model):
+    __tablename__ = 'sheet_sync_lock'
+    job_id = db.Column(BinaryUUID, primary_key=True)
+    owner = db.Column(db.String(256), nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=False)
+
+
+# Cards that have been deleted, so that clients syncing with a cursor can be told to drop them.
+# Neither id is a foreign key: both the card and (later) its group are gone. See database/sync_log.py
+class CardTombstone(db.Model):
+    __tablename__ = 'card_tombstone'
+    __table_args__ = (
+        db.Index('ix_card_tombstone_group_id_time_deleted', 'group_id', 'time_deleted'),
+    )
+
+    card_id = db.Column(BinaryUUID, primary_key=True)
+    group_id = db.Column(BinaryUUID, nullable=False)
+    time_deleted = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+# A user joining or leaving a group. Deleting a group counts as all of its subscribers leaving it.
+class MembershipEvent(db.Model):
+    __tablename__ = 'membership_event'
+    __table_args__ = (
+        db.Index('ix_membership_event_user_id_time', 'user_id', 'time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(BinaryUUID, nullable=False)
+    group_id = db.Column(BinaryUUID, nullable=False)
+    joined = db.Column(db.Boolean, nullable=False)
+    time = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -0,0 +1,58 @@
+"""The version of a group's cards, for caching responses built from them.
+
+A group's version is its own time_updated, plus the number of cards in it and
+the latest time_updated among them, all read with one aggregate query. Adding,
+editing or deleting a card changes at least one of those, so anything built
+from the cards of a version can be reused until the version changes.
+
+Deleting a card only lowers the count, and can leave the latest time_updated
+earlier than it was. Its Last-Modified would then go backwards, and clients
+validating with If-Modified-Since alone would keep their stale copy. So
+anything that deletes cards must call mark_group_changed as well.
+
+Timestamps are only stored to the second, so two changes within the same
+second can share a version. Versions that are that fresh aren't settled (see
+utils/http_cache.py), and shouldn't be cached.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import func, update
+
+from database.db_interface import db
+from database.db_types import Card, Group
+from utils.http_cache import is_settled
+
+
+class GroupVersion(namedtuple('GroupVersion', ['group_updated', 'card_count', 'cards_updated'])):
+
+    @property
+    def last_modified(self):
+        return max(filter(None, (self.group_updated, self.cards_updated)), default=None)
+
+    @property
+    def settled(self):
+        return is_settled(self.last_modified)
+
+
+def get_group_version(group_id):
+    """The GroupVersion of a group, or None if there's no such group"""
+    row = (
+        db.session.query(
+            Group.time_updated,
+            func.count(Card.card_id),
+            func.max(Card.time_updated),
+        )
+        .outerjoin(Card, Card.group_id == Group.group_id)
+        .filter(Group.group_id == group_id)
+        .group_by(Group.group_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return GroupVersion(*row)
+
+
+def mark_group_changed(group_id):
+    """Move a group's time_updated on, for changes its cards' timestamps don't show, like deletions"""
+    db.session.execute(update(Group).where(Group.group_id == group_id).values(time_updated=datetime.now()))
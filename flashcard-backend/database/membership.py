@@ -0,0 +1,49 @@
+"""Is user U subscribed to group G?
+
+Answered with a single EXISTS query on the user_group primary key, and
+cached across requests. Only positive answers are cached: joining a group
+takes effect straight away in every process, and leaving a group takes
+effect straight away in this process, and within MEMBERSHIP_CACHE_TTL
+seconds in the others.
+"""
+import os
+
+from sqlalchemy import exists
+
+from database.db_interface import db
+from database.db_types import user_group
+from utils.cache import TTLCache, MISSING
+
+MEMBERSHIP_CACHE_TTL = float(os.getenv('MEMBERSHIP_CACHE_TTL', 30))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', 100000))
+
+membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
+
+def is_member(user_id, group_id):
+    key = (user_id, group_id)
+    if membership_cache.get(key) is not MISSING:
+        return True
+
+    subscribed = db.session.query(
+        exists().where(
+            user_group.c.user_id == user_id,
+            user_group.c.group_id == group_id,
+        )
+    ).scalar()
+
+    if subscribed:
+        membership_cache.set(key, True)
+    return subscribed
+
+
+def invalidate_membership(user_id=None, group_id=None):
+    """Forget cached memberships for a user, a group, or one user in one group"""
+    if user_id is not None and group_id is not None:
+        membership_cache.delete((user_id, group_id))
+    elif group_id is not None:
+        membership_cache.delete_where(lambda key: key[1] == group_id)
+    elif user_id is not None:
+        membership_cache.delete_where(lambda key: key[0] == user_id)
+    else:
+        membership_cache.clear()
@@ -0,0 +1,185 @@
+"""Connection pool sizing and instrumentation.
+
+Every gunicorn worker has its own pool, so the database sees up to
+    workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+connections from the web servers, plus the scheduler process. Size
+max_connections on the database for that.
+
+By default a worker keeps one connection per request thread, plus one for the
+answer buffer, and can overflow by one per distractor thread (which hold a
+connection while they wait on the model).
+
+Stats are per process. Slow queries are logged with the endpoint that ran
+them, or the thread name for background work.
+"""
+import os
+import threading
+import time
+from collections import deque
+from logging import getLogger
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = getLogger()
+
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+DISTRACTOR_MAX_WORKERS = int(os.getenv('DISTRACTOR_MAX_WORKERS', 8))
+
+# Blank means "work it out from the thread counts"
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or GUNICORN_THREADS + 1)
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW') or DISTRACTOR_MAX_WORKERS)
+# Seconds to wait for a connection before giving up with an error
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+# Seconds before a connection is replaced. Keep it under the server's wait_timeout
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))
+# Check connections are alive before handing them out
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+# Queries slower than this are logged
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 500))
+
+RECENT_SLOW_QUERIES = 50
+RECENT_WAITS = 1000
+
+
+class PoolStats:
+    """Counters for connection checkouts and slow queries in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=RECENT_WAITS)
+        self.slow_queries = 0
+        self.recent_slow_queries = deque(maxlen=RECENT_SLOW_QUERIES)
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_waits.append(wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_slow_query(self, source, duration, statement):
+        with self._lock:
+            self.slow_queries += 1
+            self.recent_slow_queries.append({
+                'source': source,
+                'duration': round(duration, 4),
+                'statement': statement,
+            })
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self.recent_waits)
+            stats = {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_wait': round(self.total_wait / self.checkouts, 4) if self.checkouts else 0.0,
+                'p99_wait': round(waits[int(0.99 * (len(waits) - 1))], 4) if waits else 0.0,
+                'max_wait': round(self.max_wait, 4),
+                'slow_queries': self.slow_queries,
+                'recent_slow_queries': list(self.recent_slow_queries),
+            }
+
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'pool_size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                # Negative until the pool has opened pool_size connections
+                'overflow': pool.overflow(),
+            })
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited, and how many timed out"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            logger.warning(
+                f"Timed out after {self._timeout}s waiting for a database connection "
+                f"({self.checkedout()} checked out, pool size {self.size()}, overflow {self.overflow()})"
+            )
+            raise
+        pool_stats.record_checkout(time.perf_counter() - started)
+        pool_stats.pool = self
+        return connection
+
+    def recreate(self):
+        # dispose() swaps the pool for a new one - keep the stats pointing at the live pool
+        new_pool = super().recreate()
+        pool_stats.pool = new_pool
+        return new_pool
+
+
+def engine_options(database_uri):
+    """Options for create_engine, for the given database"""
+    options = {
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    # SQLite (local development) picks its own pool
+    if database_uri.startswith('sqlite'):
+        return options
+
+    options.update({
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    })
+    return options
+
+
+def query_source():
+    """The endpoint running the current query, or the thread for background work"""
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_started'].pop()
+    if duration * 1000 < DB_SLOW_QUERY_MS:
+        return
+
+    source = query_source()
+    statement = ' '.join(statement.split())[:500]
+    pool_stats.record_slow_query(source, duration, statement)
+    logger.warning(f"Slow query ({duration * 1000:.0f}ms) from {source}: {statement}")
+
+
+@event.listens_for(Engine, 'handle_error')
+def _drop_query_timer(exception_context):
+    # Failed queries never reach after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
@@ -0,0 +1,59 @@
+"""Usernames (and emails) of users, looked up by id.
+
+Lists of cards and groups only carry creator ids, so the frontend resolves
+them in bulk. Profiles are read through a per-process cache, and the ones
+that aren't cached are fetched with chunked IN queries - so resolving a few
+hundred creators takes one query, or none.
+
+Users that don't exist aren't cached, so a user that registers later is
+found straight away. Anything that changes a username or email must call
+invalidate_profile.
+"""
+import os
+
+from database.db_interface import db
+from database.db_types import User
+from utils.cache import TTLCache, MISSING
+
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', 300))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 100000))
+# Ids per IN query. Keeps the statement (and the database's plan for it) a reasonable size
+PROFILE_QUERY_CHUNK_SIZE = int(os.getenv('PROFILE_QUERY_CHUNK_SIZE', 500))
+
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+
+def get_profiles(user_ids):
+    """{user_id: {'username', 'email', 'user_id'}} for those of the given UUIDs that exist"""
+    profiles = {}
+    missing = []
+    for user_id in set(user_ids):
+        profile = profile_cache.get(user_id)
+        if profile is MISSING:
+            missing.append(user_id)
+        else:
+            profiles[user_id] = profile
+
+    for start in range(0, len(missing), PROFILE_QUERY_CHUNK_SIZE):
+        chunk = missing[start:start + PROFILE_QUERY_CHUNK_SIZE]
+        rows = db.session.execute(
+            db.select(User.id, User.username, User.email).where(User.id.in_(chunk))
+        )
+        for row in rows:
+            profile = {
+                'username': row.username,
+                'email': row.email,
+                'user_id': row.id,
+            }
+            profile_cache.set(row.id, profile)
+            profiles[row.id] = profile
+
+    return profiles
+
+
+def invalidate_profile(user_id=None):
+    """Forget a cached profile, or all of them"""
+    if user_id is None:
+        profile_cache.clear()
+    else:
+        profile_cache.delete(user_id)
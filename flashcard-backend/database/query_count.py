@@ -0,0 +1,138 @@
+"""Counting the queries made by each request, to catch N+1 queries.
+
+Every request's queries are counted, including those made while a streamed
+response is being sent.
+ - @query_budget(n) on a view says it should make at most n queries. Requests
+   that go over are logged, with the statement that was repeated the most.
+   With QUERY_BUDGET_STRICT on (for development), the query that goes over
+   the budget raises QueryBudgetExceeded instead. A view whose queries grow
+   with its input, e.g. one per chunk of ids, can raise its budget for the
+   request with extend_query_budget(n).
+ - With QUERY_COUNT_HEADER on, responses carry an X-Query-Count header with
+   the number of queries made before the body was sent.
+ - count_queries() counts the queries in a block of code, for scripts:
+
+       with count_queries(max_queries=2) as counter:
+           client.get('/api/groups', headers=headers)
+"""
+import functools
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from logging import getLogger
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = getLogger()
+
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER', 'false').lower() == 'true'
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+# Requests to views without a budget are logged if they make more queries than this
+QUERY_COUNT_WARN = int(os.getenv('QUERY_COUNT_WARN', 50))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self, max_queries=None, strict=False):
+        self.max_queries = max_queries
+        self.strict = strict
+        self.count = 0
+        self.statements = Counter()
+
+    def add(self, statement):
+        self.count += 1
+        self.statements[statement] += 1
+        if self.strict and self.over_budget():
+            raise QueryBudgetExceeded(self.describe())
+
+    def over_budget(self):
+        return self.max_queries is not None and self.count > self.max_queries
+
+    def describe(self):
+        statement, times = self.statements.most_common(1)[0] if self.statements else ('', 0)
+        statement = ' '.join(statement.split())[:300]
+        budget = f" (budget {self.max_queries})" if self.max_queries is not None else ''
+        return f"{self.count} queries{budget}, most repeated ({times}x): {statement}"
+
+
+_local = threading.local()
+
+
+@contextmanager
+def count_queries(max_queries=None):
+    """Count the queries made on this thread inside the block. Raises QueryBudgetExceeded at the end if it went over max_queries."""
+    counter = QueryCounter(max_queries)
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+    # Checked at the end rather than on the query that goes over, which a view could swallow as a 500
+    if counter.over_budget():
+        raise QueryBudgetExceeded(counter.describe())
+
+
+def query_budget(max_queries):
+    """Decorator for views, giving the most queries a request should make"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            counter = g.get('query_counter')
+            if counter is not None:
+                counter.max_queries = max_queries
+                counter.strict = QUERY_BUDGET_STRICT
+                if counter.strict and counter.over_budget():
+                    raise QueryBudgetExceeded(counter.describe())
+            return view(*args, **kwargs)
+
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+def extend_query_budget(max_queries):
+    """Let the current request make up to max_queries, if that's more than its view's @query_budget"""
+    counter = g.get('query_counter') if has_request_context() else None
+    if counter is not None and counter.max_queries is not None:
+        counter.max_queries = max(counter.max_queries, max_queries)
+
+
+def start_request_counter():
+    g.query_counter = QueryCounter()
+
+
+def check_request_counter(response):
+    counter = g.get('query_counter')
+    if counter is None:
+        return response
+
+    if QUERY_COUNT_HEADER:
+        response.headers['X-Query-Count'] = str(counter.count)
+
+    endpoint = request.endpoint
+
+    # Streamed responses are still making queries, so wait until they're done
+    def check():
+        if counter.over_budget() or (counter.max_queries is None and counter.count > QUERY_COUNT_WARN):
+            logger.warning(f"Too many queries from {endpoint}: {counter.describe()}")
+
+    response.call_on_close(check)
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.add(statement)
+    if has_request_context():
+        counter = g.get('query_counter')
+        if counter is not None:
+            counter.add(statement)
@@ -0,0 +1,279 @@
+"""Checking that the queries behind each endpoint use an index.
+
+Each endpoint in ENDPOINTS is called through the app's test client, every
+statement it runs is recorded, and each one is EXPLAINed against the same
+database. A statement that reads a whole table - type ALL on MySQL, a plain
+SCAN on SQLite - is a failure, unless that's listed in ALLOWED_SCANS.
+
+Plans depend on table sizes, so seed() the database with a few thousand
+cards first. tests/test_query_plans.py does this against the test database,
+and benchmarks/query_plans.py against any database, at any size.
+"""
+import random
+import re
+import uuid
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from database.db_interface import db
+from database.db_types import (
+    Card, CardDistractor, CardTombstone, Group, MembershipEvent, User, UserCardData,
+    card_content_hash, user_group,
+)
+from database.sync_log import make_cursor
+
+# Endpoints, and the parts of the path filled in from the seeded data
+ENDPOINTS = [
+    ("GET", "/api/user/groups"),
+    ("GET", "/api/user/details?user_ids={user_id}"),
+    ("GET", "/api/groups?limit=50"),
+    ("GET", "/api/groups?limit=50&after={group_id}"),
+    ("GET", "/api/groups/{group_id}"),
+    ("GET", "/api/groups/{group_id}/cards"),
+    ("GET", "/api/groups/{group_id}/cards?limit=50&after={card_id}"),
+    ("GET", "/api/cards"),
+    ("GET", "/api/cards?limit=50&after={card_id}"),
+    ("GET", "/api/cards/{card_id}"),
+    ("GET", "/api/cards/flashcard"),
+    ("GET", "/api/cards/flashcard?mode=review"),
+    ("GET", "/api/cards/session"),
+    ("GET", "/api/cards/session?mode=random"),
+    ("GET", "/api/sync"),
+    ("GET", "/api/sync?since={cursor}"),
+    ("POST", "/api/groups/{other_group_id}/join"),
+    ("POST", "/api/groups/{other_group_id}/leave"),
+    ("PUT", "/api/cards/{card_id}"),
+    ("DELETE", "/api/cards/{deleted_card_id}"),
+]
+
+# (endpoint, table): why reading the whole table is fine there
+ALLOWED_SCANS = {
+}
+
+PLAN_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'INSERT')
+
+
+def seed(users, groups, cards, subscriptions, seed=0):
+    """Fill the database with synthetic data. Returns the id of the user to run as."""
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    def some_time():
+        return now - timedelta(seconds=rng.randrange(90 * 24 * 60 * 60))
+
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    db.session.execute(User.__table__.insert(), [{
+        'id': user_id,
+        'username': f"plans-{user_id.hex[:12]}",
+        'email': f"plans-{user_id.hex[:12]}@example.com",
+        'password_hash': "-",
+    } for user_id in user_ids])
+
+    group_ids = [uuid.uuid4() for _ in range(groups)]
+    db.session.execute(Group.__table__.insert(), [{
+        'group_id': group_id,
+        'creator_id': rng.choice(user_ids),
+        'group_name': f"plans-{group_id.hex[:12]}",
+        'time_created': some_time(),
+        'time_updated': some_time(),
+    } for group_id in group_ids])
+
+    memberships = {
+        (user_id, group_id)
+        for user_id in user_ids
+        for group_id in rng.sample(group_ids, min(subscriptions, groups))
+    }
+    db.session.execute(user_group.insert(), [
+        {'user_id': user_id, 'group_id': group_id} for user_id, group_id in memberships
+    ])
+    db.session.execute(MembershipEvent.__table__.insert(), [
+        {'user_id': user_id, 'group_id': group_id, 'joined': True, 'time': some_time()}
+        for user_id, group_id in memberships
+    ])
+
+    card_rows = []
+    for _ in range(cards):
+        question = f"question {rng.getrandbits(64):x}"
+        time_updated = some_time()
+        card_rows.append({
+            'card_id': uuid.uuid4(),
+            'question': question,
+            'correct_answer': "answer",
+            'group_id': rng.choice(group_ids),
+            'creator_id': rng.choice(user_ids),
+            'updated_by_id': rng.choice(user_ids),
+            'time_created': time_updated,
+            'time_updated': time_updated,
+        })
+    for start in range(0, len(card_rows), 5000):
+        db.session.execute(Card.__table__.insert(), card_rows[start:start + 5000])
+
+    db.session.execute(CardDistractor.__table__.insert(), [{
+        'card_id': card['card_id'],
+        'content_hash': card_content_hash(card['question'], card['correct_answer']),
+        'incorrect_answer': "wrong",
+    } for card in card_rows])
+
+    # Some review history for every user, in the groups they're subscribed to
+    subscribed = {}
+    for user_id, group_id in memberships:
+        subscribed.setdefault(user_id, set()).add(group_id)
+    history = [{
+        'user_id': user_id,
+        'card_id': card['card_id'],
+        'times_answered': 1,
+        'times_answered_incorrectly': 0,
+        'last_seen': some_time(),
+        'due_at': some_time() + timedelta(days=60),
+    } for user_id in user_ids for card in rng.sample(card_rows, min(500, cards))
+        if card['group_id'] in subscribed.get(user_id, ())]
+    if history:
+        db.session.execute(UserCardData.__table__.insert(), history)
+
+    db.session.execute(CardTombstone.__table__.insert(), [{
+        'card_id': uuid.uuid4(),
+        'group_id': rng.choice(group_ids),
+        'time_deleted': some_time(),
+    } for _ in range(cards // 10)])
+
+    db.session.commit()
+
+    # Run as whoever has the most cards to look at
+    return max(user_ids, key=lambda user_id: len(subscribed.get(user_id, ())))
+
+
+def endpoint_arguments(user_id):
+    """Values for the placeholders in ENDPOINTS, for a user with at least one card"""
+    group_ids = db.session.scalars(
+        db.select(user_group.c.group_id).where(user_group.c.user_id == user_id)
+    ).all()
+    card_ids = db.session.scalars(
+        db.select(Card.card_id).where(Card.group_id.in_(group_ids)).order_by(Card.card_id).limit(2)
+    ).all()
+    if len(card_ids) < 2:
+        raise ValueError(f"User {user_id} needs at least two cards in their groups")
+    group_id = db.session.scalar(db.select(Card.group_id).where(Card.card_id == card_ids[0]))
+    other_group_id = db.session.scalar(
+        db.select(Group.group_id).where(Group.group_id.not_in(group_ids)).limit(1)
+    )
+
+    return {
+        'user_id': user_id,
+        'group_id': group_id,
+        'other_group_id': other_group_id or group_id,
+        'card_id': card_ids[0],
+        'deleted_card_id': card_ids[1],
+        'cursor': make_cursor(datetime.now() - timedelta(days=1)),
+    }
+
+
+class StatementRecorder:
+    """Every statement run on the engine, tagged with the endpoint that ran it"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.endpoint = None
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        # EXPLAIN takes one set of parameters, and bulk INSERT ... VALUES don't read anything
+        if executemany or self.endpoint is None:
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if verb not in PLAN_STATEMENTS or (verb == 'INSERT' and 'SELECT' not in statement.upper()):
+            return
+        self.statements.append((self.endpoint, statement, parameters))
+
+
+def full_scans(connection, statement, parameters, tables):
+    """Names of the tables the statement reads in full"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        scans = set()
+        for row in plan:
+            # SEARCH uses an index, SCAN ... USING [COVERING] INDEX walks one in order
+            match = re.match(r'SCAN (?:TABLE )?"?(\w+)"?(?: AS \w+)?$', row[-1])
+            if match:
+                scans.add(match.group(1))
+        return {table for table in scans if table in tables}
+
+    if dialect in ('mysql', 'mariadb'):
+        plan = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+        return {row['table'] for row in plan if row['type'] == 'ALL' and row['table'] in tables}
+
+    raise ValueError(f"Don't know how to read query plans from {dialect}")
+
+
+def sorts(connection, statement, parameters):
+    """Whether the statement sorts its rows itself, rather than reading them in index order"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        return any(row[-1].startswith('USE TEMP B-TREE FOR') for row in plan)
+
+    if dialect in ('mysql', 'mariadb'):
+        plan = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+        return any('filesort' in (row['Extra'] or '') for row in plan)
+
+    raise ValueError(f"Don't know how to read query plans from {dialect}")
+
+
+def call_endpoints(app, user_id):
+    """Call every endpoint in ENDPOINTS as the user, recording the statements they run.
+
+    The user needs at least two cards in their groups, and the endpoints change the
+    database, e.g. deleting one of those cards. Returns (statements, errors), where
+    statements are [(endpoint, statement, parameters), ...] and errors are
+    ["<method> <path>: <status> <body>", ...] for responses that weren't successful.
+    """
+    client = app.test_client()
+    with app.app_context():
+        # Tables get analyzed when they're loaded in bulk, which a freshly seeded one hasn't been
+        if db.engine.dialect.name == 'sqlite':
+            db.session.execute(db.text("ANALYZE"))
+        arguments = endpoint_arguments(user_id)
+        headers = {'Authorization': f"Bearer {create_access_token(identity=str(user_id))}"}
+        db.session.remove()
+
+    errors = []
+    with app.app_context(), StatementRecorder(db.engine) as recorder:
+        for method, path in ENDPOINTS:
+            path = path.format(**arguments)
+            recorder.endpoint = f"{method} {path.split('?')[0]}"
+            json = {'question': "edited"} if method == 'PUT' else None
+            response = client.open(path, method=method, headers=headers, json=json)
+            response.get_data()
+            response.close()
+            if response.status_code >= 400:
+                errors.append(f"{method} {path}: {response.status_code} {response.get_data(as_text=True)[:200]}")
+        recorder.endpoint = None
+
+    return recorder.statements, errors
+
+
+def explain_statements(app, statements):
+    """[(endpoint, statement, tables it reads in full), ...] for each recorded statement.
+
+    The endpoint has its ids replaced with <id>. Scans in ALLOWED_SCANS are left out.
+    """
+    results = []
+    with app.app_context(), db.engine.connect() as connection:
+        tables = set(db.metadata.tables)
+        for endpoint, statement, parameters in statements:
+            template = re.sub(r'/[0-9a-f-]{32,36}', '/<id>', endpoint)
+            scans = {
+                table for table in full_scans(connection, statement, parameters, tables)
+                if (template, table) not in ALLOWED_SCANS
+            }
+            results.append((template, statement, scans))
+    return results
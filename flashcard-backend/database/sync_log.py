@@ -0,0 +1,167 @@
+"""What has changed in a user's library since a sync cursor.
+
+Cards carry time_updated, so cards added or edited since a point in time are
+a range scan. Deletes and membership changes leave nothing behind to scan, so
+they're recorded as they happen: a CardTombstone for every deleted card, and a
+MembershipEvent whenever a user joins or leaves a group (deleting a group
+counts as all of its subscribers leaving it).
+
+A cursor is an opaque token wrapping the time a sync started, less
+SYNC_CURSOR_OVERLAP_SECONDS. Timestamps are only stored to the second, and a
+change can be committed a little after its timestamp is taken, so each sync
+overlaps the end of the one before. Clients apply upserts and deletes by id,
+so seeing a change twice is harmless.
+
+Tombstones and events are pruned after SYNC_LOG_RETENTION_DAYS. A cursor
+older than that can't be answered incrementally, and gets a full sync.
+"""
+import base64
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, literal, or_, select
+
+from database.db_interface import db
+from database.db_types import Card, CardTombstone, MembershipEvent, user_group
+from scheduler import scheduler
+
+from logging import getLogger
+
+logger = getLogger()
+
+SYNC_CURSOR_OVERLAP_SECONDS = float(os.getenv('SYNC_CURSOR_OVERLAP_SECONDS', 10))
+SYNC_LOG_RETENTION_DAYS = float(os.getenv('SYNC_LOG_RETENTION_DAYS', 30))
+SYNC_LOG_PRUNE_INTERVAL = int(os.getenv('SYNC_LOG_PRUNE_INTERVAL', 24 * 60 * 60))
+
+CURSOR_VERSION = 'v1'
+
+
+# cards is a query, to be streamed. The rest are lists.
+SyncChanges = namedtuple('SyncChanges', ['cursor', 'full', 'cards', 'deleted_card_ids', 'joined_group_ids', 'left_group_ids'])
+
+
+def make_cursor(since):
+    token = f"{CURSOR_VERSION}:{since.isoformat()}"
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+
+def parse_cursor(cursor):
+    """The time a cursor was issued for. Raises ValueError if it isn't one of ours."""
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    version, _, since = token.partition(':')
+    if version != CURSOR_VERSION:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return datetime.fromisoformat(since)
+
+
+def record_deleted_cards(card_ids):
+    """Leave tombstones for cards that are about to be deleted, in the caller's transaction"""
+    tombstones = CardTombstone.__table__
+    db.session.execute(
+        insert(tombstones).from_select(
+            ['card_id', 'group_id', 'time_deleted'],
+            select(Card.card_id, Card.group_id, literal(datetime.now(), db.DateTime))
+            .where(Card.card_id.in_(card_ids)),
+        )
+    )
+
+
+def record_membership(user_id, group_id, joined):
+    db.session.add(MembershipEvent(user_id=user_id, group_id=group_id, joined=joined))
+
+
+def record_group_deleted(group_id):
+    """Every subscriber of a group that's about to be deleted leaves it"""
+    events = MembershipEvent.__table__
+    db.session.execute(
+        insert(events).from_select(
+            ['user_id', 'group_id', 'joined', 'time'],
+            select(
+                user_group.c.user_id,
+                user_group.c.group_id,
+                literal(False),
+                literal(datetime.now(), db.DateTime),
+            ).where(user_group.c.group_id == group_id),
+        )
+    )
+
+
+def get_changes(user_id, cursor=None, card_columns=(Card,)):
+    """SyncChanges for a user since a cursor, or everything if cursor is None or too old to answer.
+
+    Raises ValueError for a malformed cursor.
+    """
+    now = datetime.now()
+    next_cursor = make_cursor(now - timedelta(seconds=SYNC_CURSOR_OVERLAP_SECONDS))
+
+    since = parse_cursor(cursor) if cursor else None
+    if since is not None and since < now - timedelta(days=SYNC_LOG_RETENTION_DAYS):
+        since = None
+
+    subscribed = set(db.session.scalars(
+        select(user_group.c.group_id).where(user_group.c.user_id == user_id)
+    ))
+
+    cards = (
+        select(*card_columns)
+        .join(user_group, user_group.c.group_id == Card.group_id)
+        .where(user_group.c.user_id == user_id)
+        .order_by(Card.card_id)
+    )
+
+    if since is None:
+        return SyncChanges(next_cursor, True, cards, [], sorted(subscribed), [])
+
+    # Current membership is what counts - the events only say which groups to look at
+    changed = set(db.session.scalars(
+        select(MembershipEvent.group_id)
+        .where(MembershipEvent.user_id == user_id)
+        .where(MembershipEvent.time >= since)
+    ))
+    joined = changed & subscribed
+    left = changed - subscribed
+
+    # Everything in a group the user has just joined, and anything that has changed in the others
+    updated = Card.time_updated >= since
+    if joined:
+        updated = or_(updated, Card.group_id.in_(joined))
+    cards = cards.where(updated)
+
+    # Deletes in groups the user has left don't matter, as the client drops those groups whole
+    deleted_card_ids = list(db.session.scalars(
+        select(CardTombstone.card_id)
+        .join(user_group, user_group.c.group_id == CardTombstone.group_id)
+        .where(user_group.c.user_id == user_id)
+        .where(CardTombstone.time_deleted >= since)
+    ))
+
+    return SyncChanges(next_cursor, False, cards, deleted_card_ids, sorted(joined), sorted(left))
+
+
+def prune_sync_log():
+    """Delete tombstones and membership events that no cursor still needs"""
+    cutoff = datetime.now() - timedelta(days=SYNC_LOG_RETENTION_DAYS)
+
+    tombstones = db.session.execute(
+        CardTombstone.__table__.delete().where(CardTombstone.time_deleted < cutoff)
+    ).rowcount
+    events = db.session.execute(
+        MembershipEvent.__table__.delete().where(MembershipEvent.time < cutoff)
+    ).rowcount
+    db.session.commit()
+
+    logger.info(f"Pruned {tombstones} card tombstones and {events} membership events from before {cutoff}")
+    return tombstones, events
+
+
+def prune_sync_log_job():
+    """Scheduled job wrapper - APScheduler runs jobs outside of the app context"""
+    from data_imports.sheet_scheduler import run_on_one_replica
+
+    with scheduler.app.app_context():
+        run_on_one_replica("prune_sync_log", timedelta(seconds=SYNC_LOG_PRUNE_INTERVAL), prune_sync_log)
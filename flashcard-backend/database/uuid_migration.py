@@ -0,0 +1,312 @@
+"""Converting UUID columns between CHAR(32) hex and BINARY(16) on MySQL, without long locks.
+
+It's done in three steps, so the slow part can run while the old version of
+the app is still serving:
+
+    prepare   adds a shadow column next to each UUID column, and triggers that
+              fill it in on every insert and update
+    backfill  fills in the shadow columns of existing rows, a batch of
+              primary keys at a time, committing after each batch
+    cutover   swaps the shadow columns in, rebuilding the primary keys,
+              indexes and foreign keys on them, and drops the old columns
+
+`flask uuid-backfill` runs the first two ahead of a deploy. Migration
+b7d4e2f9a015 runs all three, so any rows the backfill hasn't reached (or
+everything, if it wasn't run) are converted during `flask setup-db`.
+
+None of this can be rolled back: MySQL commits each ALTER TABLE as it runs.
+Instead, every step looks at what's already been done and carries on from
+there, so if one fails part way through, fix the cause and run it (or the
+migration) again.
+
+The tables, columns and foreign keys are listed here rather than read from
+the models, since this has to work on the schema as it was, not as it is.
+"""
+import time
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+from logging import getLogger
+
+logger = getLogger()
+
+UUID_COLUMNS = {
+    'user': ['id'],
+    'group': ['group_id', 'creator_id'],
+    'user_group': ['user_id', 'group_id'],
+    'card': ['card_id', 'group_id', 'creator_id', 'updated_by_id'],
+    'card_distractor': ['card_id'],
+    'user_card_data': ['user_id', 'card_id'],
+    'sheet_sync_job': ['job_id', 'group_id', 'creator_id'],
+    'sheet_sync_row': ['job_id', 'card_id'],
+    'sheet_sync_lock': ['job_id'],
+    'card_tombstone': ['card_id', 'group_id'],
+    'membership_event': ['user_id', 'group_id'],
+}
+
+# (column, referred table, referred column) of each table's foreign keys. They're
+# dropped while the columns change, and added back under these names.
+FOREIGN_KEYS = {
+    'group': [('creator_id', 'user', 'id')],
+    'user_group': [('user_id', 'user', 'id'), ('group_id', 'group', 'group_id')],
+    'card': [('group_id', 'group', 'group_id'), ('creator_id', 'user', 'id'), ('updated_by_id', 'user', 'id')],
+    'card_distractor': [('card_id', 'card', 'card_id')],
+    'user_card_data': [('user_id', 'user', 'id'), ('card_id', 'card', 'card_id')],
+    'sheet_sync_job': [('group_id', 'group', 'group_id'), ('creator_id', 'user', 'id')],
+    'sheet_sync_row': [('job_id', 'sheet_sync_job', 'job_id'), ('card_id', 'card', 'card_id')],
+}
+
+SHADOW_SUFFIX = '_new'
+# What the old columns are renamed to during the cutover, until they're dropped
+OLD_SUFFIX = '_old'
+
+# What a UUID column is converted to: its type, the MySQL data type that has, and an
+# SQL expression (with {} for the old column) that converts a value to it
+Target = namedtuple('Target', ['column_type', 'data_type', 'expression'])
+BINARY = Target('BINARY(16)', 'binary', 'UNHEX({})')
+HEX = Target('CHAR(32)', 'char', 'LOWER(HEX({}))')
+
+
+def quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def data_type(connection, table, column):
+    return connection.execute(sa.text(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :column"
+    ), {'table': table, 'column': column}).scalar()
+
+
+def table_state(connection, table, target):
+    """How far along the table is: None if it doesn't exist, 'pending', 'renamed' or 'done'.
+
+    A table is renamed once cutover has swapped its columns over, but not yet rebuilt it.
+    Each of those is one ALTER TABLE, so a table is never part way through either.
+    """
+    columns = UUID_COLUMNS[table]
+    current = data_type(connection, table, columns[0])
+    if current is None:
+        return None
+    if data_type(connection, table, columns[0] + OLD_SUFFIX) is not None:
+        return 'renamed'
+    return 'done' if current == target.data_type else 'pending'
+
+
+def tables_to_convert(connection, target):
+    """Tables that exist, and whose UUID columns haven't been touched by cutover yet"""
+    return [table for table in UUID_COLUMNS if table_state(connection, table, target) == 'pending']
+
+
+def trigger_name(table, event):
+    return f"{table}_uuid_{event}"
+
+
+def prepare(connection, target=BINARY):
+    """Add the shadow columns and the triggers that keep them current. Safe to run again."""
+    for table in tables_to_convert(connection, target):
+        columns = UUID_COLUMNS[table]
+        missing = [c for c in columns if data_type(connection, table, c + SHADOW_SUFFIX) is None]
+        if missing:
+            # Adding nullable columns is instant on MySQL 8, and doesn't block writes
+            connection.execute(sa.text(
+                f"ALTER TABLE {quote(connection, table)} "
+                + ", ".join(f"ADD COLUMN {quote(connection, c + SHADOW_SUFFIX)} {target.column_type} NULL" for c in missing)
+            ))
+
+        assignments = ", ".join(
+            f"NEW.{quote(connection, c + SHADOW_SUFFIX)} = {target.expression.format('NEW.' + quote(connection, c))}"
+            for c in columns
+        )
+        for event in ('INSERT', 'UPDATE'):
+            name = trigger_name(table, event.lower())
+            exists = connection.execute(sa.text(
+                "SELECT 1 FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = :name"
+            ), {'name': name}).scalar()
+            if not exists:
+                connection.execute(sa.text(
+                    f"CREATE TRIGGER {quote(connection, name)} BEFORE {event} ON {quote(connection, table)} "
+                    f"FOR EACH ROW SET {assignments}"
+                ))
+
+
+def backfill(connection, target=BINARY, batch_size=1000, pause=0, commit=True):
+    """Fill in the shadow columns of rows written before the triggers were. Returns the number of rows updated.
+
+    Walks each table in order of the first column of its primary key, so every batch is a
+    range scan, and skips rows that are already done. With commit, each batch is committed
+    on its own, so no batch holds its locks for long.
+    """
+    inspector = sa.inspect(connection)
+    updated = 0
+
+    for table in tables_to_convert(connection, target):
+        columns = UUID_COLUMNS[table]
+        key = quote(connection, inspector.get_pk_constraint(table)['constrained_columns'][0])
+        quoted_table = quote(connection, table)
+        assignments = ", ".join(
+            f"{quote(connection, c + SHADOW_SUFFIX)} = {target.expression.format(quote(connection, c))}"
+            for c in columns
+        )
+        # The first UUID column of every table is NOT NULL, so a NULL shadow means not done yet
+        not_done = f"{quote(connection, columns[0] + SHADOW_SUFFIX)} IS NULL"
+
+        last = None
+        table_updated = 0
+        while True:
+            after = "" if last is None else f"WHERE {key} > :last"
+            keys = connection.execute(sa.text(
+                f"SELECT DISTINCT {key} FROM {quoted_table} {after} ORDER BY {key} LIMIT :limit"
+            ), {'last': last, 'limit': batch_size}).scalars().all()
+            if not keys:
+                break
+
+            table_updated += connection.execute(sa.text(
+                f"UPDATE {quoted_table} SET {assignments} "
+                f"WHERE {key} BETWEEN :first AND :last AND {not_done}"
+            ), {'first': keys[0], 'last': keys[-1]}).rowcount
+            last = keys[-1]
+
+            if commit:
+                connection.commit()
+            if pause:
+                time.sleep(pause)
+
+        logger.info(f"Backfilled {table_updated} rows of {table}")
+        updated += table_updated
+
+    return updated
+
+
+def cutover(connection, target=BINARY):
+    """Swap the shadow columns in, and drop the old ones. Run prepare and backfill first.
+
+    Safe to run again after a failure: tables that are done are skipped, those that were
+    renamed pick up from there, and foreign keys that are already gone, or back, are left be.
+    """
+    states = {table: table_state(connection, table, target) for table in UUID_COLUMNS}
+    tables = [table for table, state in states.items() if state in ('pending', 'renamed')]
+
+    if tables:
+        # Foreign keys need both sides to be the same type, so they all come off while the columns change
+        drop_foreign_keys(connection)
+        for table in tables:
+            if states[table] == 'pending':
+                rename_columns(connection, table)
+            rebuild_table(connection, table, target)
+
+    add_foreign_keys(connection)
+
+
+def rename_columns(connection, table):
+    """Stop the triggers, and swap the shadow columns in for the old ones"""
+    for event in ('insert', 'update'):
+        connection.execute(sa.text(f"DROP TRIGGER IF EXISTS {quote(connection, trigger_name(table, event))}"))
+
+    # Renaming is only a change to the table definition, so this is quick
+    renames = []
+    for column in UUID_COLUMNS[table]:
+        renames.append(f"RENAME COLUMN {quote(connection, column)} TO {quote(connection, column + OLD_SUFFIX)}")
+        renames.append(f"RENAME COLUMN {quote(connection, column + SHADOW_SUFFIX)} TO {quote(connection, column)}")
+    connection.execute(sa.text(f"ALTER TABLE {quote(connection, table)} " + ", ".join(renames)))
+
+
+def rebuild_table(connection, table, target):
+    """Make the swapped in columns the table's keys, and drop the old ones"""
+    quoted_table = quote(connection, table)
+    uuid_columns = UUID_COLUMNS[table]
+
+    # The primary key and indexes went with the old columns when they were renamed.
+    # They're made again on the new ones, under the names they had before.
+    old_columns = {column + OLD_SUFFIX: column for column in uuid_columns}
+    inspector = sa.inspect(connection)
+    nullable = {column['name']: column['nullable'] for column in inspector.get_columns(table)}
+    primary_key = inspector.get_pk_constraint(table)['constrained_columns']
+    indexes = [
+        index for index in inspector.get_indexes(table)
+        if set(index['column_names']) & set(old_columns)
+    ]
+
+    # Everything else is one ALTER, so the table is rebuilt once
+    clauses = []
+    for column in uuid_columns:
+        null = "NULL" if nullable[column + OLD_SUFFIX] else "NOT NULL"
+        clauses.append(f"MODIFY COLUMN {quote(connection, column)} {target.column_type} {null}")
+    if set(primary_key) & set(old_columns):
+        columns = ", ".join(quote(connection, old_columns.get(c, c)) for c in primary_key)
+        clauses.append("DROP PRIMARY KEY")
+        clauses.append(f"ADD PRIMARY KEY ({columns})")
+    for index in indexes:
+        unique = "UNIQUE " if index['unique'] else ""
+        columns = ", ".join(quote(connection, old_columns.get(c, c)) for c in index['column_names'])
+        clauses.append(f"DROP INDEX {quote(connection, index['name'])}")
+        clauses.append(f"ADD {unique}INDEX {quote(connection, index['name'])} ({columns})")
+    clauses += [f"DROP COLUMN {quote(connection, column)}" for column in old_columns]
+    connection.execute(sa.text(f"ALTER TABLE {quoted_table} " + ", ".join(clauses)))
+    logger.info(f"Converted the UUID columns of {table} to {target.column_type}")
+
+
+def foreign_key_name(table, column):
+    return f"fk_{table}_{column}"
+
+
+def existing_foreign_keys(connection):
+    """{table: {constrained column: constraint name}} for the tables in FOREIGN_KEYS that exist"""
+    inspector = sa.inspect(connection)
+    existing = {}
+    for table in FOREIGN_KEYS:
+        if inspector.has_table(table):
+            existing[table] = {
+                foreign_key['constrained_columns'][0]: foreign_key['name']
+                for foreign_key in inspector.get_foreign_keys(table)
+            }
+    return existing
+
+
+def drop_foreign_keys(connection):
+    """Drop whichever of the foreign keys are still there"""
+    for table, names in existing_foreign_keys(connection).items():
+        for column, _, _ in FOREIGN_KEYS[table]:
+            if column in names:
+                connection.execute(sa.text(
+                    f"ALTER TABLE {quote(connection, table)} DROP FOREIGN KEY {quote(connection, names[column])}"
+                ))
+
+
+def add_foreign_keys(connection):
+    """Add back whichever of the foreign keys are missing"""
+    inspector = sa.inspect(connection)
+    missing = [
+        (table, column, referred_table, referred_column)
+        for table, names in existing_foreign_keys(connection).items()
+        for column, referred_table, referred_column in FOREIGN_KEYS[table]
+        if column not in names and inspector.has_table(referred_table)
+    ]
+    if not missing:
+        return
+
+    # Every row was converted the same way, so there's nothing for the database to check
+    connection.execute(sa.text("SET foreign_key_checks = 0"))
+    try:
+        for table, column, referred_table, referred_column in missing:
+            connection.execute(sa.text(
+                f"ALTER TABLE {quote(connection, table)} "
+                f"ADD CONSTRAINT {quote(connection, foreign_key_name(table, column))} "
+                f"FOREIGN KEY ({quote(connection, column)}) "
+                f"REFERENCES {quote(connection, referred_table)} ({quote(connection, referred_column)})"
+            ))
+    finally:
+        connection.execute(sa.text("SET foreign_key_checks = 1"))
+
+
+def convert(connection, target=BINARY):
+    """All three steps, as the migration runs them.
+
+    Alembic owns the transaction here, so the backfill doesn't commit as it goes. That
+    doesn't make any of this atomic: the first ALTER TABLE commits the backfill, and each
+    one after commits itself. Running it again after a failure carries on from there.
+    """
+    prepare(connection, target)
+    backfill(connection, target, commit=False)
+    cutover(connection, target)
@@ -0,0 +1,64 @@
+# Production server config. Run with:
+#   gunicorn -c gunicorn.conf.py "app:create_app(background_workers=False)"
+#
+# The database schema should already be up to date (`flask setup-db`), and scheduled
+# jobs run in their own process (`flask run-scheduler`), not here.
+#
+# Reloading:
+#   kill -HUP <master pid>   replaces the workers gracefully, picking up config changes.
+#                            Because the app is preloaded, code changes need a restart
+#                            (or USR2 then QUIT on the old master, for a zero-downtime swap).
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# "gthread" (threaded workers) or "gevent" (green threads, for I/O-bound endpoints)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# Defaults to 2 x CPUs + 1, including when set but blank
+workers = int(os.getenv('GUNICORN_WORKERS') or multiprocessing.cpu_count() * 2 + 1)
+# Threads per worker, for gthread workers
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Concurrent greenlets per worker, for gevent workers
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+if worker_class == 'gevent':
+    # Has to happen before the app (and the database driver) is imported by the preload
+    from gevent import monkey
+    monkey.patch_all()
+
+# Import the app once in the master, so workers share the imported modules through copy-on-write.
+# The master serves nothing, so it's built without background threads; post_fork starts them in each worker.
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# How long workers get to finish in-flight requests on reload or shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then, staggered so they don't all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+pidfile = os.getenv('GUNICORN_PIDFILE', '/tmp/gunicorn.pid')
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and background threads.
+
+    The app was created in the master, and neither open connections nor running
+    threads survive a fork in a usable state.
+    """
+    from app import start_background_workers
+    from database.db_interface import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        # Drop the master's pooled connections without closing them out from under it
+        db.engine.dispose(close=False)
+
+    if app.config['APP_ROLE'] in ('web', 'all'):
+        start_background_workers(app)
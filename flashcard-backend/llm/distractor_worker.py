@@ -0,0 +1,261 @@
+"""Background generation of incorrect answers (distractors) for cards.
+
+Cards are packed into batches, and each batch is sent to the model as a single
+prompt. Batches run on a bounded thread pool, so a large import is spread over
+a handful of concurrent API calls rather than one serial call per card.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from logging import getLogger
+
+from database.db_interface import db
+from database.db_types import Card, CardDistractor
+from llm.providers import LLM_CALL_SECONDS, NullProvider, get_provider
+
+logger = getLogger()
+
+# Cards per prompt
+DISTRACTOR_BATCH_SIZE = int(os.getenv('DISTRACTOR_BATCH_SIZE', 25))
+# Concurrent calls to the model
+DISTRACTOR_MAX_WORKERS = int(os.getenv('DISTRACTOR_MAX_WORKERS', 8))
+# Attempts per batch before giving up on it (the backfill job will pick it up later)
+DISTRACTOR_MAX_ATTEMPTS = int(os.getenv('DISTRACTOR_MAX_ATTEMPTS', 4))
+# Base delay in seconds for the exponential backoff between attempts
+DISTRACTOR_RETRY_BACKOFF = float(os.getenv('DISTRACTOR_RETRY_BACKOFF', 1.0))
+
+
+class RunStats:
+    """Throughput and latency figures for one generation run"""
+
+    def __init__(self, cards_requested):
+        self.cards_requested = cards_requested
+        self.cards_generated = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.retries = 0
+        self.batch_latencies = []
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record_batch(self, generated, latency, retries, failed):
+        with self._lock:
+            self.batches += 1
+            self.cards_generated += generated
+            self.retries += retries
+            self.batch_latencies.append(latency)
+            if failed:
+                self.failed_batches += 1
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def wall_time(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def cards_per_second(self):
+        if not self.wall_time:
+            return 0.0
+        return self.cards_generated / self.wall_time
+
+    def latency_percentile(self, percentile):
+        if not self.batch_latencies:
+            return 0.0
+        latencies = sorted(self.batch_latencies)
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def to_dict(self):
+        return {
+            'cards_requested': self.cards_requested,
+            'cards_generated': self.cards_generated,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'retries': self.retries,
+            'wall_time': round(self.wall_time, 3),
+            'cards_per_second': round(self.cards_per_second, 2),
+            'batch_latency_p50': round(self.latency_percentile(50), 3),
+            'batch_latency_p95': round(self.latency_percentile(95), 3),
+        }
+
+
+class DistractorWorker:
+    def __init__(
+        self,
+        provider=None,
+        batch_size=DISTRACTOR_BATCH_SIZE,
+        max_workers=DISTRACTOR_MAX_WORKERS,
+        max_attempts=DISTRACTOR_MAX_ATTEMPTS,
+        retry_backoff=DISTRACTOR_RETRY_BACKOFF,
+    ):
+        self.provider = provider
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self.app = None
+        # Set up on first use, so a process that never generates anything never imports the model SDKs
+        self._provider_lock = threading.Lock()
+        # Batches go to the pool; whole runs are coordinated (and timed) on their own thread
+        self._pool = None
+        self._dispatcher = None
+
+        # Cards currently being generated, so overlapping runs don't pay for them twice
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+        # Stats for the most recent runs
+        self.recent_runs = deque(maxlen=20)
+
+    def init_app(self, app):
+        self.app = app
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="distractor")
+        self._dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="distractor-dispatch")
+
+    def get_provider(self):
+        if self.provider is None:
+            with self._provider_lock:
+                if self.provider is None:
+                    try:
+                        self.provider = get_provider()
+                    except ValueError as e:
+                        logger.error(f"Distractors won't be generated: {e}")
+                        self.provider = NullProvider()
+        return self.provider
+
+    @property
+    def available(self):
+        """Whether there's a model to generate with. Without one, requests for distractors are ignored."""
+        return self.get_provider().available
+
+    def enqueue(self, card_ids):
+        """Generate distractors for these cards in the background. Returns immediately."""
+        card_ids = list(card_ids)
+        if not card_ids or self._dispatcher is None:
+            return None
+        # Until the first run has set the provider up, leave finding out whether there is one to that run
+        if self.provider is not None and not self.provider.available:
+            return None
+        return self._dispatcher.submit(self.run, card_ids)
+
+    def run(self, card_ids):
+        """Generate distractors for these cards, blocking until every batch is done."""
+        if not self.available:
+            return RunStats(0)
+
+        card_ids = self._claim(card_ids)
+        stats = RunStats(len(card_ids))
+
+        try:
+            batches = [
+                card_ids[i:i + self.batch_size]
+                for i in range(0, len(card_ids), self.batch_size)
+            ]
+            futures = [self._pool.submit(self._process_batch, batch, stats) for batch in batches]
+            wait(futures)
+        finally:
+            self._release(card_ids)
+            stats.finish()
+
+        self.recent_runs.append(stats)
+        if card_ids:
+            logger.info(f"Distractor run complete: {stats.to_dict()}")
+
+        return stats
+
+    def shutdown(self, block=True):
+        if self._dispatcher is not None:
+            self._dispatcher.shutdown(wait=block)
+        if self._pool is not None:
+            self._pool.shutdown(wait=block)
+
+    def _claim(self, card_ids):
+        with self._in_flight_lock:
+            claimed = [card_id for card_id in dict.fromkeys(card_ids) if card_id not in self._in_flight]
+            self._in_flight.update(claimed)
+        return claimed
+
+    def _release(self, card_ids):
+        with self._in_flight_lock:
+            self._in_flight.difference_update(card_ids)
+
+    def _process_batch(self, card_ids, stats):
+        started = time.monotonic()
+        generated = 0
+        retries = 0
+        failed = False
+
+        try:
+            with self.app.app_context():
+                cards = self._cards_needing_distractors(card_ids)
+                if not cards:
+                    return
+
+                prompt_cards = [{
+                    'id': str(card.card_id),
+                    'question': card.question,
+                    'correct_answer': card.correct_answer,
+                } for card in cards]
+
+                incorrect_answers, retries = self._generate_with_retries(prompt_cards)
+                if incorrect_answers is None:
+                    failed = True
+                    return
+
+                for card in cards:
+                    incorrect_answer = incorrect_answers.get(str(card.card_id))
+                    if not incorrect_answer:
+                        continue
+                    db.session.merge(CardDistractor(
+                        card_id=card.card_id,
+                        content_hash=card.content_hash,
+                        incorrect_answer=incorrect_answer,
+                    ))
+                    generated += 1
+
+                db.session.commit()
+        except Exception as e:
+            logger.exception(f"Failed to store distractors for a batch of {len(card_ids)} cards: {e}")
+            failed = True
+        finally:
+            stats.record_batch(generated, time.monotonic() - started, retries, failed)
+
+    def _cards_needing_distractors(self, card_ids):
+        cards = Card.query.filter(Card.card_id.in_(card_ids)).all()
+        existing = {
+            (distractor.card_id, distractor.content_hash)
+            for distractor in CardDistractor.query.filter(CardDistractor.card_id.in_(card_ids))
+        }
+        return [card for card in cards if (card.card_id, card.content_hash) not in existing]
+
+    def _generate_with_retries(self, prompt_cards):
+        """Returns (answers, retries). answers is None if every attempt failed."""
+        provider_name = getattr(self.provider, 'name', type(self.provider).__name__)
+        for attempt in range(self.max_attempts):
+            started = time.perf_counter()
+            try:
+                answers = self.provider.generate(prompt_cards)
+                LLM_CALL_SECONDS.observe(time.perf_counter() - started, provider=provider_name, outcome='ok')
+                return answers, attempt
+            except Exception as e:
+                LLM_CALL_SECONDS.observe(time.perf_counter() - started, provider=provider_name, outcome='error')
+                if attempt == self.max_attempts - 1:
+                    logger.error(f"Giving up on a batch of {len(prompt_cards)} cards after {self.max_attempts} attempts: {e}")
+                    break
+                # Exponential backoff, with jitter so parallel batches don't retry in lockstep
+                delay = self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"Distractor batch failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        return None, self.max_attempts - 1
+
+
+distractor_worker = DistractorWorker()
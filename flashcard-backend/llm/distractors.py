@@ -0,0 +1,70 @@
+import os
+from datetime import timedelta
+
+from database.db_interface import db
+from database.db_types import Card, CardDistractor
+from llm.distractor_worker import distractor_worker
+from scheduler import scheduler
+
+# How often, in seconds, to look for cards that have no distractor yet
+DISTRACTOR_BACKFILL_INTERVAL = int(os.getenv('DISTRACTOR_BACKFILL_INTERVAL', 60))
+# How many cards to generate distractors for on each run
+DISTRACTOR_BACKFILL_BATCH_SIZE = int(os.getenv('DISTRACTOR_BACKFILL_BATCH_SIZE', 500))
+
+# The last card the previous backfill run asked for. Each run carries on after it, so cards
+# the model keeps failing on are retried once per pass over the backlog, not first every time.
+_backfill_cursor = None
+
+
+def get_cards_missing_distractors(limit, after=None, up_to=None):
+    """IDs of cards with no stored distractor at all, in card_id order.
+
+    Stale distractors are deleted when a card's question or answer changes, so
+    a card with no rows is exactly a card that needs (re)generating.
+    """
+    query = (
+        db.session.query(Card.card_id)
+        .outerjoin(CardDistractor, CardDistractor.card_id == Card.card_id)
+        .filter(CardDistractor.card_id.is_(None))
+    )
+    if after is not None:
+        query = query.filter(Card.card_id > after)
+    if up_to is not None:
+        query = query.filter(Card.card_id <= up_to)
+    rows = query.order_by(Card.card_id).limit(limit).all()
+    return [row.card_id for row in rows]
+
+
+def fill_missing_distractors(limit=DISTRACTOR_BACKFILL_BATCH_SIZE):
+    """Generate and store distractors for cards that don't have one yet.
+
+    New cards are normally handled as soon as they're created, this catches
+    anything that slipped through (e.g. the model was down at the time).
+    Returns the number of distractors stored.
+    """
+    global _backfill_cursor
+
+    if not distractor_worker.available:
+        return 0
+
+    card_ids = get_cards_missing_distractors(limit, after=_backfill_cursor)
+    if len(card_ids) < limit and _backfill_cursor is not None:
+        # Reached the end of the backlog, so wrap around to the cards before the cursor
+        card_ids += get_cards_missing_distractors(limit - len(card_ids), up_to=_backfill_cursor)
+    _backfill_cursor = card_ids[-1] if card_ids else None
+    # Release the connection before waiting on the model
+    db.session.close()
+
+    stats = distractor_worker.run(card_ids)
+    return stats.cards_generated
+
+
+def backfill_distractors_job():
+    """Scheduled job wrapper - APScheduler runs jobs outside of the app context"""
+    from data_imports.sheet_scheduler import run_on_one_replica
+
+    with scheduler.app.app_context():
+        # Every replica running a scheduler fires this, but only one of them should pay for the generations
+        run_on_one_replica(
+            "backfill_distractors", timedelta(seconds=DISTRACTOR_BACKFILL_INTERVAL), fill_missing_distractors
+        )
@@ -1,81 +1,127 @@
+import json
 import os
-import openai
+import threading
+from logging import getLogger
+
+from llm.providers import LLM_TOKENS, parse_answers
+
+logger = getLogger()
 
 
-# Ensure environment variables for API key, organization, and project ID are set
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_ORGANIZATION = os.getenv('OPENAI_ORGANIZATION')
 OPENAI_PROJECT_ID = os.getenv('OPENAI_PROJECT_ID')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL')
 
-if not OPENAI_API_KEY:
-    raise EnvironmentError("OPENAI_API_KEY environment variable is not set.")
-if not OPENAI_ORGANIZATION:
-    raise EnvironmentError("OPENAI_ORGANIZATION environment variable is not set.")
-if not OPENAI_PROJECT_ID:
-    raise EnvironmentError("OPENAI_PROJECT_ID environment variable is not set.")
-if not OPENAI_MODEL:
-    raise EnvironmentError("OPENAI_MODEL environment variable is not set.")
+
+def check_config():
+    """Ensure environment variables for API key, organization, project ID and model are set"""
+    if not OPENAI_API_KEY:
+        raise EnvironmentError("OPENAI_API_KEY environment variable is not set.")
+    if not OPENAI_ORGANIZATION:
+        raise EnvironmentError("OPENAI_ORGANIZATION environment variable is not set.")
+    if not OPENAI_PROJECT_ID:
+        raise EnvironmentError("OPENAI_PROJECT_ID environment variable is not set.")
+    if not OPENAI_MODEL:
+        raise EnvironmentError("OPENAI_MODEL environment variable is not set.")
+
+
+# One client for the whole process. It holds a connection pool, so reusing it
+# saves a TLS handshake per call, and it is safe to share between threads.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                check_config()
+                # The SDK takes a while to import, so it's only imported once a client is needed
+                import openai
+                _client = openai.OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    organization=OPENAI_ORGANIZATION,
+                    project=OPENAI_PROJECT_ID,
+                )
+    return _client
 
 
-def get_incorrect_answer(question, correct_answer):
+def get_incorrect_answers(cards):
     """
-    Generate two incorrect answers for a given question and correct answer using OpenAI's API.
+    Generate one incorrect answer for each of several cards, in a single API call.
 
     Args:
-        question (str): The question to be answered.
-        correct_answer (str): The correct answer to the question.
+        cards (list): dicts with "id", "question" and "correct_answer" keys.
 
     Returns:
-        list: A list containing two incorrect answers.
+        dict: Maps each card id to its incorrect answer. Cards the model skipped are missing.
+
+    Raises on API or parsing errors, so the caller can decide whether to retry.
     """
+    if not cards:
+        return {}
 
-    # Set up OpenAI API client
-    client = openai.OpenAI(
-        api_key=OPENAI_API_KEY,
-        organization=OPENAI_ORGANIZATION,
-        project=OPENAI_PROJECT_ID,
-    )
+    client = get_client()
 
-    # Craft the prompt to generate incorrect answer
     prompt = [
         {
             "content": (
-                f"Generate one plausible but incorrect answer to the following question. Return absolutley no other text, but the single answer.\n\n"
-                f"Question: {question}\n"
-                f"Correct Answer: {correct_answer}\n"
-                f"Incorrect Answer:"
+                "You write plausible but incorrect answers for flashcards. "
+                "For each card you are given, write one answer that is wrong but could be mistaken for the correct one. "
+                "Reply with JSON only, in the form "
+                '{"answers": [{"id": "<card id>", "incorrect_answer": "<answer>"}]}, '
+                "with exactly one entry per card."
             ),
             "role": "system"
+        },
+        {
+            "content": json.dumps([
+                {
+                    "id": card["id"],
+                    "question": card["question"],
+                    "correct_answer": card["correct_answer"],
+                }
+                for card in cards
+            ]),
+            "role": "user"
         }
     ]
 
-    try:
-        # Call OpenAI API to generate responses
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=prompt,
-            max_tokens=100,
-            temperature=0.7,
-            n=1,  # Generate a single completion
-        )
+    response = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=prompt,
+        # Roughly enough room for one short answer per card, plus the JSON wrapping
+        max_tokens=100 + 60 * len(cards),
+        temperature=0.7,
+        n=1,
+        response_format={"type": "json_object"},
+    )
+    if response.usage:
+        LLM_TOKENS.inc(response.usage.prompt_tokens, provider='openai', kind='prompt')
+        LLM_TOKENS.inc(response.usage.completion_tokens, provider='openai', kind='completion')
+
+    return parse_answers(response.choices[0].message.content, cards)
+
+class OpenAIProvider:
+    """Model provider (see llm/providers.py) backed by the OpenAI API"""
 
-        # Extract the text from the API response
-        incorrect_answer = response.choices[0].message.content
+    name = 'openai'
+    available = True
 
-        # Split the response into individual answers
-        return incorrect_answer.strip()
+    def __init__(self):
+        # Fails here, rather than on the first call, if the config or the SDK is missing
+        get_client()
 
-    except Exception as e:
-        print(f"An error occurred while generating incorrect answers: {e}")
-        return []
+    def generate(self, cards):
+        return get_incorrect_answers(cards)
 
 # Example usage
 if __name__ == "__main__":
-    question = "What does CPT stand for?"
-    correct_answer = "Clinical Prescription Tracker"
-    incorrect_answers = get_incorrect_answer(question, correct_answer)
+    cards = [{"id": "1", "question": "What does CPT stand for?", "correct_answer": "Clinical Prescription Tracker"}]
+    incorrect_answers = get_incorrect_answers(cards)
 
     print("Generated Incorrect Answers:")
-    for idx, answer in enumerate(incorrect_answers, start=1):
-        print(f"{idx}. {answer}")
+    for card in cards:
+        print(f"{card['question']} {incorrect_answers.get(card['id'])}")
@@ -0,0 +1,142 @@
+"""Registry of the models that distractors can be generated with.
+
+Providers are registered by import path, and only imported when one is first
+asked for, so a process that never generates anything never pays for (or
+needs credentials for) the model SDKs. If the configured provider can't be set
+up, the null provider is used instead and the app carries on without
+distractors.
+
+A provider has a generate(cards) method, taking dicts with "id", "question"
+and "correct_answer" keys and returning {id: incorrect answer}, a `name` for
+metrics, and an `available` flag saying whether it generates anything at all.
+Models are asked to reply in JSON, which parse_answers() reads.
+"""
+import importlib
+import json
+import os
+import random
+import time
+from logging import getLogger
+
+from utils.metrics import Counter, Histogram
+
+logger = getLogger()
+
+# Which provider to use. Defaults to "openai" if an API key is configured, otherwise "null".
+LLM_PROVIDER = os.getenv('LLM_PROVIDER')
+
+# Name -> "module:attribute" of a class or factory taking no arguments
+MODEL_PROVIDERS = {
+    'openai': 'llm.llm:OpenAIProvider',
+    'fake': 'llm.providers:FakeProvider',
+    'null': 'llm.providers:NullProvider',
+}
+
+LLM_CALL_SECONDS = Histogram(
+    'llm_call_duration_seconds',
+    'Time taken by calls to the model, by provider and outcome',
+    ['provider', 'outcome'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0),
+)
+LLM_TOKENS = Counter(
+    'llm_tokens_total',
+    'Tokens used by calls to the model, by provider and kind (prompt or completion)',
+    ['provider', 'kind'],
+)
+
+
+class NullProvider:
+    """Generates nothing. Used when no model is configured, so the app works offline."""
+
+    name = 'null'
+    available = False
+
+    def generate(self, cards):
+        return {}
+
+
+def parse_answers(reply, cards):
+    """{id: incorrect answer} from a model's reply to a prompt for these cards.
+
+    The reply should be {"answers": [{"id": ..., "incorrect_answer": ...}, ...]}, with one
+    entry per card. Entries for cards that weren't asked about, or with no answer, are
+    dropped, and cards the model skipped are missing. Raises ValueError if the reply
+    isn't in that form at all, so the caller can retry.
+    """
+    content = json.loads(reply)
+    if not isinstance(content, dict) or not isinstance(content.get("answers", []), list):
+        raise ValueError(f"Unexpected reply from the model: {reply[:200]}")
+
+    requested_ids = {card["id"] for card in cards}
+    incorrect_answers = {}
+    for answer in content.get("answers", []):
+        if not isinstance(answer, dict):
+            continue
+        card_id = answer.get("id")
+        incorrect_answer = str(answer.get("incorrect_answer") or "").strip()
+        if card_id in requested_ids and incorrect_answer:
+            incorrect_answers[card_id] = incorrect_answer
+
+    return incorrect_answers
+
+
+class FakeProvider:
+    """Stand-in for the model, for running the pipeline offline.
+
+    Args:
+        latency (float): Seconds to sleep per call, to simulate a round-trip.
+        failure_rate (float): Fraction of calls that raise, to exercise the retries.
+        reply (callable): Takes the cards and returns the model's raw reply, which is parsed
+            as a real one would be. By default, every card gets a well-formed answer.
+    """
+
+    name = 'fake'
+    available = True
+
+    def __init__(self, latency=0.0, failure_rate=0.0, reply=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reply = reply or self.well_formed_reply
+        self.calls = 0
+
+    @staticmethod
+    def well_formed_reply(cards):
+        return json.dumps({"answers": [
+            {"id": card["id"], "incorrect_answer": f"Not {card['correct_answer']}"} for card in cards
+        ]})
+
+    def generate(self, cards):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Simulated model failure")
+
+        return parse_answers(self.reply(cards), cards)
+
+
+def register_provider(name, path):
+    MODEL_PROVIDERS[name] = path
+
+
+def default_provider_name():
+    if LLM_PROVIDER:
+        return LLM_PROVIDER
+    return 'openai' if os.getenv('OPENAI_API_KEY') else 'null'
+
+
+def get_provider(name=None):
+    """Set up the named (or configured) provider, falling back to the null provider if that fails."""
+    name = name or default_provider_name()
+    if name not in MODEL_PROVIDERS:
+        raise ValueError(f"Unknown model provider: {name}. Options are: {', '.join(MODEL_PROVIDERS)}")
+
+    module_name, _, attribute = MODEL_PROVIDERS[name].partition(':')
+    try:
+        provider = getattr(importlib.import_module(module_name), attribute)()
+    except (ImportError, EnvironmentError) as e:
+        logger.warning(f"Model provider {name} is unavailable, distractors won't be generated: {e}")
+        return NullProvider()
+
+    logger.info(f"Using model provider: {name}")
+    return provider
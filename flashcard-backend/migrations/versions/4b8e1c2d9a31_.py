@@ -0,0 +1,51 @@
+"""spaced repetition schedule on user_card_data, integer answer counters
+
+Revision ID: 4b8e1c2d9a31
+Revises: 169de9909027
+Create Date: 2026-10-18 10:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1c2d9a31'
+down_revision = '169de9909027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_card_data', schema=None) as batch_op:
+        # These were mistakenly declared as UUIDs, and nothing has written to them yet
+        batch_op.alter_column('times_answered',
+               existing_type=sa.Uuid(),
+               type_=sa.Integer(),
+               existing_nullable=True)
+        batch_op.alter_column('times_answered_incorrectly',
+               existing_type=sa.Uuid(),
+               type_=sa.Integer(),
+               existing_nullable=True)
+        batch_op.add_column(sa.Column('ease_factor', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('interval_days', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('repetitions', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('due_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_user_card_data_user_id_due_at', ['user_id', 'due_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_card_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_card_data_user_id_due_at')
+        batch_op.drop_column('due_at')
+        batch_op.drop_column('repetitions')
+        batch_op.drop_column('interval_days')
+        batch_op.drop_column('ease_factor')
+        batch_op.alter_column('times_answered_incorrectly',
+               existing_type=sa.Integer(),
+               type_=sa.Uuid(),
+               existing_nullable=True)
+        batch_op.alter_column('times_answered',
+               existing_type=sa.Integer(),
+               type_=sa.Uuid(),
+               existing_nullable=True)
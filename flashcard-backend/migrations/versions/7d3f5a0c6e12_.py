@@ -0,0 +1,32 @@
+"""full-text indexes for group and card search
+
+Revision ID: 7d3f5a0c6e12
+Revises: 4b8e1c2d9a31
+Create Date: 2026-10-18 11:40:02.871356
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f5a0c6e12'
+down_revision = '4b8e1c2d9a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only MySQL has FULLTEXT indexes. Other databases search with an in-process index.
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+
+    op.create_index('ft_group_group_name', 'group', ['group_name'], unique=False, mysql_prefix='FULLTEXT')
+    op.create_index('ft_card_question_correct_answer', 'card', ['question', 'correct_answer'], unique=False, mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+
+    op.drop_index('ft_card_question_correct_answer', table_name='card')
+    op.drop_index('ft_group_group_name', table_name='group')
@@ -0,0 +1,30 @@
+"""sheet sync revision tracking
+
+Revision ID: a3e9c47b1f08
+Revises: 7d3f5a0c6e12
+Create Date: 2026-10-18 14:12:37.509214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c47b1f08'
+down_revision = '7d3f5a0c6e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sheet_sync_row is a new table, and is made by db.create_all() on startup
+    with op.batch_alter_table('sheet_sync_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_revision', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('last_synced', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sheet_sync_job', schema=None) as batch_op:
+        batch_op.drop_column('last_synced')
+        batch_op.drop_column('last_revision')
+
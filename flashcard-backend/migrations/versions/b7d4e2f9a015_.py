@@ -0,0 +1,33 @@
+"""uuid columns as BINARY(16)
+
+Revision ID: b7d4e2f9a015
+Revises: e61f0b7c2d94
+Create Date: 2026-10-18 20:31:09.642158
+
+"""
+from alembic import op
+
+from database.uuid_migration import BINARY, HEX, convert
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4e2f9a015'
+down_revision = 'e61f0b7c2d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only MySQL stores UUIDs as CHAR(32). SQLite keeps doing so, and PostgreSQL has a native type.
+    # On a large database, run `flask uuid-backfill` before this, while the old version is still serving.
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+
+    convert(op.get_bind(), BINARY)
+
+
+def downgrade():
+    if op.get_bind().dialect.name not in ('mysql', 'mariadb'):
+        return
+
+    convert(op.get_bind(), HEX)
@@ -0,0 +1,49 @@
+"""secondary indexes on the columns hot queries filter and join on
+
+Revision ID: e61f0b7c2d94
+Revises: a3e9c47b1f08
+Create Date: 2026-10-18 19:02:44.318027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61f0b7c2d94'
+down_revision = 'a3e9c47b1f08'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, whether the first column has a foreign key). On MySQL, InnoDB has already
+# made an index for each foreign key that had none, and drops it by itself once one of these can stand in.
+INDEXES = [
+    ('ix_card_group_id_time_updated', 'card', ['group_id', 'time_updated'], True),
+    ('ix_card_creator_id', 'card', ['creator_id'], True),
+    ('ix_group_group_name', 'group', ['group_name'], False),
+    ('ix_group_creator_id', 'group', ['creator_id'], True),
+    ('ix_user_group_group_id', 'user_group', ['group_id'], True),
+    ('ix_user_card_data_card_id', 'user_card_data', ['card_id'], True),
+    ('ix_sheet_sync_job_group_id', 'sheet_sync_job', ['group_id'], True),
+    ('ix_sheet_sync_row_card_id', 'sheet_sync_row', ['card_id'], True),
+]
+
+
+def upgrade():
+    # Tables newer than the database (e.g. sheet_sync_row) are made, indexes and all, by db.create_all() afterwards
+    inspector = sa.inspect(op.get_bind())
+
+    # InnoDB adds indexes online, so reads and writes carry on while they're built
+    for name, table, columns, _ in INDEXES:
+        if inspector.has_table(table):
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    mysql = op.get_bind().dialect.name in ('mysql', 'mariadb')
+
+    for name, table, columns, foreign_key in reversed(INDEXES):
+        if mysql and foreign_key:
+            # MySQL won't drop the only index a foreign key can use, so put back the kind it made itself
+            op.create_index(columns[0], table, columns[:1], unique=False)
+        op.drop_index(name, table_name=table)
@@ -1,12 +1,29 @@
-from flask import request, jsonify
+from flask import request, jsonify, current_app, Response, stream_with_context
 from flask_jwt_extended import (
     jwt_required, get_jwt_identity
 )
-from sqlalchemy.sql.expression import func
+from sqlalchemy import select
+from datetime import datetime
 from uuid import UUID
 
 from database.db_interface import db
-from database.db_types import Card, Group, User
+from database.group_versions import mark_group_changed
+from database.membership import is_member
+from database.query_count import query_budget
+from database.sync_log import get_changes, record_deleted_cards
+from database.db_types import Card, User, user_group
+from data_imports.bulk_import import (
+    BulkCardImporter, import_cards, json_rows, ndjson_rows, csv_rows
+)
+from llm.distractor_worker import distractor_worker
+from search.search import search_card_ids
+from study.answer_buffer import answer_buffer
+from study.card_index import card_index
+from study.sessions import STUDY_MODES, new_session_id, next_batch
+from study.spaced_repetition import (
+    get_next_card, QUALITY_CORRECT, QUALITY_INCORRECT
+)
+from utils.http_cache import cached_response, is_not_modified, is_settled, make_etag, not_modified_response
 
 # Create Card Endpoint
 @jwt_required()
@@ -21,70 +38,83 @@ def create_card():
 
     user_id = get_jwt_identity()
     user_uuid = UUID(user_id)
-    user = User.query.filter_by(id=user_uuid).first()
-    user_groups = user.subscribed_groups.all()
 
-    # Check if the user is subscribed to the group
-    if group_id not in [group.group_id for group in user_groups]:
+    # Check if the user is subscribed to the group. This also means the group exists.
+    if not is_member(user_uuid, group_id):
         return jsonify({'message': 'User is not subscribed to the group'}), 403
 
-    # Check if the group exists
-    if not Group.query.filter_by(group_id=group_id).first():
-        return jsonify({'message': 'Group not found'}), 404
-
     # Create new card
+    now = datetime.now()
     new_card = Card(
         question=question,
         correct_answer=correct_answer,
         group_id=group_id,
         creator_id=user_uuid,
-        updated_by_id=user_uuid
+        updated_by_id=user_uuid,
+        time_created=now,
+        time_updated=now,
     )
     db.session.add(new_card)
     db.session.commit()
 
+    card_index.add(group_id, [new_card.card_id], now)
+    distractor_worker.enqueue([new_card.card_id])
+
     return jsonify({'card_id': new_card.card_id}), 201
 
+# Streamed request bodies that create_bulk_cards understands, and how to read rows from them
+BULK_IMPORT_STREAM_TYPES = {
+    'application/x-ndjson': ndjson_rows,
+    'text/csv': csv_rows,
+}
+
 # Bulk create cards
 @jwt_required()
 def create_bulk_cards():
-    data = request.get_json()
-    cards = data.get('cards')
-    group_id = UUID(data.get('group_id'))
+    """Accepts a JSON body of {"group_id", "cards"}, or a streamed NDJSON or CSV body with ?group_id=.
 
-    if not all([cards, group_id]):
+    Cards are inserted in chunks, committing after each one, and rows that fail
+    validation are reported back without stopping the rest of the import.
+    """
+    content_type = request.mimetype
+    streamed = content_type in BULK_IMPORT_STREAM_TYPES
+
+    if streamed:
+        group_id = request.args.get('group_id')
+    else:
+        data = request.get_json()
+        cards = data.get('cards')
+        group_id = data.get('group_id')
+        if not isinstance(cards, list) or not cards:
+            return jsonify({'message': 'Missing required fields'}), 400
+
+    if not group_id:
         return jsonify({'message': 'Missing required fields'}), 400
+    try:
+        group_id = UUID(group_id)
+    except ValueError:
+        return jsonify({'message': 'Invalid group_id'}), 400
 
     user_id = get_jwt_identity()
     user_uuid = UUID(user_id)
-    user = User.query.filter_by(id=user_uuid).first()
-    user_groups = user.subscribed_groups.all()
 
-    # Check if the user is subscribed to the group
-    if group_id not in [group.group_id for group in user_groups]:
+    # Check if the user is subscribed to the group. This also means the group exists.
+    if not is_member(user_uuid, group_id):
         return jsonify({'message': 'User is not subscribed to the group'}), 403
 
-    # Check if the group exists
-    if not Group.query.filter_by(group_id=group_id).first():
-        return jsonify({'message': 'Group not found'}), 404
-
-    # Create new cards
-    created_cards = []
-    for card in cards:
-        new_card = Card(
-            question=card.get('question'),
-            correct_answer=card.get('correct_answer'),
-            group_id=group_id,
-            creator_id=user_uuid,
-            updated_by_id=user_uuid
-        )
-        db.session.add(new_card)
-        created_cards.append(new_card)
+    if streamed:
+        # Read the body a line at a time, rather than loading it all into memory
+        importer = BulkCardImporter(group_id, user_uuid)
+        rows = BULK_IMPORT_STREAM_TYPES[content_type](request.stream)
+    else:
+        importer = BulkCardImporter(group_id, user_uuid, keep_card_ids=True)
+        rows = json_rows(cards)
 
-    db.session.commit()
-    card_ids = [card.card_id for card in created_cards]
+    result = import_cards(importer, rows)
 
-    return jsonify({'message': 'Cards created', 'card_ids': card_ids}), 201
+    if not result['created'] and result['error_count']:
+        return jsonify({'message': 'No cards created', **result}), 400
+    return jsonify({'message': 'Cards created', **result}), 201
 
 # Get Card Endpoint
 @jwt_required()
@@ -99,9 +129,7 @@ def get_card(card_id):
         return jsonify({'message': 'Card not found'}), 404
 
     # Check that the user is subscribed to the group of the card
-    user = User.query.filter_by(id=user_uuid).first()
-    user_groups =  user.subscribed_groups.all()
-    if card.group_id not in [group.group_id for group in user_groups]:
+    if not is_member(user_uuid, card.group_id):
         return jsonify({'message': 'User is not subscribed to the group'}), 403
 
     card_data = {
@@ -114,15 +142,50 @@ def get_card(card_id):
         'time_updated': card.time_updated,
         'updated_by_id': card.updated_by_id
     }
+    if not is_settled(card.time_updated):
+        return cached_response(card_data)
+
+    etag = make_etag('card', card.card_id, card.time_updated)
+    if is_not_modified(etag, card.time_updated):
+        return not_modified_response(etag, card.time_updated)
+    return cached_response(card_data, etag, card.time_updated)
+
+# Rows are pulled from the database this many at a time while streaming a response
+CARDS_STREAM_CHUNK_SIZE = 1000
+# Page size limits for the paginated form of get_cards
+CARDS_PAGE_DEFAULT_LIMIT = 500
+CARDS_PAGE_MAX_LIMIT = 5000
+
+CARD_LIST_COLUMNS = (
+    Card.card_id,
+    Card.question,
+    Card.correct_answer,
+    Card.group_id,
+    Card.creator_id,
+    Card.time_created,
+    Card.time_updated,
+    Card.updated_by_id,
+)
 
-    return jsonify(card_data), 200
+def card_row_to_dict(row):
+    return {
+        'card_id': str(row.card_id),
+        'question': row.question,
+        'correct_answer': row.correct_answer,
+        'group_id': str(row.group_id),
+        'creator_id': str(row.creator_id),
+        'time_created': row.time_created,
+        'time_updated': row.time_updated,
+        'updated_by_id': str(row.updated_by_id)
+    }
 
 # Get Cards Endpoint
 @jwt_required()
+@query_budget(2)
 def get_cards():
     """Only return cards that a user has subscribed to the corresponding group
 
-    Returns:
+    Without query parameters, returns every card, grouped:
     {
         group_id: [
             {
@@ -132,31 +195,184 @@ def get_cards():
         ],
         ...
     }
+
+    With ?limit=<n> and/or ?after=<card_id>, returns one page of cards ordered by card_id:
+    {
+        cards: [{...card details}, ...],
+        next_after: card_id to pass as ?after= for the next page, or null on the last page
+    }
+
+    Either way, the cards come from a single query and the JSON is streamed
+    out as rows arrive, so memory use doesn't grow with the number of cards.
     """
     user_id = get_jwt_identity()
     user_uuid = UUID(user_id)
 
-    # Get all groups that the user has subscribed to
-    user = User.query.filter_by(id=user_uuid).first()
-    user_groups =  user.subscribed_groups.all()
-
-    # And get the cards that belong to those groups
-    cards_list = {}
-    for group in user_groups:
-        group = Group.query.filter_by(group_id=group.group_id).first()
-        cards = group.cards
-        cards_list[str(group.group_id)] = [{
-            'card_id': str(card.card_id),
-            'question': card.question,
-            'correct_answer': card.correct_answer,
-            'group_id': str(card.group_id),
-            'creator_id': str(card.creator_id),
-            'time_created': card.time_created,
-            'time_updated': card.time_updated,
-            'updated_by_id': str(card.updated_by_id)
-        } for card in cards]
-
-    return jsonify(cards_list), 200
+    if 'limit' in request.args or 'after' in request.args:
+        try:
+            limit = int(request.args.get('limit', CARDS_PAGE_DEFAULT_LIMIT))
+            after = request.args.get('after')
+            after = UUID(after) if after else None
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or after'}), 400
+        if not 0 < limit <= CARDS_PAGE_MAX_LIMIT:
+            return jsonify({'message': f'limit must be between 1 and {CARDS_PAGE_MAX_LIMIT}'}), 400
+
+        return Response(
+            stream_with_context(stream_cards_page(user_uuid, after, limit)),
+            mimetype='application/json',
+        )
+
+    return Response(
+        stream_with_context(stream_cards_by_group(user_uuid)),
+        mimetype='application/json',
+    )
+
+def stream_cards_by_group(user_uuid):
+    # Left join from the user's subscriptions, so that groups with no cards still appear
+    query = (
+        select(user_group.c.group_id.label('subscribed_group_id'), *CARD_LIST_COLUMNS)
+        .select_from(user_group)
+        .outerjoin(Card, Card.group_id == user_group.c.group_id)
+        .where(user_group.c.user_id == user_uuid)
+        .order_by(user_group.c.group_id, Card.card_id)
+        .execution_options(yield_per=CARDS_STREAM_CHUNK_SIZE)
+    )
+
+    dumps = current_app.json.dumps
+    current_group = None
+    first_card = True
+
+    yield '{'
+    for row in db.session.execute(query):
+        if row.subscribed_group_id != current_group:
+            if current_group is not None:
+                yield '],'
+            current_group = row.subscribed_group_id
+            first_card = True
+            yield f'{dumps(str(current_group))}:['
+
+        if row.card_id is None:
+            continue
+        if not first_card:
+            yield ','
+        first_card = False
+        yield dumps(card_row_to_dict(row))
+
+    if current_group is not None:
+        yield ']'
+    yield '}'
+
+def stream_cards_page(user_uuid, after, limit):
+    # Keyset pagination on the primary key, so every page costs the same however deep it is
+    query = (
+        select(*CARD_LIST_COLUMNS)
+        .join(user_group, user_group.c.group_id == Card.group_id)
+        .where(user_group.c.user_id == user_uuid)
+        .order_by(Card.card_id)
+        .limit(limit)
+        .execution_options(yield_per=CARDS_STREAM_CHUNK_SIZE)
+    )
+    if after is not None:
+        query = query.where(Card.card_id > after)
+
+    dumps = current_app.json.dumps
+    last_card_id = None
+    count = 0
+
+    yield '{"cards":['
+    for row in db.session.execute(query):
+        if count:
+            yield ','
+        yield dumps(card_row_to_dict(row))
+        last_card_id = row.card_id
+        count += 1
+
+    # A short page means there's nothing after it
+    next_after = str(last_card_id) if count == limit else None
+    yield f'],"next_after":{dumps(next_after)}}}'
+
+# Changes to the user's library since a cursor
+@jwt_required()
+@query_budget(4)
+def sync_cards():
+    """?since=<cursor from the last sync>. Without one, or with one too old to answer, everything is sent.
+    {
+        cursor: pass as ?since= next time,
+        full: true if this is everything, and the client should drop anything it has that isn't in it,
+        memberships: {joined: [group_id, ...], left: [group_id, ...]},
+        deleted_cards: [card_id, ...],
+        cards: [{...card details}, ...]
+    }
+
+    cards holds every card in a group the user has joined since the cursor, and any card
+    added or changed since then in their other groups. The cards of groups the user has left
+    (or that were deleted) aren't listed in deleted_cards - the client should drop them.
+    """
+    user_id = get_jwt_identity()
+    user_uuid = UUID(user_id)
+
+    try:
+        changes = get_changes(user_uuid, request.args.get('since'), CARD_LIST_COLUMNS)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    return Response(
+        stream_with_context(stream_sync(changes)),
+        mimetype='application/json',
+    )
+
+def stream_sync(changes):
+    dumps = current_app.json.dumps
+
+    yield '{'
+    yield f'"cursor":{dumps(changes.cursor)},"full":{dumps(changes.full)},'
+    yield f'"memberships":{dumps({"joined": changes.joined_group_ids, "left": changes.left_group_ids})},'
+    yield f'"deleted_cards":{dumps(changes.deleted_card_ids)},'
+
+    yield '"cards":['
+    query = changes.cards.execution_options(yield_per=CARDS_STREAM_CHUNK_SIZE)
+    for i, row in enumerate(db.session.execute(query)):
+        if i:
+            yield ','
+        yield dumps(card_row_to_dict(row))
+    yield ']}'
+
+CARD_SEARCH_DEFAULT_LIMIT = 50
+CARD_SEARCH_MAX_LIMIT = 200
+
+# Search the questions and answers of cards in the user's groups
+@jwt_required()
+def search_cards():
+    """?q=<search text>. Terms are matched against the start of words, and every term must match.
+    Results are ranked, best match first.
+    """
+    text = request.args.get('q')
+    if not text:
+        return jsonify({'message': 'Missing required fields'}), 400
+
+    try:
+        limit = int(request.args.get('limit', CARD_SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    limit = max(1, min(limit, CARD_SEARCH_MAX_LIMIT))
+
+    user_id = get_jwt_identity()
+    user_uuid = UUID(user_id)
+
+    group_ids = [
+        row.group_id for row in
+        db.session.query(user_group.c.group_id).filter(user_group.c.user_id == user_uuid)
+    ]
+    card_ids = search_card_ids(text, group_ids, limit)
+    if not card_ids:
+        return jsonify([]), 200
+
+    rows = db.session.query(*CARD_LIST_COLUMNS).filter(Card.card_id.in_(card_ids)).all()
+    rank = {card_id: position for position, card_id in enumerate(card_ids)}
+    rows.sort(key=lambda row: rank[row.card_id])
+
+    return jsonify([card_row_to_dict(row) for row in rows]), 200
 
 # Update Card Endpoint
 @jwt_required()
@@ -172,9 +388,7 @@ def update_card(card_id):
         return jsonify({'message': 'Card not found'}), 404
 
     # Check that the user is subscribed to the group of the card
-    user = User.query.filter_by(id=user_uuid).first()
-    user_groups = user.subscribed_groups.all()
-    if card.group_id not in [group.group_id for group in user_groups]:
+    if not is_member(user_uuid, card.group_id):
         return jsonify({'message': 'User is not subscribed to the group'}), 403
 
     # Update fields
@@ -191,26 +405,37 @@ def delete_card(card_id):
     """Users can only delete cards that they are subscribed to the group of"""
     user_id = get_jwt_identity()
     user_uuid = UUID(user_id)
-    user = User.query.filter_by(id=user_uuid).first()
     card = Card.query.filter_by(card_id=card_id).first()
 
     if not card:
         return jsonify({'message': 'Card not found'}), 404
 
     # Check that the user has access
-    user_groups = user.subscribed_groups.all()
-    if card.group_id not in [group.group_id for group in user_groups]:
+    if not is_member(user_uuid, card.group_id):
         return jsonify({'message': 'User is not subscribed to the group'}), 403
 
+    record_deleted_cards([card.card_id])
     db.session.delete(card)
+    mark_group_changed(card.group_id)
     db.session.commit()
+    card_index.discard(card.group_id, [card.card_id])
 
     return jsonify({'message': 'Card deleted'}), 200
 
 
-# Return a random flashcard for the user
+# Return the next flashcard for the user to study
 @jwt_required()
+@query_budget(6)
 def get_random_card():
+    """By default, any card at all. Pass ?mode=review for the next card due for review.
+
+    Review mode only moves on as answers are posted, which the web app doesn't do yet,
+    so random stays the default until it does.
+    """
+    mode = request.args.get('mode', 'random')
+    if mode not in ('review', 'random'):
+        return jsonify({'message': 'mode must be one of review, random'}), 400
+
     user_id = get_jwt_identity()
     user_uuid = UUID(user_id)
     user = User.query.filter_by(id=user_uuid).first()
@@ -226,8 +451,10 @@ def get_random_card():
 
     group_ids = [group.group_id for group in subscribed_groups]
 
-    # Query for cards in the subscribed groups
-    card = Card.query.filter(Card.group_id.in_(group_ids)).order_by(func.random()).first()
+    if mode == 'review':
+        card = get_next_card(user_uuid, group_ids, answer_buffer.pending_card_ids(user_uuid))
+    else:
+        card = get_random_card_from(group_ids)
 
     if not card:
         return jsonify({'error': 'No cards found in subscribed groups'}), 404
@@ -245,3 +472,164 @@ def get_random_card():
     }
 
     return jsonify(card_data), 200
+
+
+# Batch size limits for get_study_batch
+STUDY_BATCH_DEFAULT_LIMIT = 20
+STUDY_BATCH_MAX_LIMIT = 100
+
+# Return the next few cards of a study session, with their incorrect answers
+@jwt_required()
+@query_budget(4)
+def get_study_batch():
+    """?limit=<n>&mode=review|random&session=<id>. Leave out session to start a new one.
+    {
+        session: id to pass as ?session= for the next batch,
+        cards: [{...card details, incorrect_answer}, ...]
+    }
+
+    Cards aren't repeated within a session (see study/sessions.py). Pass ?exclude=<card_id>,
+    repeatable, to skip cards the client already has, e.g. a batch it's still working through.
+    An empty list of cards means the session has run out.
+    """
+    mode = request.args.get('mode', 'review')
+    if mode not in STUDY_MODES:
+        return jsonify({'message': f'mode must be one of {", ".join(STUDY_MODES)}'}), 400
+
+    try:
+        limit = int(request.args.get('limit', STUDY_BATCH_DEFAULT_LIMIT))
+        exclude = {UUID(card_id) for card_id in request.args.getlist('exclude')}
+    except ValueError:
+        return jsonify({'message': 'Invalid limit or exclude'}), 400
+    if not 0 < limit <= STUDY_BATCH_MAX_LIMIT:
+        return jsonify({'message': f'limit must be between 1 and {STUDY_BATCH_MAX_LIMIT}'}), 400
+
+    user_id = get_jwt_identity()
+    user_uuid = UUID(user_id)
+    session_id = request.args.get('session') or new_session_id()
+
+    if mode == 'review':
+        exclude |= answer_buffer.pending_card_ids(user_uuid)
+    batch = next_batch(user_uuid, session_id, limit, mode, exclude, CARD_LIST_COLUMNS)
+
+    return jsonify({
+        'session': session_id,
+        'cards': [
+            dict(card_row_to_dict(row), incorrect_answer=incorrect_answer)
+            for row, incorrect_answer in batch
+        ],
+    }), 200
+
+
+def get_random_card_from(group_ids):
+    """Any card from the given groups, picked from the in-memory card index rather than sorted by the database"""
+    card_id = card_index.sample(group_ids)
+    if card_id is None:
+        return None
+
+    card = db.session.get(Card, card_id)
+    if card is None:
+        # Deleted by another process since its group was last checked. Reload the groups and try again.
+        for group_id in group_ids:
+            card_index.invalidate(group_id)
+        card_id = card_index.sample(group_ids)
+        card = db.session.get(Card, card_id) if card_id else None
+    return card
+
+
+def parse_answer_quality(data):
+    """Answer quality on the SM-2 scale, from either {"quality": 0-5} or {"correct": bool}.
+
+    Returns None if neither is given or the quality is out of range.
+    """
+    if not isinstance(data, dict):
+        return None
+    if 'quality' in data:
+        quality = data.get('quality')
+        if isinstance(quality, bool) or not isinstance(quality, int) or not 0 <= quality <= 5:
+            return None
+        return quality
+    if 'correct' in data:
+        return QUALITY_CORRECT if data.get('correct') else QUALITY_INCORRECT
+    return None
+
+# Record an answer to a card. It's written out (and the card rescheduled) shortly afterwards.
+@jwt_required()
+def answer_card(card_id):
+    """Request body is either {"correct": bool}, or {"quality": 0-5} on the SM-2 scale"""
+    data = request.get_json()
+    user_id = get_jwt_identity()
+    user_uuid = UUID(user_id)
+
+    quality = parse_answer_quality(data)
+    if quality is None:
+        return jsonify({'message': 'Provide either correct, or a quality from 0 to 5'}), 400
+
+    card = Card.query.filter_by(card_id=card_id).first()
+    if not card:
+        return jsonify({'message': 'Card not found'}), 404
+
+    # Check that the user is subscribed to the group of the card
+    if not is_member(user_uuid, card.group_id):
+        return jsonify({'message': 'User is not subscribed to the group'}), 403
+
+    answer_buffer.add(user_uuid, card.card_id, quality)
+
+    return jsonify({'message': 'Answer recorded'}), 202
+
+# Record a batch of answers, e.g. from a review session done offline
+@jwt_required()
+def answer_cards():
+    """Request body:
+    {
+        answers: [
+            {card_id, correct or quality, answered_at (optional, ISO 8601)},
+            ...
+        ]
+    }
+    """
+    data = request.get_json()
+    answers = data.get('answers') if isinstance(data, dict) else None
+    if not answers:
+        return jsonify({'message': 'Missing required fields'}), 400
+    if not isinstance(answers, list):
+        return jsonify({'message': 'answers must be a list'}), 400
+
+    user_id = get_jwt_identity()
+    user_uuid = UUID(user_id)
+    now = datetime.now()
+
+    # Validate everything before recording anything
+    parsed = []
+    for index, answer in enumerate(answers):
+        if not isinstance(answer, dict):
+            return jsonify({'message': f'Answer {index}: must be an object'}), 400
+        quality = parse_answer_quality(answer)
+        if quality is None:
+            return jsonify({'message': f'Answer {index}: provide either correct, or a quality from 0 to 5'}), 400
+
+        try:
+            card_id = UUID(answer.get('card_id'))
+            answered_at = answer.get('answered_at')
+            answered_at = datetime.fromisoformat(answered_at) if answered_at else now
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'message': f'Answer {index}: invalid card_id or answered_at'}), 400
+
+        # Timestamps come from the client, so don't let them schedule from the future
+        if answered_at.tzinfo is not None:
+            answered_at = answered_at.astimezone().replace(tzinfo=None)
+        parsed.append((card_id, quality, min(answered_at, now)))
+
+    # Check that the user is subscribed to the groups of all of the cards
+    card_ids = {card_id for card_id, _, _ in parsed}
+    cards = Card.query.filter(Card.card_id.in_(card_ids)).all()
+
+    if len(cards) != len(card_ids):
+        return jsonify({'message': 'Card not found'}), 404
+    if not all(is_member(user_uuid, group_id) for group_id in {card.group_id for card in cards}):
+        return jsonify({'message': 'User is not subscribed to the group'}), 403
+
+    for card_id, quality, answered_at in parsed:
+        answer_buffer.add(user_uuid, card_id, quality, answered_at)
+
+    return jsonify({'message': 'Answers recorded', 'count': len(parsed)}), 202
@@ -1,4 +1,4 @@
-from flask import jsonify
+from flask import current_app, jsonify
 
 from database.db_types import User
 
@@ -10,3 +10,51 @@ def get_usernames():
     usernames = [user.username for user in users]
     return jsonify(usernames), 200
 
+
+# Throughput and latency of recent distractor generation runs
+def get_distractor_stats():
+    from llm.distractor_worker import distractor_worker
+    runs = [stats.to_dict() for stats in distractor_worker.recent_runs]
+    return jsonify(runs), 200
+
+# Queue depth and flush latency of the answer write-behind buffer
+def get_answer_buffer_stats():
+    from study.answer_buffer import answer_buffer
+    return jsonify(answer_buffer.stats()), 200
+
+# Hit/miss counts for the group membership cache
+def get_membership_cache_stats():
+    from database.membership import membership_cache
+    return jsonify(membership_cache.stats()), 200
+
+# Hit/miss counts for the user profile cache
+def get_profile_cache_stats():
+    from database.profiles import profile_cache
+    return jsonify(profile_cache.stats()), 200
+
+# Hit/miss counts for the rendered response cache
+def get_render_cache_stats():
+    from utils.http_cache import render_cache
+    return jsonify(render_cache.stats()), 200
+
+# Hit/miss counts for study sessions. A miss is a new session, or one that's expired or lives in another process
+def get_study_session_stats():
+    from study.sessions import session_cache
+    return jsonify(session_cache.stats()), 200
+
+# Size of the in-memory card index used for random cards, and how often it's been checked and rebuilt
+def get_card_index_stats():
+    from study.card_index import card_index
+    return jsonify(card_index.stats()), 200
+
+# How long this process took to create the app, and what it's running
+def get_startup_stats():
+    return jsonify({
+        'role': current_app.config['APP_ROLE'],
+        'startup_seconds': round(current_app.config['STARTUP_SECONDS'], 4),
+    }), 200
+
+# Connection pool usage, checkout waits and slow queries in this process
+def get_db_pool_stats():
+    from database.pool import pool_stats
+    return jsonify(pool_stats.stats()), 200
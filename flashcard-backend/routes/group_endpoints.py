@@ -3,14 +3,24 @@ from flask_jwt_extended import (
     jwt_required, get_jwt_identity
 )
 from datetime import datetime
+from sqlalchemy import and_, func
 import uuid
 
-from data_imports.google_sheets import sync_cards_from_sheet
+from data_imports.sheet_scheduler import schedule_sheet_sync
 
 from database.db_interface import db
-from database.db_types import Group, SheetSyncJob, User
+from database.group_versions import get_group_version
+from database.membership import invalidate_membership, is_member
+from database.query_count import query_budget
+from database.sync_log import record_group_deleted, record_membership
+from database.db_types import Card, Group, SheetSyncJob, User, user_group
 
 from scheduler import scheduler
+from search.search import search_group_ids
+from study.card_index import card_index
+from utils.http_cache import (
+    cached_response, is_not_modified, is_settled, make_etag, not_modified_response, render_cache, render_json
+)
 
 from logging import getLogger
 
@@ -35,23 +45,68 @@ def create_group():
     new_group.subscribers.append(user)
 
     db.session.add(new_group)
+    db.session.flush()
+    record_membership(user_uuid, new_group.group_id, joined=True)
     db.session.commit()
 
     return jsonify({'group_id': new_group.group_id}), 201
 
+# Page size limits for get_groups
+GROUPS_PAGE_DEFAULT_LIMIT = 100
+GROUPS_PAGE_MAX_LIMIT = 1000
+
 # Get Card Groups Endpoint
 @jwt_required()
+@query_budget(1)
 def get_groups():
-    groups = Group.query.all()
+    """Returns one page of groups, ordered by group_id, each with its number of subscribers:
+    {groups: [...], next_after: group_id to pass as ?after= for the next page, or null on the last page}
+
+    Responses carry an ETag, so a client polling with If-None-Match gets a 304 if nothing has changed.
+    """
+    try:
+        limit = int(request.args.get('limit', GROUPS_PAGE_DEFAULT_LIMIT))
+        after = request.args.get('after')
+        after = uuid.UUID(after) if after else None
+    except ValueError:
+        return jsonify({'message': 'Invalid limit or after'}), 400
+    if not 0 < limit <= GROUPS_PAGE_MAX_LIMIT:
+        return jsonify({'message': f'limit must be between 1 and {GROUPS_PAGE_MAX_LIMIT}'}), 400
+
+    # Counted by the database in the same query, rather than loading every subscriber
+    subscriber_count = func.count(user_group.c.user_id)
+    query = (
+        db.session.query(
+            Group.group_id,
+            Group.group_name,
+            Group.creator_id,
+            Group.time_created,
+            Group.time_updated,
+            subscriber_count.label('subscriber_count'),
+        )
+        .outerjoin(user_group, user_group.c.group_id == Group.group_id)
+    )
+    if after is not None:
+        query = query.filter(Group.group_id > after)
+    query = query.group_by(Group.group_id).order_by(Group.group_id).limit(limit)
+
     groups_list = [{
-        'group_name': group.group_name,
-        'group_id': group.group_id,
-        'creator_id': group.creator_id,
-        'time_created': group.time_created,
-        'time_updated': group.time_updated,
-        "subscribers": [subscriber.id for subscriber in group.subscribers]
-    } for group in groups]
-    return jsonify(groups_list), 200
+        'group_name': row.group_name,
+        'group_id': row.group_id,
+        'creator_id': row.creator_id,
+        'time_created': row.time_created,
+        'time_updated': row.time_updated,
+        'subscriber_count': row.subscriber_count,
+    } for row in query]
+
+    next_after = groups_list[-1]['group_id'] if len(groups_list) == limit else None
+    body = render_json({'groups': groups_list, 'next_after': next_after})
+
+    # Memberships don't have timestamps, so the ETag is a hash of the page itself
+    etag = make_etag('groups', body)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    return cached_response(body, etag)
 
 
 # Update Card Group Endpoint
@@ -71,7 +126,7 @@ def update_group(group_id):
     # Update fields
     group.group_name = data.get('group_name', group.group_name)
 
-    group.time_updated = datetime.now().isoformat()
+    group.time_updated = datetime.now()
     db.session.commit()
 
     return jsonify({'message': 'Group updated'}), 200
@@ -89,8 +144,11 @@ def delete_group(group_id):
     if group.creator_id != uuid.UUID(user_id):
         return jsonify({'message': 'User is not the creator of the group'}), 403
 
+    record_group_deleted(group_id)
     db.session.delete(group)
     db.session.commit()
+    invalidate_membership(group_id=group_id)
+    card_index.invalidate(group_id)
 
     return jsonify({'message': 'Group deleted'}), 200
 
@@ -106,8 +164,10 @@ def add_user_to_group(group_id):
 
     user = User.query.filter_by(id=user_uuid).first()
     group.subscribers.append(user)
+    record_membership(user_uuid, group.group_id, joined=True)
 
     db.session.commit()
+    invalidate_membership(user_id=user_uuid, group_id=group_id)
 
     return jsonify({'message': 'User added to group'}), 200
 
@@ -123,35 +183,108 @@ def remove_user_from_group(group_id):
 
     user = User.query.filter_by(id=user_uuid).first()
     group.subscribers.remove(user)
+    record_membership(user_uuid, group.group_id, joined=False)
 
     db.session.commit()
+    invalidate_membership(user_id=user_uuid, group_id=group_id)
 
     return jsonify({"message": "User removed from group"}), 200
 
+# Fields that can be requested from get_group_cards with ?fields=
+GROUP_CARD_FIELDS = ('card_id', 'question', 'correct_answer', 'time_created', 'time_updated', 'subscribed')
+# Page size limits for the paginated form of get_group_cards
+GROUP_CARDS_PAGE_DEFAULT_LIMIT = 500
+GROUP_CARDS_PAGE_MAX_LIMIT = 5000
+
 # Get cards in group
 @jwt_required()
+@query_budget(3)
 def get_group_cards(group_id):
-    group = Group.query.filter_by(group_id=group_id).first()
-    if not group:
+    """Returns a list of the cards in the group.
+
+    Optional query parameters:
+    - fields: comma separated subset of GROUP_CARD_FIELDS to include for each card
+    - limit, after: return one page of cards, ordered by card_id, after the given card_id, as
+        {cards: [...], next_after: card_id of the last card, or null on the last page}
+
+    Responses are versioned by the group's cards (see database/group_versions.py). A client that
+    already has the current version gets a 304, and otherwise the rendered response is reused
+    from memory while the version stays the same.
+    """
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(GROUP_CARD_FIELDS)
+    unknown = [field for field in fields if field not in GROUP_CARD_FIELDS]
+    if unknown:
+        return jsonify({'message': f'Unknown fields: {unknown}'}), 400
+
+    paginated = 'limit' in request.args or 'after' in request.args
+    if paginated:
+        try:
+            limit = int(request.args.get('limit', GROUP_CARDS_PAGE_DEFAULT_LIMIT))
+            after = request.args.get('after')
+            after = uuid.UUID(after) if after else None
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or after'}), 400
+        if not 0 < limit <= GROUP_CARDS_PAGE_MAX_LIMIT:
+            return jsonify({'message': f'limit must be between 1 and {GROUP_CARDS_PAGE_MAX_LIMIT}'}), 400
+
+    version = get_group_version(group_id)
+    if version is None:
         return jsonify({'message': 'Group not found'}), 404
 
     user_id = get_jwt_identity()
     user_uuid = uuid.UUID(user_id)
 
-    cards = group.cards
-    cards_list = [{
-        'card_id': card.card_id,
-        'question': card.question,
-        'correct_answer': card.correct_answer,
-        'time_created': card.time_created,
-        'time_updated': card.time_updated,
-        'subscribed': user_uuid in [acc.id for acc in group.subscribers],
-    } for card in cards]
+    # The same for every card, so look it up once
+    subscribed = is_member(user_uuid, group_id) if 'subscribed' in fields else None
 
-    return jsonify(cards_list), 200
+    # Everything the response depends on
+    cache_key = (
+        'group_cards', group_id, tuple(version), tuple(fields), subscribed,
+        (limit, after) if paginated else None,
+    )
+    etag = make_etag(*cache_key) if version.settled else None
+    if etag is not None:
+        if is_not_modified(etag, version.last_modified):
+            return not_modified_response(etag, version.last_modified)
+        body = render_cache.get(cache_key, None)
+        if body is not None:
+            return cached_response(body, etag, version.last_modified)
+
+    # Only load the columns that were asked for. card_id is always needed for paging.
+    card_fields = [field for field in fields if field != 'subscribed']
+    columns = [getattr(Card, field) for field in dict.fromkeys(card_fields + ['card_id'])]
+    query = db.session.query(*columns).filter(Card.group_id == group_id)
+
+    if paginated:
+        if after is not None:
+            query = query.filter(Card.card_id > after)
+        query = query.order_by(Card.card_id).limit(limit)
+
+    cards_list = []
+    last_card_id = None
+    for row in query:
+        card = {field: getattr(row, field) for field in card_fields}
+        if subscribed is not None:
+            card['subscribed'] = subscribed
+        cards_list.append(card)
+        last_card_id = row.card_id
+
+    if paginated:
+        next_after = last_card_id if len(cards_list) == limit else None
+        body = render_json({'cards': cards_list, 'next_after': next_after})
+    else:
+        body = render_json(cards_list)
+
+    # A version that's still changing isn't worth keeping, and mustn't be validated against later
+    if etag is None:
+        return cached_response(body)
+    render_cache.set(cache_key, body)
+    return cached_response(body, etag, version.last_modified)
 
 # Get group information
 @jwt_required()
+@query_budget(2)
 def get_group_info(group_id):
     group = Group.query.filter_by(group_id=group_id).first()
     if not group:
@@ -159,28 +292,62 @@ def get_group_info(group_id):
 
     user_id = get_jwt_identity()
     user_uuid = uuid.UUID(user_id)
+    subscribed = is_member(user_uuid, group.group_id)
 
-    return jsonify({
+    group_info = {
         'group_name': group.group_name,
         'group_id': group.group_id,
         'creator_id': group.creator_id,
         'time_created': group.time_created,
         'time_updated': group.time_updated,
-        'subscribed': user_uuid in [acc.id for acc in group.subscribers],
-    }), 200
+        'subscribed': subscribed,
+    }
+    if not is_settled(group.time_updated):
+        return cached_response(group_info)
+
+    etag = make_etag('group_info', group.group_id, group.time_updated, subscribed)
+    if is_not_modified(etag, group.time_updated):
+        return not_modified_response(etag, group.time_updated)
+    return cached_response(group_info, etag, group.time_updated)
+
+GROUP_SEARCH_DEFAULT_LIMIT = 50
+GROUP_SEARCH_MAX_LIMIT = 200
 
 # Search for group names (and IDs?)
 @jwt_required()
 def search_groups():
     name = request.args.get("group_name")
     if name is None:
-        return 400
+        return jsonify({"message": "Missing required fields"}), 400
+
+    try:
+        limit = int(request.args.get("limit", GROUP_SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"message": "Invalid limit"}), 400
+    limit = max(1, min(limit, GROUP_SEARCH_MAX_LIMIT))
 
     user_id = get_jwt_identity()
     user_uuid = uuid.UUID(user_id)
 
-    # Use ilike for case-insensitive partial matching
-    groups = Group.query.filter(Group.group_name.ilike(f"%{name}%")).all()
+    # Ranked, prefix matching search on the words in the group name
+    group_ids = search_group_ids(name, limit)
+    if not group_ids:
+        logger.info("No group found")
+        return "", 204
+
+    # The left join picks up whether the user is subscribed to each group, in the same query.
+    subscription = user_group.alias()
+    groups = (
+        db.session.query(Group, subscription.c.user_id.isnot(None).label('subscribed'))
+        .outerjoin(subscription, and_(
+            subscription.c.group_id == Group.group_id,
+            subscription.c.user_id == user_uuid,
+        ))
+        .filter(Group.group_id.in_(group_ids))
+        .all()
+    )
+    rank = {group_id: position for position, group_id in enumerate(group_ids)}
+    groups.sort(key=lambda row: rank[row[0].group_id])
 
     groups_list = [{
         'group_name': group.group_name,
@@ -188,12 +355,8 @@ def search_groups():
         'creator_id': group.creator_id,
         'time_created': group.time_created,
         'time_updated': group.time_updated,
-        'subscribed': user_uuid in [acc.id for acc in group.subscribers],
-    } for group in groups]
-
-    if len(groups_list) == 0:
-        print("No group found")
-        return 204
+        'subscribed': bool(subscribed),
+    } for group, subscribed in groups]
 
     return jsonify(groups_list), 200
 
@@ -233,15 +396,10 @@ def create_group_from_google_sheet():
     db.session.add(new_job)
     db.session.commit()
 
-    # # Schedule the actual job in APScheduler
-    # scheduler.add_job(
-    #     id=new_job.job_id,
-    #     func=sync_cards_from_sheet,
-    #     args=[new_job.job_id],
-    #     trigger='cron',  # or 'interval'
-    #     # TODO: parse `cron_string`
-    #     minute='*/5',
-    # )
+    # Schedule the actual job in APScheduler, if it runs in this process.
+    # Otherwise the scheduler process picks the job up the next time it reloads.
+    if scheduler.running:
+        schedule_sheet_sync(new_job)
 
     return jsonify({
         "message": f"Sync job created for group: {group_name}",
@@ -0,0 +1,117 @@
+import time
+
+from flask import Response, g, request
+
+from utils import metrics
+from utils.metrics import Callback, Counter, Histogram
+
+### METRICS ###
+
+REQUESTS = Counter(
+    'http_requests_total',
+    'Requests served, by route and status',
+    ['method', 'rule', 'status'],
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time taken to serve requests, by route',
+    ['method', 'rule'],
+)
+# A route whose query count creeps up with the data has an N+1
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Database queries made per request, by route',
+    ['method', 'rule'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200),
+)
+
+
+def _pool_stats():
+    from database.pool import pool_stats
+    return pool_stats.stats()
+
+
+def _answer_buffer_stats():
+    from study.answer_buffer import answer_buffer
+    return answer_buffer.stats()
+
+
+def _membership_cache_stats():
+    from database.membership import membership_cache
+    return membership_cache.stats()
+
+
+def _profile_cache_stats():
+    from database.profiles import profile_cache
+    return profile_cache.stats()
+
+
+def _render_cache_stats():
+    from utils.http_cache import render_cache
+    return render_cache.stats()
+
+
+# Stats that are already kept elsewhere, read when scraped
+Callback('db_pool_checked_out', 'Database connections in use', lambda: _pool_stats().get('checked_out', 0))
+Callback('db_pool_overflow', 'Database connections open beyond the pool size', lambda: max(_pool_stats().get('overflow', 0), 0))
+Callback('db_pool_checkouts_total', 'Database connections handed out', lambda: _pool_stats()['checkouts'], type='counter')
+Callback('db_pool_timeouts_total', 'Requests for a database connection that timed out', lambda: _pool_stats()['timeouts'], type='counter')
+Callback('db_slow_queries_total', 'Queries slower than DB_SLOW_QUERY_MS', lambda: _pool_stats()['slow_queries'], type='counter')
+Callback('answer_buffer_queue_depth', 'Answers waiting to be written', lambda: _answer_buffer_stats()['queue_depth'])
+Callback('answer_buffer_events_flushed_total', 'Answers written out', lambda: _answer_buffer_stats()['events_flushed'], type='counter')
+Callback('answer_buffer_failed_flushes_total', 'Answer writes that failed', lambda: _answer_buffer_stats()['failed_flushes'], type='counter')
+Callback(
+    'membership_cache_lookups_total',
+    'Group membership cache lookups, by result',
+    lambda: {('hit',): _membership_cache_stats()['hits'], ('miss',): _membership_cache_stats()['misses']},
+    labelnames=['result'],
+    type='counter',
+)
+Callback(
+    'profile_cache_lookups_total',
+    'User profile cache lookups, by result',
+    lambda: {('hit',): _profile_cache_stats()['hits'], ('miss',): _profile_cache_stats()['misses']},
+    labelnames=['result'],
+    type='counter',
+)
+Callback(
+    'render_cache_lookups_total',
+    'Rendered response cache lookups, by result',
+    lambda: {('hit',): _render_cache_stats()['hits'], ('miss',): _render_cache_stats()['misses']},
+    labelnames=['result'],
+    type='counter',
+)
+
+
+def start_request_timer():
+    # Threads don't survive gunicorn's fork, so each worker starts its own writer on its first request
+    metrics.start_snapshot_writer()
+    g.request_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    # Added up by database/query_count.py
+    query_counter = g.get('query_counter')
+
+    labels = {
+        'method': request.method,
+        'rule': request.url_rule.rule if request.url_rule else 'unmatched',
+    }
+    status = response.status_code
+
+    # Recorded once the response is closed, so streamed responses count their whole body and all their queries
+    def observe():
+        REQUESTS.inc(status=status, **labels)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+        REQUEST_QUERIES.observe(query_counter.count if query_counter else 0, **labels)
+
+    response.call_on_close(observe)
+    return response
+
+
+# Everything above, plus the metrics recorded by the rest of the app, for Prometheus to scrape
+def get_metrics():
+    return Response(metrics.collect(), mimetype='text/plain; version=0.0.4')
@@ -4,9 +4,13 @@ from flask_jwt_extended import (
     jwt_required, get_jwt_identity
 )
 from werkzeug.security import generate_password_hash, check_password_hash
+import math
 import uuid
 
 from database.db_interface import db
+from database.profiles import PROFILE_CACHE_TTL, PROFILE_QUERY_CHUNK_SIZE, get_profiles
+from database.query_count import extend_query_budget, query_budget
+from utils.http_cache import cached_response, is_not_modified, make_etag, not_modified_response, render_json
 from database.db_types import User
 
 
@@ -83,6 +87,7 @@ def protected():
 
 # Get user groups endpoint
 @jwt_required()
+@query_budget(2)
 def get_user_groups():
     user_id = get_jwt_identity()
     user = User.query.filter_by(id=uuid.UUID(user_id)).first()
@@ -94,32 +99,48 @@ def get_user_groups():
         'time_created': group.time_created,
         'time_updated': group.time_updated
     } for group in groups]
-    return jsonify(groups_list), 200
 
-# Get a user's details from their user_id
+    # Joining and leaving groups isn't timestamped, so the ETag is a hash of the list itself
+    body = render_json(groups_list)
+    etag = make_etag(body)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+    return cached_response(body, etag)
+
+# Get the details of several users from their user_ids.
+# GET takes ?user_ids=<id>,<id>,... and can be cached by the browser. POST takes
+# {"user_ids": [...]} in the body, for lists too long to fit in a URL.
 @jwt_required()
+@query_budget(1)
 def get_user_details():
-    user_id = get_jwt_identity()
-
-    # Request body contains a list of user_ids
-    data = request.get_json()
-    user_ids = data.get('user_ids')
+    if request.method == 'GET':
+        user_ids = [
+            user_id
+            for value in request.args.getlist('user_ids')
+            for user_id in value.split(',')
+            if user_id
+        ]
+    else:
+        data = request.get_json(silent=True)
+        user_ids = data.get('user_ids') if isinstance(data, dict) else None
+        if user_ids is not None and not isinstance(user_ids, list):
+            return jsonify({'message': 'user_ids must be a list'}), 400
 
     if not user_ids:
         return jsonify({'message': 'Missing required fields'}), 400
 
-    # Check that each user_id is a valid UUID. Remove duplicates.
-    user_ids = list(set([uuid.UUID(user_id) for user_id in user_ids if uuid.UUID(user_id)]))
-
-    # Get the user details
-    user_details = {}
-    for user_id in user_ids:
-        user = User.query.filter_by(id=user_id).first()
-        if user:
-            user_details[str(user_id)] = {
-                'username': user.username,
-                'email': user.email,
-                'user_id': user.id
-            }
-
-    return jsonify(user_details), 200
+    try:
+        user_ids = {uuid.UUID(str(user_id)) for user_id in user_ids}
+    except ValueError:
+        return jsonify({'message': 'Invalid user_id'}), 400
+
+    # Uncached profiles are fetched PROFILE_QUERY_CHUNK_SIZE at a time, one query each
+    extend_query_budget(math.ceil(len(user_ids) / PROFILE_QUERY_CHUNK_SIZE))
+
+    profiles = get_profiles(user_ids)
+    user_details = {str(user_id): profile for user_id, profile in profiles.items()}
+
+    response = jsonify(user_details)
+    # Private, since it needs a token. Kept for as long as the server caches profiles itself.
+    response.headers['Cache-Control'] = f'private, max-age={int(PROFILE_CACHE_TTL)}'
+    return response, 200
@@ -1 +1 @@
-flask --app app run
+APP_ROLE=all flask --app app run
@@ -0,0 +1,95 @@
+"""In-process inverted index with prefix matching.
+
+This is the search backend for databases without full-text indexes (e.g.
+SQLite in development). Words are kept in a sorted vocabulary, so all the
+words starting with a prefix are found with a binary search.
+"""
+import heapq
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Score for a query term that matches a whole word, or only the start of one
+EXACT_MATCH_SCORE = 2.0
+PREFIX_MATCH_SCORE = 1.0
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall((text or "").lower())
+
+
+class InvertedIndex:
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.vocabulary = []
+        # doc_id -> (number of words, extra data stored with the document)
+        self.documents = {}
+
+    def build(self, documents):
+        """Replace the contents of the index.
+
+        Args:
+            documents: iterable of (doc_id, text, extra). extra is stored and
+                handed to the search filter, e.g. the group a card belongs to.
+        """
+        postings = defaultdict(set)
+        stored = {}
+        for doc_id, text, extra in documents:
+            words = tokenize(text)
+            for word in words:
+                postings[word].add(doc_id)
+            stored[doc_id] = (len(words), extra)
+
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.documents = stored
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _words_with_prefix(self, prefix):
+        vocabulary = self.vocabulary
+        for position in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            word = vocabulary[position]
+            if not word.startswith(prefix):
+                break
+            yield word
+
+    def search(self, query, limit=50, doc_filter=None):
+        """Documents containing every term in the query, best match first.
+
+        Each term matches words it is a prefix of, so "phot syn" finds
+        "photosynthesis". Whole-word matches score higher than prefix matches,
+        and shorter documents win ties.
+
+        Returns a list of (doc_id, score).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        # Set operations run in C, so match on sets first and only score what's left
+        exact_matches = []
+        candidates = None
+        for term in terms:
+            exact_matches.append(self.postings.get(term, set()))
+            term_matches = set().union(*[self.postings[word] for word in self._words_with_prefix(term)])
+            candidates = term_matches if candidates is None else candidates & term_matches
+            if not candidates:
+                return []
+
+        results = []
+        for doc_id in candidates:
+            length, extra = self.documents[doc_id]
+            if doc_filter is not None and not doc_filter(extra):
+                continue
+            score = sum(
+                EXACT_MATCH_SCORE if doc_id in exact else PREFIX_MATCH_SCORE
+                for exact in exact_matches
+            )
+            results.append((-score, length, doc_id))
+
+        best = heapq.nsmallest(limit, results, key=lambda result: (result[0], result[1]))
+        return [(doc_id, -score) for score, _, doc_id in best]
@@ -0,0 +1,133 @@
+"""Ranked, prefix-matching search over group names and card text.
+
+On MySQL this uses the FULLTEXT indexes on group.group_name and
+card.(question, correct_answer), in boolean mode. Anywhere else it falls
+back to an in-process inverted index, which is rebuilt whenever the table
+has changed since it was built.
+"""
+import os
+import threading
+
+from sqlalchemy import desc, func, or_
+from sqlalchemy.dialects import mysql
+
+from database.db_interface import db
+from database.db_types import Card, Group
+from search.inverted_index import InvertedIndex, tokenize
+
+# InnoDB ignores words shorter than innodb_ft_min_token_size in full-text
+# searches. Shorter terms are matched with LIKE instead.
+MYSQL_FT_MIN_TOKEN_SIZE = int(os.getenv('MYSQL_FT_MIN_TOKEN_SIZE', 3))
+
+LIKE_ESCAPE = '\\'
+
+
+def use_full_text():
+    return db.session.get_bind().dialect.name in ('mysql', 'mariadb')
+
+
+def escape_like(term):
+    """The term with LIKE's wildcards escaped, so a search for % or _ matches them literally"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def boolean_mode_query(terms):
+    """Every term required, and matched as a prefix"""
+    return " ".join(f"+{term}*" for term in terms)
+
+
+class FallbackIndex:
+    """An InvertedIndex over one table, rebuilt when the table changes"""
+
+    def __init__(self, model, load_documents):
+        self.model = model
+        self.load_documents = load_documents
+        self.index = InvertedIndex()
+        self.watermark = None
+        self._lock = threading.Lock()
+
+    def current_watermark(self):
+        return db.session.query(func.count(), func.max(self.model.time_updated)).one()
+
+    def get(self):
+        watermark = tuple(self.current_watermark())
+        if watermark != self.watermark:
+            with self._lock:
+                if watermark != self.watermark:
+                    index = InvertedIndex()
+                    index.build(self.load_documents())
+                    self.index = index
+                    self.watermark = watermark
+        return self.index
+
+
+def load_group_documents():
+    for group_id, group_name in db.session.query(Group.group_id, Group.group_name).yield_per(5000):
+        yield group_id, group_name, None
+
+
+def load_card_documents():
+    rows = db.session.query(Card.card_id, Card.question, Card.correct_answer, Card.group_id).yield_per(5000)
+    for card_id, question, correct_answer, group_id in rows:
+        yield card_id, f"{question} {correct_answer}", group_id
+
+
+group_index = FallbackIndex(Group, load_group_documents)
+card_index = FallbackIndex(Card, load_card_documents)
+
+
+def search_group_ids(text, limit=50):
+    """IDs of groups whose names match the search text, best match first"""
+    terms = tokenize(text)
+    if not terms:
+        return []
+
+    if not use_full_text():
+        return [group_id for group_id, _ in group_index.get().search(text, limit)]
+
+    long_terms = [term for term in terms if len(term) >= MYSQL_FT_MIN_TOKEN_SIZE]
+    query = db.session.query(Group.group_id)
+
+    if long_terms:
+        score = mysql.match(Group.group_name, against=boolean_mode_query(long_terms)).in_boolean_mode()
+        query = query.add_columns(score.label('score')).filter(score > 0).order_by(desc('score'))
+    else:
+        # Nothing long enough for the full-text index. A prefix LIKE can still use the b-tree index.
+        query = (
+            query.filter(Group.group_name.like(f"{escape_like(terms[0])}%", escape=LIKE_ESCAPE))
+            .order_by(func.length(Group.group_name))
+        )
+
+    for term in terms:
+        if term not in long_terms:
+            query = query.filter(Group.group_name.like(f"%{escape_like(term)}%", escape=LIKE_ESCAPE))
+
+    return [row.group_id for row in query.limit(limit)]
+
+
+def search_card_ids(text, group_ids, limit=50):
+    """IDs of cards in the given groups whose question or answer match the search text, best match first"""
+    terms = tokenize(text)
+    if not terms or not group_ids:
+        return []
+
+    if not use_full_text():
+        group_ids = set(group_ids)
+        results = card_index.get().search(text, limit, doc_filter=lambda group_id: group_id in group_ids)
+        return [card_id for card_id, _ in results]
+
+    long_terms = [term for term in terms if len(term) >= MYSQL_FT_MIN_TOKEN_SIZE]
+    query = db.session.query(Card.card_id).filter(Card.group_id.in_(group_ids))
+
+    if long_terms:
+        score = mysql.match(Card.question, Card.correct_answer, against=boolean_mode_query(long_terms)).in_boolean_mode()
+        query = query.add_columns(score.label('score')).filter(score > 0).order_by(desc('score'))
+
+    for term in terms:
+        if term not in long_terms:
+            query = query.filter(or_(
+                Card.question.like(f"%{escape_like(term)}%", escape=LIKE_ESCAPE),
+                Card.correct_answer.like(f"%{escape_like(term)}%", escape=LIKE_ESCAPE),
+            ))
+
+    return [row.card_id for row in query.limit(limit)]
@@ -0,0 +1,249 @@
+"""Write-behind buffer for answers to cards.
+
+Answers are queued in memory and written to UserCardData in batches on a short
+interval, one upsert statement per batch, rather than one transaction per
+answer. The buffer is flushed when the process exits.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from logging import getLogger
+
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from database.db_interface import db
+from database.db_types import UserCardData
+from study.spaced_repetition import sm2, DEFAULT_EASE_FACTOR
+
+logger = getLogger()
+
+# Seconds between flushes
+ANSWER_FLUSH_INTERVAL = float(os.getenv('ANSWER_FLUSH_INTERVAL', 2))
+# Flush early once this many answers are waiting
+ANSWER_FLUSH_MAX_BATCH = int(os.getenv('ANSWER_FLUSH_MAX_BATCH', 1000))
+# Answers are dropped after failing to flush this many times, so one bad row can't block the rest forever.
+# When a batch fails, each user's answers to each card are written on their own, so only those that fail
+# again count an attempt, e.g. answers to a card that has since been deleted.
+ANSWER_FLUSH_MAX_ATTEMPTS = 3
+
+
+class AnswerEvent:
+    def __init__(self, user_id, card_id, quality, answered_at):
+        self.user_id = user_id
+        self.card_id = card_id
+        self.quality = quality
+        self.answered_at = answered_at
+        self.attempts = 0
+
+
+class AnswerBuffer:
+    def __init__(self, flush_interval=ANSWER_FLUSH_INTERVAL, max_batch=ANSWER_FLUSH_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self.app = None
+        self._events = []
+        self._lock = threading.Lock()
+        # Only one flush at a time, so batches are applied in order
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        # Counters
+        self.events_received = 0
+        self.events_flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self._thread = threading.Thread(target=self._run, name="answer-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    @property
+    def queue_depth(self):
+        return len(self._events)
+
+    def add(self, user_id, card_id, quality, answered_at=None):
+        event = AnswerEvent(user_id, card_id, quality, answered_at or datetime.now())
+        with self._lock:
+            self._events.append(event)
+            self.events_received += 1
+            depth = len(self._events)
+
+        if depth >= self.max_batch:
+            self._wake.set()
+
+    def pending_card_ids(self, user_id):
+        """Cards this user has answered that haven't been written out yet"""
+        with self._lock:
+            return {event.card_id for event in self._events if event.user_id == user_id}
+
+    def flush(self):
+        """Write out everything in the buffer. Returns the number of answers written."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    self._write(events)
+                failed = []
+            except Exception as e:
+                logger.exception(f"Failed to flush {len(events)} answers, writing them one card at a time: {e}")
+                self.failed_flushes += 1
+                failed = self._write_each(events)
+
+            if failed:
+                for event in failed:
+                    event.attempts += 1
+                retry = [event for event in failed if event.attempts < ANSWER_FLUSH_MAX_ATTEMPTS]
+                if len(retry) < len(failed):
+                    logger.error(f"Dropping {len(failed) - len(retry)} answers after {ANSWER_FLUSH_MAX_ATTEMPTS} failed flushes")
+
+                # Put them back in front of anything that arrived in the meantime
+                with self._lock:
+                    self._events = retry + self._events
+
+            written = len(events) - len(failed)
+            if written:
+                latency = time.monotonic() - started
+                self.flushes += 1
+                self.events_flushed += written
+                self.last_flush_latency = latency
+                self.total_flush_latency += latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+
+            return written
+
+    def shutdown(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval + 5)
+        # Whatever the thread didn't get to
+        if self.app is not None:
+            self.flush()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'events_received': self.events_received,
+            'events_flushed': self.events_flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_latency': round(self.last_flush_latency, 4),
+            'max_flush_latency': round(self.max_flush_latency, 4),
+            'mean_flush_latency': round(self.total_flush_latency / self.flushes, 4) if self.flushes else 0.0,
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _write_each(self, events):
+        """Write each user's answers to each card in a transaction of their own. Returns the events that failed."""
+        by_key = defaultdict(list)
+        for event in events:
+            by_key[(event.user_id, event.card_id)].append(event)
+
+        failed = []
+        for (user_id, card_id), key_events in by_key.items():
+            try:
+                with self.app.app_context():
+                    self._write(key_events)
+            except Exception as e:
+                logger.warning(f"Failed to write {len(key_events)} answers by {user_id} to card {card_id}: {e}")
+                failed.extend(key_events)
+        return failed
+
+    def _write(self, events):
+        by_key = defaultdict(list)
+        for event in sorted(events, key=lambda event: event.answered_at):
+            by_key[(event.user_id, event.card_id)].append(event)
+
+        # One read for the current schedule of every card in the batch
+        existing = {
+            (card_data.user_id, card_data.card_id): card_data
+            for card_data in UserCardData.query.filter(
+                tuple_(UserCardData.user_id, UserCardData.card_id).in_(list(by_key))
+            )
+        }
+
+        rows = []
+        for (user_id, card_id), key_events in by_key.items():
+            current = existing.get((user_id, card_id))
+            schedule = {
+                'ease_factor': current.ease_factor if current and current.ease_factor else DEFAULT_EASE_FACTOR,
+                'interval_days': current.interval_days if current and current.interval_days else 0,
+                'repetitions': current.repetitions if current and current.repetitions else 0,
+            }
+            incorrect = 0
+            for event in key_events:
+                schedule = sm2(
+                    event.quality,
+                    schedule['ease_factor'],
+                    schedule['interval_days'],
+                    schedule['repetitions'],
+                    event.answered_at,
+                )
+                if event.quality < 3:
+                    incorrect += 1
+
+            rows.append({
+                'user_id': user_id,
+                'card_id': card_id,
+                # Counters are added on to the stored values, not overwritten
+                'times_answered': len(key_events),
+                'times_answered_incorrectly': incorrect,
+                'last_seen': key_events[-1].answered_at,
+                **schedule,
+            })
+
+        db.session.execute(upsert_user_card_data(rows))
+        db.session.commit()
+
+
+def upsert_user_card_data(rows):
+    """INSERT ... ON DUPLICATE KEY UPDATE (or ON CONFLICT, off MySQL) for a batch of rows"""
+    table = UserCardData.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(table).values(rows)
+        new = stmt.inserted
+    else:
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(rows)
+        new = stmt.excluded
+
+    update = {
+        'times_answered': db.func.coalesce(table.c.times_answered, 0) + new.times_answered,
+        'times_answered_incorrectly': db.func.coalesce(table.c.times_answered_incorrectly, 0) + new.times_answered_incorrectly,
+        'last_seen': new.last_seen,
+        'ease_factor': new.ease_factor,
+        'interval_days': new.interval_days,
+        'repetitions': new.repetitions,
+        'due_at': new.due_at,
+    }
+
+    if dialect in ('mysql', 'mariadb'):
+        return stmt.on_duplicate_key_update(**update)
+    return stmt.on_conflict_do_update(index_elements=[table.c.user_id, table.c.card_id], set_=update)
+
+
+answer_buffer = AnswerBuffer()
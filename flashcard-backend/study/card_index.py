@@ -0,0 +1,236 @@
+"""An in-process index of the card ids in each group, for picking random cards.
+
+Each group's ids are packed into a bytearray, 16 bytes per card, so a group
+of 20k cards costs 320kB rather than 20k ORM objects. A random card from a
+user's groups is a random position across all of them - weighted by group
+size, so every card is equally likely - then one primary key lookup. The
+database never has to sort the candidates.
+
+Cards created or deleted in this process are added to or dropped from the
+index straight away, and the group's version moved on to match. Changes made
+by other processes (other workers, sheet syncs in the scheduler) are picked up
+by comparing each group's version - its number of cards, and the latest
+time_created among them - with the database at most every
+CARD_INDEX_CHECK_INTERVAL seconds, and rebuilding the group if it has moved.
+Editing a card never changes its id or group, so needs nothing.
+
+MySQL rounds time_created to the second, so the time a card was created here
+can be up to a second off what the database has. Times within a second of
+each other count as the same version.
+"""
+import bisect
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from database.db_interface import db
+from database.db_types import Card
+
+CARD_INDEX_CHECK_INTERVAL = float(os.getenv('CARD_INDEX_CHECK_INTERVAL', 30))
+# Groups kept in the index, least recently used dropped first
+CARD_INDEX_SIZE = int(os.getenv('CARD_INDEX_SIZE', 10000))
+
+UUID_SIZE = 16
+
+# How far apart two time_created can be and still be the same version. See the module docstring.
+VERSION_TIME_TOLERANCE = timedelta(seconds=1)
+
+
+def same_version(a, b):
+    """Whether two (card count, latest time_created) versions match"""
+    if a is None or b is None or a[0] != b[0]:
+        return False
+    if a[1] is None or b[1] is None:
+        return a[1] is b[1]
+    return abs(a[1] - b[1]) <= VERSION_TIME_TOLERANCE
+
+
+class GroupCards:
+    """The card ids of one group, packed into a bytearray"""
+    __slots__ = ('ids', 'version', 'checked_at')
+
+    def __init__(self, card_ids=(), version=None):
+        self.ids = bytearray(b''.join(card_id.bytes for card_id in card_ids))
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids) // UUID_SIZE
+
+    def __getitem__(self, i):
+        return uuid.UUID(bytes=bytes(self.ids[i * UUID_SIZE:(i + 1) * UUID_SIZE]))
+
+    def find(self, card_id):
+        target = card_id.bytes
+        start = 0
+        while True:
+            start = self.ids.find(target, start)
+            # Only a match on a 16 byte boundary is a card id
+            if start == -1 or start % UUID_SIZE == 0:
+                return start
+            start += 1
+
+    def extend(self, card_ids):
+        """Append ids that can't already be here, e.g. those of cards just created. Doesn't look for them first."""
+        self.ids += b''.join(card_id.bytes for card_id in card_ids)
+
+    def discard(self, card_id):
+        """Remove an id by moving the last one into its place, so nothing else moves. Returns whether it was here."""
+        start = self.find(card_id)
+        if start == -1:
+            return False
+        last = self.ids[-UUID_SIZE:]
+        del self.ids[-UUID_SIZE:]
+        if start < len(self.ids):
+            self.ids[start:start + UUID_SIZE] = last
+        return True
+
+
+class CardIndex:
+
+    def __init__(self, maxsize=CARD_INDEX_SIZE, check_interval=CARD_INDEX_CHECK_INTERVAL):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.rebuilds = 0
+        self.checks = 0
+
+    def versions(self, group_ids):
+        """{group_id: (card count, latest time_created)} from the database. Groups with no cards are left out."""
+        rows = db.session.execute(
+            select(Card.group_id, func.count(), func.max(Card.time_created))
+            .where(Card.group_id.in_(group_ids))
+            .group_by(Card.group_id)
+        )
+        return {group_id: (count, time_created) for group_id, count, time_created in rows}
+
+    def load(self, group_ids):
+        card_ids = {group_id: [] for group_id in group_ids}
+        rows = db.session.execute(select(Card.group_id, Card.card_id).where(Card.group_id.in_(group_ids)))
+        for group_id, card_id in rows:
+            card_ids[group_id].append(card_id)
+        return card_ids
+
+    def get(self, group_ids):
+        """[GroupCards, ...] for the given groups, checking and rebuilding any that are due"""
+        now = time.monotonic()
+        with self._lock:
+            entries = {group_id: self._groups.get(group_id) for group_id in group_ids}
+        stale = [
+            group_id for group_id, entry in entries.items()
+            if entry is None or now - entry.checked_at >= self.check_interval
+        ]
+
+        if stale:
+            self.checks += 1
+            versions = self.versions(stale)
+            changed = []
+            for group_id in stale:
+                version = versions.get(group_id, (0, None))
+                entry = entries[group_id]
+                if entry is None or not same_version(entry.version, version):
+                    changed.append(group_id)
+                else:
+                    entry.checked_at = now
+
+            if changed:
+                self.rebuilds += len(changed)
+                for group_id, card_ids in self.load(changed).items():
+                    entries[group_id] = GroupCards(card_ids, versions.get(group_id, (0, None)))
+
+            with self._lock:
+                for group_id in changed:
+                    self._groups[group_id] = entries[group_id]
+
+        with self._lock:
+            for group_id in group_ids:
+                if group_id in self._groups:
+                    self._groups.move_to_end(group_id)
+            while len(self._groups) > self.maxsize:
+                self._groups.popitem(last=False)
+
+        return list(entries.values())
+
+    def sample(self, group_ids):
+        """The id of a random card from the given groups, every card equally likely, or None if they're empty"""
+        card_ids = self.sample_many(group_ids, 1)
+        return card_ids[0] if card_ids else None
+
+    def sample_many(self, group_ids, count, exclude=()):
+        """Up to count different random card ids from the given groups, in random order, leaving out any in exclude"""
+        entries = self.get(group_ids)
+        with self._lock:
+            cumulative = []
+            total = 0
+            for entry in entries:
+                total += len(entry)
+                cumulative.append(total)
+
+            # Each excluded card can use up at most one of the positions drawn
+            picked = {}
+            for position in random.sample(range(total), min(total, count + len(exclude))):
+                i = bisect.bisect_right(cumulative, position)
+                card_id = entries[i][position - (cumulative[i - 1] if i else 0)]
+                if card_id not in exclude:
+                    picked[card_id] = None
+                    if len(picked) == count:
+                        break
+            return list(picked)
+
+    def add(self, group_id, card_ids, time_created):
+        """Cards just created in a group, the latest of them at time_created.
+
+        New ids can't be in the index yet, so they're appended without looking for them,
+        which keeps bulk imports linear. Groups that aren't in the index are loaded when
+        they're next needed.
+        """
+        card_ids = list(card_ids)
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if entry is not None and card_ids:
+                entry.extend(card_ids)
+                count, latest = entry.version
+                entry.version = (count + len(card_ids), max(latest, time_created) if latest else time_created)
+
+    def discard(self, group_id, card_ids):
+        """Cards just deleted from a group.
+
+        Their count comes off the group's version. If the latest card was deleted, the
+        version's time_created is out of date, and the group is rebuilt at its next check.
+        """
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if entry is not None:
+                removed = sum(entry.discard(card_id) for card_id in card_ids)
+                count, latest = entry.version
+                entry.version = (count - removed, latest if count > removed else None)
+
+    def invalidate(self, group_id=None):
+        """Forget a group, or all of them, so it's loaded again when it's next needed"""
+        with self._lock:
+            if group_id is None:
+                self._groups.clear()
+            else:
+                self._groups.pop(group_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'groups': len(self._groups),
+                'maxsize': self.maxsize,
+                'cards': sum(len(entry) for entry in self._groups.values()),
+                'bytes': sum(len(entry.ids) for entry in self._groups.values()),
+                'checks': self.checks,
+                'rebuilds': self.rebuilds,
+            }
+
+
+card_index = CardIndex()
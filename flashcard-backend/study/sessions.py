@@ -0,0 +1,92 @@
+"""Study sessions: batches of cards, with their distractors, that don't repeat within a session.
+
+In review mode, the cards are picked by next_card_ids, a few short index
+scans that each stop at the batch size (see study/spaced_repetition.py). In
+random mode, they're picked from the in-memory card index instead (see
+study/card_index.py), so the database never has to shuffle the user's whole
+library. Either way they're then loaded by id, with their distractors
+outer-joined onto them, so a client can fetch the next batch while the user
+works through the current one.
+
+The cards a session has been given are remembered per process, in
+session_cache. A session that has expired, or whose next batch is served by
+another worker, starts from an empty set. In review mode that rarely matters,
+as answered cards are rescheduled and drop to the back of the queue anyway.
+"""
+import os
+import uuid
+
+from sqlalchemy import select
+
+from database.db_interface import db
+from database.db_types import Card, CardDistractor, card_content_hash, user_group
+from study.card_index import card_index
+from study.spaced_repetition import next_card_ids
+from utils.cache import TTLCache, MISSING
+
+STUDY_SESSION_TTL = float(os.getenv('STUDY_SESSION_TTL', 3600))
+STUDY_SESSION_CACHE_SIZE = int(os.getenv('STUDY_SESSION_CACHE_SIZE', 10000))
+
+session_cache = TTLCache(maxsize=STUDY_SESSION_CACHE_SIZE, ttl=STUDY_SESSION_TTL)
+
+STUDY_MODES = ('review', 'random')
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def next_batch(user_id, session_id, limit, mode='review', exclude_card_ids=(), card_columns=tuple(Card.__table__.c), now=None):
+    """The next cards of a session, as [(row, incorrect_answer), ...], and remember them as seen.
+
+    In review mode, cards come in the same order as get_next_card would give them
+    one at a time: overdue, then never answered, then due soonest. In random mode
+    they're shuffled, and any deleted by another process since the card index last
+    checked their group are left out. Either way, cards in exclude_card_ids are skipped, along with
+    any this session has already been given. An empty batch means the session
+    has run out of cards.
+    """
+    key = (user_id, session_id)
+    seen = session_cache.get(key)
+    if seen is MISSING:
+        seen = set()
+    skip = seen | set(exclude_card_ids)
+
+    if mode == 'review':
+        group_ids = select(user_group.c.group_id).where(user_group.c.user_id == user_id)
+        card_ids = next_card_ids(user_id, group_ids, limit, skip, now)
+    else:
+        card_ids = random_card_ids(user_id, limit, skip)
+    if not card_ids:
+        return []
+    query = batch_query(card_columns).where(Card.card_id.in_(card_ids))
+
+    batch = {}
+    for row in db.session.execute(query):
+        incorrect_answer = batch.get(row.card_id, (None, ""))[1]
+        if row.content_hash == card_content_hash(row.question, row.correct_answer):
+            incorrect_answer = row.incorrect_answer
+        batch[row.card_id] = (row, incorrect_answer)
+
+    # In the order they were picked, rather than whatever order the database returned them in
+    batch = {card_id: batch[card_id] for card_id in card_ids if card_id in batch}
+
+    session_cache.set(key, seen | batch.keys())
+    return list(batch.values())
+
+
+def batch_query(card_columns):
+    # Stale distractors are deleted when a card changes, but one can outlive the change
+    # by a moment, so a card can have more than one row here
+    return (
+        select(*card_columns, CardDistractor.content_hash, CardDistractor.incorrect_answer)
+        .outerjoin(CardDistractor, CardDistractor.card_id == Card.card_id)
+    )
+
+
+def random_card_ids(user_id, limit, skip):
+    """Up to limit random ids of cards in the user's groups, none of them in skip"""
+    group_ids = db.session.scalars(select(user_group.c.group_id).where(user_group.c.user_id == user_id)).all()
+    if not group_ids:
+        return []
+    return card_index.sample_many(group_ids, limit, skip)
@@ -0,0 +1,117 @@
+"""SM-2 spaced repetition scheduling.
+
+Each (user, card) pair has a row in UserCardData holding its schedule. Picking
+the next cards to study is a range scan on the (user_id, due_at) index, so it
+costs the same whatever the size of the user's decks. Cards the user has
+never answered have no row there; they're found with an anti-join in card_id
+order, and only looked for once the overdue cards run out.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, select
+
+from database.db_interface import db
+from database.db_types import Card, UserCardData
+
+DEFAULT_EASE_FACTOR = 2.5
+MINIMUM_EASE_FACTOR = 1.3
+# A failed card comes back this soon, rather than waiting a full day
+RELEARN_DELAY = timedelta(minutes=10)
+
+# Answer quality, on SM-2's 0-5 scale, for a plain right/wrong answer
+QUALITY_CORRECT = 4
+QUALITY_INCORRECT = 1
+
+
+def sm2(quality, ease_factor, interval_days, repetitions, now):
+    """Apply one review to a card's schedule.
+
+    Args:
+        quality (int): How well the answer went, 0 (blackout) to 5 (perfect). 3 and up is a pass.
+        ease_factor (float): The card's current ease factor.
+        interval_days (float): The card's current interval.
+        repetitions (int): Number of passes in a row so far.
+        now (datetime): Time of the review.
+
+    Returns:
+        dict: The new ease_factor, interval_days, repetitions and due_at.
+    """
+    if quality >= 3:
+        if repetitions == 0:
+            interval_days = 1
+        elif repetitions == 1:
+            interval_days = 6
+        else:
+            interval_days = round(interval_days * ease_factor, 2)
+        repetitions += 1
+        due_at = now + timedelta(days=interval_days)
+    else:
+        repetitions = 0
+        interval_days = 0
+        due_at = now + RELEARN_DELAY
+
+    ease_factor = ease_factor + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    ease_factor = max(MINIMUM_EASE_FACTOR, ease_factor)
+
+    return {
+        'ease_factor': ease_factor,
+        'interval_days': interval_days,
+        'repetitions': repetitions,
+        'due_at': due_at,
+    }
+
+
+def next_card_ids(user_id, group_ids, limit, exclude_card_ids=(), now=None):
+    """Ids of the next cards this user should study, from the given groups, best first.
+
+    In order of preference:
+    - overdue cards, most overdue first,
+    - cards the user has never answered, in card_id order,
+    - cards that will be due soonest.
+
+    Each of those is its own query with its own LIMIT, walking an index, and the later
+    ones only run if the earlier ones didn't fill the batch. group_ids can be a list, or
+    a select of them. exclude_card_ids skips cards, e.g. those already given out.
+    """
+    now = now or datetime.now()
+    exclude_card_ids = list(exclude_card_ids)
+
+    def scheduled(*conditions):
+        query = (
+            select(UserCardData.card_id)
+            .join(Card, Card.card_id == UserCardData.card_id)
+            .where(UserCardData.user_id == user_id, Card.group_id.in_(group_ids), *conditions)
+        )
+        if exclude_card_ids:
+            query = query.where(UserCardData.card_id.not_in(exclude_card_ids))
+        return query.order_by(UserCardData.due_at)
+
+    card_ids = db.session.scalars(scheduled(UserCardData.due_at <= now).limit(limit)).all()
+
+    if len(card_ids) < limit:
+        answered = exists().where(UserCardData.user_id == user_id, UserCardData.card_id == Card.card_id)
+        unseen = select(Card.card_id).where(Card.group_id.in_(group_ids), ~answered)
+        if exclude_card_ids:
+            unseen = unseen.where(Card.card_id.not_in(exclude_card_ids))
+        card_ids += db.session.scalars(unseen.order_by(Card.card_id).limit(limit - len(card_ids))).all()
+
+    if len(card_ids) < limit:
+        upcoming = scheduled(UserCardData.due_at > now).limit(limit - len(card_ids))
+        card_ids += db.session.scalars(upcoming).all()
+
+    return card_ids
+
+
+def get_next_card(user_id, group_ids, exclude_card_ids=None, now=None):
+    """The card this user should study next, from the given groups. See next_card_ids.
+
+    exclude_card_ids skips cards whose answers haven't been written out yet.
+    """
+    if not group_ids:
+        return None
+
+    card_ids = next_card_ids(user_id, group_ids, 1, exclude_card_ids or (), now)
+    if not card_ids and exclude_card_ids:
+        # Everything has just been answered - better to repeat a card than show nothing
+        card_ids = next_card_ids(user_id, group_ids, 1, now=now)
+    return db.session.get(Card, card_ids[0]) if card_ids else None
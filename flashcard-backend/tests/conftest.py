@@ -0,0 +1,88 @@
+"""Shared fixtures.
+
+Tests run the app against a throwaway SQLite database, or the database in
+TEST_DATABASE_URI if that's set. Every table is emptied after each test that
+uses the database, so only ever point that at a scratch one.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# database.db_interface insists on these being set, and builds its URI from them on import
+for name, value in {
+    'DATABASE_ENGINE': 'sqlite',
+    'DATABASE_USERNAME': 'test',
+    'DATABASE_PASSWORD': 'test',
+    'DATABASE_HOST': 'localhost',
+    'DATABASE_PORT': '0',
+    'DATABASE_NAME': 'test',
+    'JWT_SECRET_KEY': 'test-secret-key-that-is-long-enough-for-hs256',
+}.items():
+    os.environ.setdefault(name, value)
+
+import database.db_interface as db_interface  # noqa: E402
+
+_database_dir = tempfile.TemporaryDirectory()
+TEST_DATABASE_URI = os.getenv('TEST_DATABASE_URI') or f"sqlite:///{os.path.join(_database_dir.name, 'test.db')}"
+db_interface.DATABASE_URI = TEST_DATABASE_URI
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app, setup_database
+
+    app = create_app('none')
+    app.config['TESTING'] = True
+    with app.app_context():
+        setup_database()
+    return app
+
+
+def empty_tables(app):
+    from database.db_interface import db
+
+    with app.app_context():
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def empty_db(app):
+    """Empties every table once the test is done"""
+    yield
+    empty_tables(app)
+
+
+@pytest.fixture
+def app_context(app, empty_db):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture
+def client(app, empty_db):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app, empty_db):
+    """Creates a user. Returns (user id, headers that authenticate as them)."""
+    from flask_jwt_extended import create_access_token
+
+    from database.db_interface import db
+    from database.db_types import User
+
+    def make_user(username=None):
+        username = username or f"user-{uuid.uuid4().hex[:12]}"
+        with app.app_context():
+            user = User(username=username, email=f"{username}@example.com", password_hash="-")
+            db.session.add(user)
+            db.session.commit()
+            token = create_access_token(identity=str(user.id))
+            return user.id, {'Authorization': f"Bearer {token}"}
+
+    return make_user
@@ -0,0 +1,125 @@
+import threading
+import uuid
+
+import pytest
+
+from database.db_interface import db
+from database.db_types import Card, Group, UserCardData
+from database.query_count import count_queries
+from study.answer_buffer import ANSWER_FLUSH_MAX_ATTEMPTS, AnswerBuffer
+
+
+@pytest.fixture
+def cards(app_context, make_user):
+    user_id, _ = make_user()
+    group = Group(group_name="Answered", creator_id=user_id)
+    db.session.add(group)
+    db.session.flush()
+    cards = [Card(question=f"q{i}", correct_answer="a", group_id=group.group_id, creator_id=user_id) for i in range(3)]
+    db.session.add_all(cards)
+    db.session.commit()
+    return user_id, [card.card_id for card in cards]
+
+
+@pytest.fixture
+def buffer(app):
+    buffer = AnswerBuffer(flush_interval=60)
+    buffer.app = app
+    return buffer
+
+
+def card_data(user_id, card_id):
+    db.session.expire_all()
+    return db.session.get(UserCardData, (user_id, card_id))
+
+
+def fail_for(monkeypatch, bad_card_id):
+    """Make every write that includes an answer to bad_card_id fail, as a foreign key error would"""
+    write = AnswerBuffer._write
+
+    def _write(self, events):
+        if any(event.card_id == bad_card_id for event in events):
+            raise RuntimeError("foreign key constraint fails")
+        return write(self, events)
+
+    monkeypatch.setattr(AnswerBuffer, '_write', _write)
+
+
+def test_answers_to_the_same_card_are_written_together(cards, buffer):
+    user_id, card_ids = cards
+    for quality in (5, 1, 4):
+        buffer.add(user_id, card_ids[0], quality)
+    buffer.add(user_id, card_ids[1], 4)
+
+    # One read of the current schedules, and one upsert
+    with count_queries(max_queries=2):
+        assert buffer.flush() == 4
+
+    first = card_data(user_id, card_ids[0])
+    assert (first.times_answered, first.times_answered_incorrectly) == (3, 1)
+    assert card_data(user_id, card_ids[1]).times_answered == 1
+    assert buffer.queue_depth == 0
+
+
+def test_answers_add_on_to_those_already_written(cards, buffer):
+    user_id, card_ids = cards
+    buffer.add(user_id, card_ids[0], 4)
+    buffer.flush()
+    buffer.add(user_id, card_ids[0], 4)
+    buffer.flush()
+
+    assert card_data(user_id, card_ids[0]).times_answered == 2
+
+
+def test_a_failed_flush_is_retried(cards, buffer, monkeypatch):
+    user_id, card_ids = cards
+    buffer.add(user_id, card_ids[0], 4)
+
+    fail_for(monkeypatch, card_ids[0])
+    assert buffer.flush() == 0
+    assert buffer.queue_depth == 1
+
+    monkeypatch.undo()
+    assert buffer.flush() == 1
+    assert card_data(user_id, card_ids[0]).times_answered == 1
+
+
+def test_one_bad_answer_doesnt_hold_up_the_rest(cards, buffer, make_user, monkeypatch):
+    user_id, card_ids = cards
+    other_user_id, _ = make_user()
+    for card_id in card_ids:
+        buffer.add(user_id, card_id, 4)
+    buffer.add(other_user_id, card_ids[1], 4)
+    fail_for(monkeypatch, card_ids[0])
+
+    assert buffer.flush() == 3
+    assert card_data(user_id, card_ids[1]).times_answered == 1
+    assert card_data(user_id, card_ids[2]).times_answered == 1
+    assert card_data(user_id, card_ids[0]) is None
+
+    # The bad one is retried, then dropped
+    for _ in range(ANSWER_FLUSH_MAX_ATTEMPTS - 1):
+        assert buffer.queue_depth == 1
+        buffer.flush()
+    assert buffer.queue_depth == 0
+    assert buffer.stats()['events_flushed'] == 3
+
+
+def test_pending_answers_are_reported_per_user(cards, buffer):
+    user_id, card_ids = cards
+    buffer.add(user_id, card_ids[0], 4)
+    buffer.add(uuid.uuid4(), card_ids[1], 4)
+
+    assert buffer.pending_card_ids(user_id) == {card_ids[0]}
+
+
+def test_shutdown_writes_whatever_is_left(cards, buffer):
+    user_id, card_ids = cards
+    buffer._thread = threading.Thread(target=buffer._run, daemon=True)
+    buffer._thread.start()
+    buffer.add(user_id, card_ids[0], 4)
+
+    buffer.shutdown()
+
+    assert not buffer._thread.is_alive()
+    assert card_data(user_id, card_ids[0]).times_answered == 1
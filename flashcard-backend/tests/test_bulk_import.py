@@ -0,0 +1,92 @@
+import json
+import uuid
+
+import pytest
+
+import data_imports.bulk_import as bulk_import
+from database.db_interface import db
+from database.db_types import Card, Group
+from database.query_count import count_queries
+
+
+@pytest.fixture
+def group(client, make_user):
+    _, headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Imported"}, headers=headers).get_json()['group_id']
+    return group_id, headers
+
+
+def import_body(client, group, body, content_type):
+    group_id, headers = group
+    return client.post(f"/api/cards/bulk?group_id={group_id}", data=body, content_type=content_type, headers=headers)
+
+
+def group_questions(app, group_id):
+    with app.app_context():
+        return sorted(db.session.scalars(db.select(Card.question).where(Card.group_id == group_id)))
+
+
+def test_json_imports_report_their_card_ids(client, group, app):
+    group_id, headers = group
+    cards = [{'question': f"q{i}", 'correct_answer': "a"} for i in range(3)]
+    response = client.post("/api/cards/bulk", json={'group_id': group_id, 'cards': cards}, headers=headers)
+
+    assert response.status_code == 201
+    assert len(response.get_json()['card_ids']) == 3
+    assert group_questions(app, group_id) == ["q0", "q1", "q2"]
+
+
+def test_ndjson_imports_skip_bad_rows(client, group, app):
+    lines = [
+        json.dumps({'question': "q1", 'correct_answer': "a"}),
+        "not json",
+        "",
+        json.dumps({'question': "q2"}),
+        json.dumps(["q3", "a"]),
+        json.dumps({'question': "q4", 'correct_answer': "a"}),
+    ]
+    response = import_body(client, group, "\n".join(lines), 'application/x-ndjson')
+
+    result = response.get_json()
+    assert response.status_code == 201
+    assert (result['created'], result['error_count']) == (2, 3)
+    assert [error['row'] for error in result['errors']] == [2, 4, 5]
+    assert group_questions(app, group[0]) == ["q1", "q4"]
+
+
+def test_csv_imports_skip_the_header_and_bad_rows(client, group, app):
+    body = 'question,correct_answer\nq1,a\n"q2, with a comma",b\nq3\nq4,a,extra\n'
+    response = import_body(client, group, body, 'text/csv')
+
+    result = response.get_json()
+    assert (result['created'], result['error_count']) == (2, 2)
+    assert [error['row'] for error in result['errors']] == [4, 5]
+    assert group_questions(app, group[0]) == ["q1", "q2, with a comma"]
+
+
+def test_imports_with_nothing_valid_fail(client, group):
+    response = import_body(client, group, "q1\nq2\n", 'text/csv')
+    assert response.status_code == 400
+    assert response.get_json()['created'] == 0
+
+
+def test_imports_into_someone_elses_group_are_refused(client, group, make_user):
+    _, headers = make_user()
+    response = client.post(f"/api/cards/bulk?group_id={group[0]}", data="q,a\n", content_type='text/csv',
+                           headers=headers)
+    assert response.status_code == 403
+
+
+def test_rows_are_inserted_and_committed_a_chunk_at_a_time(group, app):
+    with app.app_context():
+        group_row = db.session.get(Group, uuid.UUID(group[0]))
+        importer = bulk_import.BulkCardImporter(group_row.group_id, group_row.creator_id, chunk_size=10)
+        rows = bulk_import.csv_rows(f"q{i},a\n" for i in range(25))
+
+        with count_queries() as counter:
+            result = bulk_import.import_cards(importer, rows)
+
+    assert result['created'] == 25
+    # One INSERT per chunk of ten
+    assert counter.count == 3
+    assert len(group_questions(app, group[0])) == 25
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.cache as cache
+from utils.cache import MISSING, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for time.monotonic in utils/cache.py. Move it on with clock.now += seconds."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_entries_expire_after_the_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=30)
+    entries.set('a', 1)
+
+    clock.now += 29
+    assert entries.get('a') == 1
+    clock.now += 2
+    assert entries.get('a') is MISSING
+    assert len(entries) == 0
+
+
+def test_none_can_be_cached():
+    entries = TTLCache(maxsize=10, ttl=30)
+    entries.set('a', None)
+    assert entries.get('a') is None
+    assert entries.get('b', 'default') == 'default'
+
+
+def test_the_least_recently_used_entry_is_evicted(clock):
+    entries = TTLCache(maxsize=2, ttl=30)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    entries.get('a')
+    entries.set('c', 3)
+
+    assert entries.get('b') is MISSING
+    assert (entries.get('a'), entries.get('c')) == (1, 3)
+    assert entries.evictions == 1
+
+
+def test_setting_an_entry_again_restarts_its_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=30)
+    entries.set('a', 1)
+    clock.now += 20
+    entries.set('a', 2)
+    clock.now += 20
+
+    assert entries.get('a') == 2
+
+
+def test_delete_where_only_deletes_matching_keys():
+    entries = TTLCache(maxsize=10, ttl=30)
+    for key in [('u1', 'g1'), ('u1', 'g2'), ('u2', 'g1')]:
+        entries.set(key, True)
+
+    entries.delete_where(lambda key: key[1] == 'g1')
+
+    assert entries.get(('u1', 'g2')) is True
+    assert len(entries) == 1
+
+
+def test_stats_count_hits_and_misses():
+    entries = TTLCache(maxsize=10, ttl=30)
+    entries.set('a', 1)
+    entries.get('a')
+    entries.get('a')
+    entries.get('b')
+
+    stats = entries.stats()
+    assert (stats['size'], stats['hits'], stats['misses']) == (1, 2, 1)
+    assert stats['hit_ratio'] == pytest.approx(2 / 3, abs=1e-4)
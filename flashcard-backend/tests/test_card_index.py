@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_imports.bulk_import as bulk_import
+from data_imports.bulk_import import BulkCardImporter
+from database.db_interface import db
+from database.db_types import Card, Group
+from study.card_index import CardIndex, same_version
+
+
+@pytest.fixture
+def group(app_context, make_user):
+    user_id, _ = make_user()
+    group = Group(group_name="Indexed", creator_id=user_id)
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+
+@pytest.fixture
+def index():
+    # Checks the database on every get(), so a stale version always shows up as a rebuild
+    return CardIndex(check_interval=0)
+
+
+def create_cards(group, count, when=None):
+    when = when or datetime.now()
+    cards = [
+        Card(question=f"question {i}", correct_answer="answer", group_id=group.group_id,
+             creator_id=group.creator_id, time_created=when, time_updated=when)
+        for i in range(count)
+    ]
+    db.session.add_all(cards)
+    db.session.commit()
+    return cards
+
+
+def indexed_ids(index, group):
+    entry = index.get([group.group_id])[0]
+    return {entry[i] for i in range(len(entry))}
+
+
+def test_same_version_allows_for_rounding_to_the_second():
+    now = datetime(2024, 1, 1, 12, 0, 0, 600000)
+    assert same_version((3, now), (3, now.replace(microsecond=0) + timedelta(seconds=1)))
+    assert not same_version((3, now), (4, now))
+    assert not same_version((3, now), (3, now + timedelta(seconds=5)))
+    assert same_version((0, None), (0, None))
+
+
+def test_added_cards_need_no_rebuild(group, index):
+    create_cards(group, 3)
+    index.get([group.group_id])
+
+    added = create_cards(group, 2)
+    index.add(group.group_id, [card.card_id for card in added], added[-1].time_created)
+
+    assert len(indexed_ids(index, group)) == 5
+    assert index.rebuilds == 1
+
+
+def test_discarded_cards_need_no_rebuild(group, index):
+    cards = create_cards(group, 3, datetime.now() - timedelta(minutes=1))
+    create_cards(group, 1)
+    index.get([group.group_id])
+
+    db.session.delete(cards[0])
+    db.session.commit()
+    index.discard(group.group_id, [cards[0].card_id])
+
+    assert cards[0].card_id not in indexed_ids(index, group)
+    assert index.rebuilds == 1
+
+
+def test_cards_changed_elsewhere_are_picked_up(group, index):
+    create_cards(group, 3)
+    index.get([group.group_id])
+
+    create_cards(group, 1)
+
+    assert len(indexed_ids(index, group)) == 4
+    assert index.rebuilds == 2
+
+
+def test_bulk_import_keeps_the_index_current(group, index, monkeypatch):
+    monkeypatch.setattr(bulk_import, 'card_index', index)
+    create_cards(group, 1)
+    index.get([group.group_id])
+
+    importer = BulkCardImporter(group.group_id, group.creator_id, chunk_size=10, keep_card_ids=True)
+    for row_number in range(25):
+        importer.add(row_number, f"imported {row_number}", "answer")
+    importer.flush()
+
+    ids = indexed_ids(index, group)
+    assert len(ids) == 26
+    assert set(importer.card_ids) <= ids
+    assert index.rebuilds == 1
+
+
+def test_sample_many_picks_different_cards_and_skips_excluded(group, index):
+    cards = create_cards(group, 10)
+    excluded = {card.card_id for card in cards[:4]}
+
+    picked = index.sample_many([group.group_id], 10, excluded)
+
+    assert len(picked) == 6
+    assert set(picked) == {card.card_id for card in cards} - excluded
+
+
+def test_random_sessions_come_from_the_card_index(client, make_user, monkeypatch):
+    import study.sessions as sessions
+
+    index = CardIndex()
+    monkeypatch.setattr(sessions, 'card_index', index)
+    _, headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Random"}, headers=headers).get_json()['group_id']
+    for i in range(5):
+        client.post("/api/cards", json={'question': f"q{i}", 'correct_answer': "a", 'group_id': group_id}, headers=headers)
+
+    first = client.get("/api/cards/session?mode=random&limit=3", headers=headers).get_json()
+    rest = client.get(f"/api/cards/session?mode=random&limit=3&session={first['session']}", headers=headers).get_json()
+    done = client.get(f"/api/cards/session?mode=random&limit=3&session={first['session']}", headers=headers).get_json()
+
+    assert (len(first['cards']), len(rest['cards']), len(done['cards'])) == (3, 2, 0)
+    assert len({card['card_id'] for card in first['cards'] + rest['cards']}) == 5
+    assert index.stats()['groups'] == 1
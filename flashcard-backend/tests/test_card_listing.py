@@ -0,0 +1,59 @@
+import pytest
+
+
+@pytest.fixture
+def library(client, make_user):
+    """A user in two groups, one of them empty, with someone else's group alongside"""
+    _, headers = make_user()
+    _, other_headers = make_user()
+
+    def create_group(name, cards, headers):
+        group_id = client.post("/api/groups", json={'group_name': name}, headers=headers).get_json()['group_id']
+        for i in range(cards):
+            client.post("/api/cards", json={'question': f"{name} {i}", 'correct_answer': "a", 'group_id': group_id},
+                        headers=headers)
+        return group_id
+
+    groups = {
+        'full': create_group("Full", 7, headers),
+        'empty': create_group("Empty", 0, headers),
+    }
+    create_group("Someone else's", 3, other_headers)
+    return headers, groups
+
+
+def test_cards_are_listed_by_group(client, library):
+    headers, groups = library
+    response = client.get("/api/cards", headers=headers)
+
+    assert response.is_streamed
+    cards_by_group = response.get_json()
+    assert set(cards_by_group) == {groups['full'], groups['empty']}
+    assert len(cards_by_group[groups['full']]) == 7
+    assert cards_by_group[groups['empty']] == []
+
+
+def test_pages_cover_every_card_once(client, library):
+    headers, groups = library
+    card_ids = []
+    path = "/api/cards?limit=3"
+    while path:
+        page = client.get(path, headers=headers).get_json()
+        assert len(page['cards']) <= 3
+        card_ids += [card['card_id'] for card in page['cards']]
+        path = page['next_after'] and f"/api/cards?limit=3&after={page['next_after']}"
+
+    assert len(card_ids) == 7
+    assert card_ids == sorted(set(card_ids))
+
+
+def test_users_with_no_groups_get_nothing(client, make_user):
+    _, headers = make_user()
+    assert client.get("/api/cards", headers=headers).get_json() == {}
+    assert client.get("/api/cards?limit=10", headers=headers).get_json() == {'cards': [], 'next_after': None}
+
+
+@pytest.mark.parametrize('query', ["limit=0", "limit=100000", "limit=ten", "after=not-a-card"])
+def test_bad_pages_are_rejected(client, library, query):
+    headers, _ = library
+    assert client.get(f"/api/cards?{query}", headers=headers).status_code == 400
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils.http_cache as http_cache
+from database.db_interface import db
+from database.db_types import Card, Group
+
+
+@pytest.fixture
+def deck(app, client, make_user, monkeypatch):
+    """A group of three cards, last changed an hour ago, so its version is settled"""
+    monkeypatch.setattr(http_cache, 'CACHE_SETTLE_SECONDS', 0)
+    _, headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Deck"}, headers=headers).get_json()['group_id']
+    for i in range(3):
+        client.post("/api/cards", json={'question': f"q{i}", 'correct_answer': "a", 'group_id': group_id}, headers=headers)
+
+    an_hour_ago = datetime.now() - timedelta(hours=1)
+    with app.app_context():
+        db.session.execute(db.update(Card).values(time_updated=an_hour_ago))
+        db.session.execute(db.update(Group).values(time_updated=an_hour_ago))
+        db.session.commit()
+        card_ids = [str(card_id) for card_id in db.session.scalars(db.select(Card.card_id).order_by(Card.card_id))]
+
+    return headers, group_id, card_ids
+
+
+def test_deleting_a_card_invalidates_if_modified_since(client, deck):
+    headers, group_id, card_ids = deck
+    response = client.get(f"/api/groups/{group_id}/cards", headers=headers)
+    assert response.status_code == 200
+    last_modified = response.headers['Last-Modified']
+
+    assert client.delete(f"/api/cards/{card_ids[-1]}", headers=headers).status_code == 200
+
+    response = client.get(f"/api/groups/{group_id}/cards", headers={**headers, 'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+
+def test_unchanged_deck_is_not_modified(client, deck):
+    headers, group_id, _ = deck
+    response = client.get(f"/api/groups/{group_id}/cards", headers=headers)
+
+    by_date = client.get(f"/api/groups/{group_id}/cards", headers={
+        **headers, 'If-Modified-Since': response.headers['Last-Modified'],
+    })
+    by_etag = client.get(f"/api/groups/{group_id}/cards", headers={**headers, 'If-None-Match': response.headers['ETag']})
+
+    assert by_date.status_code == 304
+    assert by_etag.status_code == 304
+
+
+def test_group_list_is_not_modified_until_a_group_changes(client, make_user):
+    _, headers = make_user()
+    client.post("/api/groups", json={'group_name': "First"}, headers=headers)
+    response = client.get("/api/groups", headers=headers)
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    etag = response.headers['ETag']
+
+    assert client.get("/api/groups", headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    client.post("/api/groups", json={'group_name': "Second"}, headers=headers)
+    response = client.get("/api/groups", headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['groups']) == 2
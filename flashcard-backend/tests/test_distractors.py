@@ -0,0 +1,137 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import llm.llm as llm
+import llm.providers as providers
+from database.db_interface import db
+from database.db_types import Card, CardDistractor, Group
+from llm.distractor_worker import DistractorWorker
+from llm.providers import FakeProvider, NullProvider
+
+CARDS = [
+    {'id': "1", 'question': "2 + 2", 'correct_answer': "4"},
+    {'id': "2", 'question': "3 + 3", 'correct_answer': "6"},
+]
+
+
+def reply_with(*answers):
+    return lambda cards: json.dumps({'answers': [{'id': id, 'incorrect_answer': answer} for id, answer in answers]})
+
+
+def stub_client(monkeypatch, reply):
+    """Have get_incorrect_answers talk to a client that always replies with reply"""
+    message = SimpleNamespace(content=reply)
+    response = SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+    completions = SimpleNamespace(create=lambda **kwargs: response)
+    monkeypatch.setattr(llm, 'get_client', lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+
+def test_fake_provider_answers_every_card():
+    assert FakeProvider().generate(CARDS) == {"1": "Not 4", "2": "Not 6"}
+
+
+def test_answers_the_model_skipped_are_missing():
+    provider = FakeProvider(reply=reply_with(("1", "5")))
+    assert provider.generate(CARDS) == {"1": "5"}
+
+
+def test_answers_for_cards_that_werent_asked_about_are_dropped():
+    provider = FakeProvider(reply=reply_with(("1", "5"), ("2", " "), ("3", "7"), ("1", "3")))
+    assert provider.generate(CARDS) == {"1": "3"}
+
+
+@pytest.mark.parametrize('reply', ["The answers are 5 and 7", '["5", "7"]', '{"answers": "5, 7"}'])
+def test_malformed_replies_raise(reply):
+    with pytest.raises(ValueError):
+        FakeProvider(reply=lambda cards: reply).generate(CARDS)
+
+
+def test_get_incorrect_answers_parses_the_reply(monkeypatch):
+    stub_client(monkeypatch, reply_with(("2", "8"))(CARDS))
+    assert llm.get_incorrect_answers(CARDS) == {"2": "8"}
+
+
+def test_get_incorrect_answers_raises_on_a_malformed_reply(monkeypatch):
+    stub_client(monkeypatch, "Sorry, I can't help with that")
+    with pytest.raises(ValueError):
+        llm.get_incorrect_answers(CARDS)
+
+
+def test_an_unknown_provider_means_no_distractors(monkeypatch):
+    monkeypatch.setattr(providers, 'LLM_PROVIDER', 'nonexistent')
+    worker = DistractorWorker()
+
+    assert not worker.available
+    assert isinstance(worker.provider, NullProvider)
+
+
+@pytest.fixture
+def card_ids(app_context, make_user):
+    user_id, _ = make_user()
+    group = Group(group_name="Distracted", creator_id=user_id)
+    db.session.add(group)
+    db.session.flush()
+    cards = [Card(question=f"{i} + {i}", correct_answer=str(2 * i), group_id=group.group_id, creator_id=user_id)
+             for i in range(5)]
+    db.session.add_all(cards)
+    db.session.commit()
+    return [card.card_id for card in cards]
+
+
+@pytest.fixture
+def run(app):
+    """Run a DistractorWorker with the given provider over some cards, and return its stats"""
+    workers = []
+
+    def run(provider, card_ids):
+        worker = DistractorWorker(provider=provider, batch_size=2, max_workers=2, max_attempts=2, retry_backoff=0)
+        worker.init_app(app)
+        workers.append(worker)
+        return worker.run(card_ids)
+
+    yield run
+    for worker in workers:
+        worker.shutdown()
+
+
+def distractors():
+    db.session.expire_all()
+    return {distractor.card_id: distractor.incorrect_answer for distractor in CardDistractor.query}
+
+
+def test_worker_stores_a_distractor_per_card(card_ids, run):
+    provider = FakeProvider()
+    stats = run(provider, card_ids)
+
+    assert (stats.cards_generated, stats.batches, stats.failed_batches) == (5, 3, 0)
+    assert provider.calls == 3
+    assert set(distractors()) == set(card_ids)
+
+
+def test_worker_skips_cards_that_already_have_one(card_ids, run):
+    run(FakeProvider(), card_ids[:3])
+    provider = FakeProvider()
+
+    assert run(provider, card_ids).cards_generated == 2
+    # Batches are split up before checking, so the first one, already done, never gets to the model
+    assert provider.calls == 2
+
+
+def test_worker_stores_what_it_gets_and_leaves_the_rest_for_later(card_ids, run):
+    # The model only ever answers for the first card in each batch
+    first_only = FakeProvider(reply=lambda cards: FakeProvider.well_formed_reply(cards[:1]))
+    assert run(first_only, card_ids).cards_generated == 3
+
+    assert run(FakeProvider(), card_ids).cards_generated == 2
+    assert set(distractors()) == set(card_ids)
+
+
+def test_worker_retries_malformed_replies_then_gives_up(card_ids, run):
+    provider = FakeProvider(reply=lambda cards: "not json")
+    stats = run(provider, card_ids)
+
+    assert (stats.cards_generated, stats.failed_batches, stats.retries) == (0, 3, 3)
+    assert provider.calls == 6
+    assert distractors() == {}
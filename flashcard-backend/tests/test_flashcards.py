@@ -0,0 +1,107 @@
+import uuid
+
+import pytest
+
+import llm.distractors as distractors
+from database.db_interface import db
+from database.db_types import CardDistractor
+from llm.distractor_worker import DistractorWorker
+from llm.providers import FakeProvider
+from study.answer_buffer import answer_buffer
+
+CARDS = 5
+
+
+@pytest.fixture
+def deck(client, make_user, app, monkeypatch):
+    """A user subscribed to a group of cards, with answers written out as soon as they're flushed"""
+    monkeypatch.setattr(answer_buffer, 'app', app)
+    _, headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Deck"}, headers=headers).get_json()['group_id']
+    for i in range(CARDS):
+        client.post("/api/cards", json={'question': f"q{i}", 'correct_answer': "a", 'group_id': group_id}, headers=headers)
+    yield headers
+    answer_buffer.flush()
+
+
+def next_card(client, headers, mode=None):
+    path = "/api/cards/flashcard" + (f"?mode={mode}" if mode else "")
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_review_mode_gives_the_same_card_until_it_is_answered(client, deck):
+    assert next_card(client, deck, 'review')['card_id'] == next_card(client, deck, 'review')['card_id']
+
+
+def test_answering_a_card_moves_review_mode_on(client, deck):
+    seen = []
+    for _ in range(CARDS):
+        card_id = next_card(client, deck, 'review')['card_id']
+        assert card_id not in seen
+        seen.append(card_id)
+        response = client.post(f"/api/cards/{card_id}/answer", json={'correct': True}, headers=deck)
+        assert response.status_code == 202
+        answer_buffer.flush()
+
+    assert len(set(seen)) == CARDS
+
+
+def test_random_is_the_default(client, deck):
+    card_ids = {next_card(client, deck)['card_id'] for _ in range(30)}
+    assert len(card_ids) > 1
+
+
+def test_unknown_modes_are_rejected(client, deck):
+    assert client.get("/api/cards/flashcard?mode=shuffle", headers=deck).status_code == 400
+
+
+def stored_distractors(app):
+    with app.app_context():
+        return {row.card_id: row.incorrect_answer for row in db.session.scalars(db.select(CardDistractor))}
+
+
+@pytest.fixture
+def backfill(app, monkeypatch):
+    """fill_missing_distractors, generating with the fake model"""
+    worker = DistractorWorker(provider=FakeProvider(), max_workers=1)
+    worker.init_app(app)
+    monkeypatch.setattr(distractors, 'distractor_worker', worker)
+    monkeypatch.setattr(distractors, '_backfill_cursor', None)
+
+    def backfill():
+        with app.app_context():
+            return distractors.fill_missing_distractors()
+
+    yield backfill
+    worker.shutdown()
+
+
+def test_flashcards_come_with_their_stored_incorrect_answer(client, deck, app, backfill, monkeypatch):
+    assert backfill() == CARDS
+    stored = stored_distractors(app)
+
+    # Nothing on the request path asks the model for anything
+    monkeypatch.setattr(DistractorWorker, 'run', lambda self, card_ids: pytest.fail("Called the model"))
+    for _ in range(10):
+        card = next_card(client, deck)
+        assert card['incorrect_answer'] == stored[uuid.UUID(card['card_id'])]
+
+
+def test_backfill_only_generates_whats_missing(deck, backfill):
+    assert backfill() == CARDS
+    assert backfill() == 0
+
+
+def test_editing_a_card_drops_its_stale_incorrect_answer(client, deck, app, backfill):
+    backfill()
+    card = next_card(client, deck, 'review')
+
+    response = client.put(f"/api/cards/{card['card_id']}", json={'correct_answer': "b"}, headers=deck)
+    assert response.status_code == 200
+
+    assert next_card(client, deck, 'review')['incorrect_answer'] == ""
+    assert uuid.UUID(card['card_id']) not in stored_distractors(app)
+    assert len(stored_distractors(app)) == CARDS - 1
+    assert backfill() == 1
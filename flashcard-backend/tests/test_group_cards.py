@@ -0,0 +1,59 @@
+import pytest
+
+CARDS = 5
+
+
+@pytest.fixture
+def group(client, make_user):
+    """A group of cards, as seen by its creator (a member) and by someone else"""
+    _, member_headers = make_user()
+    _, outsider_headers = make_user()
+    group_id = client.post(
+        "/api/groups", json={'group_name': "Subscribed to"}, headers=member_headers,
+    ).get_json()['group_id']
+    for i in range(CARDS):
+        client.post("/api/cards", json={'question': f"q{i}", 'correct_answer': "a", 'group_id': group_id},
+                    headers=member_headers)
+    return group_id, member_headers, outsider_headers
+
+
+def test_cards_say_whether_the_user_is_subscribed(client, group):
+    group_id, member, outsider = group
+    for headers, subscribed in ((member, True), (outsider, False)):
+        cards = client.get(f"/api/groups/{group_id}/cards", headers=headers).get_json()
+        assert len(cards) == CARDS
+        assert {card['subscribed'] for card in cards} == {subscribed}
+
+
+def test_group_info_says_whether_the_user_is_subscribed(client, group):
+    group_id, member, outsider = group
+    assert client.get(f"/api/groups/{group_id}", headers=member).get_json()['subscribed'] is True
+    assert client.get(f"/api/groups/{group_id}", headers=outsider).get_json()['subscribed'] is False
+
+
+def test_search_results_say_whether_the_user_is_subscribed(client, group):
+    _, member, outsider = group
+    for headers, subscribed in ((member, True), (outsider, False)):
+        results = client.get("/api/groups/search?group_name=subscribed", headers=headers).get_json()
+        assert [result['subscribed'] for result in results] == [subscribed]
+
+
+def test_only_the_fields_asked_for_are_returned(client, group):
+    group_id, member, _ = group
+    cards = client.get(f"/api/groups/{group_id}/cards?fields=question,card_id", headers=member).get_json()
+    assert {frozenset(card) for card in cards} == {frozenset(['question', 'card_id'])}
+
+    response = client.get(f"/api/groups/{group_id}/cards?fields=question,owner", headers=member)
+    assert response.status_code == 400
+
+
+def test_pages_cover_every_card_once(client, group):
+    group_id, member, _ = group
+    questions = []
+    path = f"/api/groups/{group_id}/cards?limit=2&fields=question"
+    while path:
+        page = client.get(path, headers=member).get_json()
+        questions += [card['question'] for card in page['cards']]
+        path = page['next_after'] and f"/api/groups/{group_id}/cards?limit=2&fields=question&after={page['next_after']}"
+
+    assert sorted(questions) == [f"q{i}" for i in range(CARDS)]
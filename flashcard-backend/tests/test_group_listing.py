@@ -0,0 +1,63 @@
+import pytest
+
+
+@pytest.fixture
+def groups(client, make_user):
+    """Five groups, the first with three subscribers and the rest with just their creator"""
+    _, headers = make_user()
+    group_ids = [
+        client.post("/api/groups", json={'group_name': f"Group {i}"}, headers=headers).get_json()['group_id']
+        for i in range(5)
+    ]
+    for _ in range(2):
+        _, member_headers = make_user()
+        client.post(f"/api/groups/{group_ids[0]}/join", headers=member_headers)
+    return group_ids, headers
+
+
+def list_groups(client, headers, path="/api/groups"):
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_groups_come_with_subscriber_counts(client, groups):
+    group_ids, headers = groups
+    listed = {group['group_id']: group for group in list_groups(client, headers)['groups']}
+
+    assert listed[group_ids[0]]['subscriber_count'] == 3
+    assert {listed[group_id]['subscriber_count'] for group_id in group_ids[1:]} == {1}
+    assert 'subscribers' not in listed[group_ids[0]]
+
+
+def test_pages_cover_every_group_once(client, groups):
+    group_ids, headers = groups
+    listed = []
+    path = "/api/groups?limit=2"
+    while path:
+        page = list_groups(client, headers, path)
+        assert len(page['groups']) <= 2
+        listed += [group['group_id'] for group in page['groups']]
+        path = page['next_after'] and f"/api/groups?limit=2&after={page['next_after']}"
+
+    assert sorted(listed) == sorted(group_ids)
+    assert len(listed) == len(group_ids)
+
+
+def test_joining_a_group_changes_the_etag(client, groups, make_user):
+    group_ids, headers = groups
+    etag = client.get("/api/groups", headers=headers).headers['ETag']
+    assert client.get("/api/groups", headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    _, member_headers = make_user()
+    client.post(f"/api/groups/{group_ids[1]}/join", headers=member_headers)
+
+    response = client.get("/api/groups", headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('query', ["limit=0", "limit=100000", "limit=some", "after=not-a-group"])
+def test_bad_pages_are_rejected(client, groups, query):
+    _, headers = groups
+    assert client.get(f"/api/groups?{query}", headers=headers).status_code == 400
@@ -0,0 +1,76 @@
+import uuid
+
+import pytest
+
+from database.membership import invalidate_membership, is_member, membership_cache
+from database.query_count import count_queries
+from utils.cache import MISSING
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    invalidate_membership()
+    yield
+    invalidate_membership()
+
+
+@pytest.fixture
+def group(client, make_user):
+    """A group with one card, and a member who isn't its creator"""
+    _, creator_headers = make_user()
+    member_id, member_headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Members"}, headers=creator_headers).get_json()['group_id']
+    card_id = client.post(
+        "/api/cards", json={'question': "q", 'correct_answer': "a", 'group_id': group_id}, headers=creator_headers,
+    ).get_json()['card_id']
+    client.post(f"/api/groups/{group_id}/join", headers=member_headers)
+    return {
+        'group_id': group_id, 'card_id': card_id, 'member_id': member_id,
+        'headers': member_headers, 'creator_headers': creator_headers,
+    }
+
+
+def cached(user_id, group):
+    return membership_cache.get((user_id, uuid.UUID(group['group_id']))) is not MISSING
+
+
+def get_card(client, group):
+    return client.get(f"/api/cards/{group['card_id']}", headers=group['headers']).status_code
+
+
+def test_memberships_are_cached_across_requests(client, group):
+    assert get_card(client, group) == 200
+    hits = membership_cache.hits
+    assert get_card(client, group) == 200
+    assert membership_cache.hits == hits + 1
+
+
+def test_non_members_are_turned_away(client, group, make_user):
+    user_id, headers = make_user()
+    assert client.get(f"/api/cards/{group['card_id']}", headers=headers).status_code == 403
+    # Only memberships are cached, so joining takes effect straight away
+    assert not cached(user_id, group)
+
+
+def test_leaving_takes_effect_straight_away(client, group):
+    assert get_card(client, group) == 200
+    client.post(f"/api/groups/{group['group_id']}/leave", headers=group['headers'])
+    assert get_card(client, group) == 403
+
+    client.post(f"/api/groups/{group['group_id']}/join", headers=group['headers'])
+    assert get_card(client, group) == 200
+
+
+def test_deleting_a_group_forgets_its_members(client, group):
+    assert get_card(client, group) == 200
+    response = client.delete(f"/api/groups/{group['group_id']}", headers=group['creator_headers'])
+    assert response.status_code == 200
+    assert not cached(group['member_id'], group)
+
+
+def test_is_member_is_one_query_then_none(app_context, group):
+    group_id = uuid.UUID(group['group_id'])
+    with count_queries() as counter:
+        assert is_member(group['member_id'], group_id)
+        assert is_member(group['member_id'], group_id)
+    assert counter.count == 1
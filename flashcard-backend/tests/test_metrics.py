@@ -0,0 +1,140 @@
+import os
+import re
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import database.pool as pool
+from database.pool import InstrumentedQueuePool, pool_stats
+from utils import metrics
+from utils.metrics import Callback, Counter, Histogram, Registry
+
+
+def sample(body, name, **labels):
+    """The value of one sample in a scrape, or 0 if it isn't there"""
+    for line in body.splitlines():
+        match = re.match(r'(\w+)(?:{(.*)})? (\S+)$', line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or ''))
+        if found == {key: str(value) for key, value in labels.items()}:
+            return float(match.group(3))
+    return 0
+
+
+def scrape(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_requests_are_counted_and_timed_by_route(client, make_user):
+    _, headers = make_user()
+    labels = {'method': 'GET', 'rule': '/api/user/groups'}
+    before = scrape(client)
+
+    for _ in range(3):
+        response = client.get("/api/user/groups", headers=headers)
+        response.close()
+    after = scrape(client)
+
+    def increase(name, **extra):
+        return sample(after, name, **labels, **extra) - sample(before, name, **labels, **extra)
+
+    assert increase('http_requests_total', status=200) == 3
+    assert increase('http_request_duration_seconds_count') == 3
+    assert increase('http_request_db_queries_sum') > 0
+
+
+def test_unmatched_requests_share_one_label(client):
+    # Any GET matches the static files route, but nothing takes a POST here
+    labels = {'method': 'POST', 'rule': 'unmatched', 'status': 405}
+    before = sample(scrape(client), 'http_requests_total', **labels)
+    client.post("/no/such/page").close()
+    assert sample(scrape(client), 'http_requests_total', **labels) - before == 1
+
+
+def test_metrics_render_in_the_prometheus_format():
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['status'], registry=registry)
+    latency = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0), registry=registry)
+    Callback('queue_depth', 'Queue depth', lambda: 7, registry=registry)
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    body = metrics.render(registry.snapshot())
+
+    assert "# TYPE requests_total counter" in body
+    assert sample(body, 'requests_total', status=200) == 3
+    assert [sample(body, 'latency_seconds_bucket', le=le) for le in ("0.1", "1", "+Inf")] == [1, 2, 3]
+    assert (sample(body, 'latency_seconds_sum'), sample(body, 'latency_seconds_count')) == (5.55, 3)
+    assert sample(body, 'queue_depth') == 7
+
+
+def test_metrics_with_the_wrong_labels_are_refused():
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['status'], registry=registry)
+    with pytest.raises(ValueError):
+        requests.inc(route="/")
+    with pytest.raises(ValueError):
+        Counter('requests_total', 'Requests again', registry=registry)
+
+
+def test_snapshots_from_every_process_are_added_up(tmp_path):
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ['status'], registry=registry)
+    latency = Histogram('latency_seconds', 'Latency', buckets=(1.0,), registry=registry)
+    requests.inc(status=200)
+    latency.observe(0.5)
+    snapshot = registry.snapshot()
+
+    merged = metrics.merge([snapshot, snapshot])
+    body = metrics.render(merged)
+    assert sample(body, 'requests_total', status=200) == 2
+    assert sample(body, 'latency_seconds_count') == 2
+
+    # Snapshots left behind by processes that have exited are dropped
+    (tmp_path / "999999999.json").write_text("{}")
+    (tmp_path / f"{os.getppid()}.json").write_text("{}")
+    assert metrics.read_snapshots(str(tmp_path)) == [{}]
+    assert not (tmp_path / "999999999.json").exists()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0,
+        pool_timeout=0.1,
+    )
+    yield engine
+    engine.dispose()
+
+
+def test_pool_stats_count_checkouts_and_timeouts(engine):
+    before = pool_stats.stats()
+
+    with engine.connect():
+        stats = pool_stats.stats()
+        assert (stats['pool_size'], stats['checked_out']) == (1, 1)
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+    after = pool_stats.stats()
+    assert after['checkouts'] - before['checkouts'] == 1
+    assert after['timeouts'] - before['timeouts'] == 1
+    assert after['checked_out'] == 0
+
+
+def test_slow_queries_are_recorded(engine, monkeypatch):
+    monkeypatch.setattr(pool, 'DB_SLOW_QUERY_MS', 0)
+    before = pool_stats.stats()['slow_queries']
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+    stats = pool_stats.stats()
+    assert stats['slow_queries'] == before + 1
+    assert stats['recent_slow_queries'][-1]['statement'] == "SELECT 1"
@@ -0,0 +1,108 @@
+"""Every view with a @query_budget stays within it.
+
+Each one is requested with enough data behind it that an N+1 query would go
+over budget, inside count_queries(), which counts everything the request
+does, streamed bodies included.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_interface import db
+from database.db_types import Card, CardDistractor, UserCardData
+from database.query_count import count_queries
+from database.sync_log import make_cursor
+
+CARDS_PER_GROUP = 10
+
+# Endpoint -> requests to make to it, filled in from the data in `library`
+BUDGETED_REQUESTS = {
+    'get_user_groups': [("GET", "/api/user/groups")],
+    'get_user_details': [
+        ("GET", "/api/user/details?user_ids={user_ids}"),
+        ("POST", "/api/user/details", {'user_ids': "{user_id_list}"}),
+    ],
+    'get_groups': [("GET", "/api/groups"), ("GET", "/api/groups?after={group_id}")],
+    'get_group_info': [("GET", "/api/groups/{group_id}")],
+    'get_group_cards': [("GET", "/api/groups/{group_id}/cards")],
+    'get_cards': [("GET", "/api/cards"), ("GET", "/api/cards?limit=5&after={card_id}")],
+    'get_random_card': [("GET", "/api/cards/flashcard"), ("GET", "/api/cards/flashcard?mode=review")],
+    'get_study_batch': [("GET", "/api/cards/session"), ("GET", "/api/cards/session?mode=random")],
+    'sync_cards': [("GET", "/api/sync"), ("GET", "/api/sync?since={cursor}")],
+}
+
+
+def budgeted_views(app):
+    return {
+        endpoint: view.query_budget
+        for endpoint, view in app.view_functions.items()
+        if hasattr(view, 'query_budget')
+    }
+
+
+@pytest.fixture
+def library(app, client, make_user):
+    """A user subscribed to two groups of cards, shared with a second user, with some review history"""
+    user_id, headers = make_user()
+    other_user_id, other_headers = make_user()
+
+    group_ids = []
+    for name in ("First", "Second"):
+        group_id = client.post("/api/groups", json={'group_name': name}, headers=headers).get_json()['group_id']
+        client.post(f"/api/groups/{group_id}/join", headers=other_headers)
+        for i in range(CARDS_PER_GROUP):
+            client.post("/api/cards", json={
+                'question': f"{name} question {i}",
+                'correct_answer': f"answer {i}",
+                'group_id': group_id,
+            }, headers=headers)
+        group_ids.append(group_id)
+
+    with app.app_context():
+        cards = Card.query.order_by(Card.card_id).all()
+        now = datetime.now()
+        for i, card in enumerate(cards):
+            db.session.add(CardDistractor(card_id=card.card_id, content_hash=card.content_hash, incorrect_answer="no"))
+            if i % 2:
+                db.session.add(UserCardData(
+                    user_id=user_id, card_id=card.card_id, times_answered=1,
+                    last_seen=now - timedelta(days=2), due_at=now - timedelta(days=1),
+                ))
+        db.session.commit()
+        card_id = str(cards[0].card_id)
+
+    return headers, {
+        'user_ids': f"{user_id},{other_user_id}",
+        'user_id_list': [str(user_id), str(other_user_id)],
+        'group_id': group_ids[0],
+        'card_id': card_id,
+        'cursor': make_cursor(datetime.now() - timedelta(hours=1)),
+    }
+
+
+def fill(value, arguments):
+    if value == "{user_id_list}":
+        return arguments['user_id_list']
+    if isinstance(value, dict):
+        return {key: fill(item, arguments) for key, item in value.items()}
+    return value.format(**arguments)
+
+
+def test_every_budgeted_view_is_exercised(app):
+    assert set(budgeted_views(app)) == set(BUDGETED_REQUESTS)
+
+
+@pytest.mark.parametrize('endpoint', sorted(BUDGETED_REQUESTS))
+def test_view_stays_within_its_query_budget(app, client, library, endpoint):
+    headers, arguments = library
+    budget = budgeted_views(app)[endpoint]
+
+    for method, path, *body in BUDGETED_REQUESTS[endpoint]:
+        path = fill(path, arguments)
+        json = fill(body[0], arguments) if body else None
+        with count_queries(max_queries=budget):
+            response = client.open(path, method=method, headers=headers, json=json)
+            response.get_data()
+            response.close()
+
+        assert response.status_code == 200, f"{method} {path}: {response.get_data(as_text=True)[:200]}"
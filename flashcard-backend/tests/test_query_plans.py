@@ -0,0 +1,62 @@
+"""No endpoint's queries read a whole table.
+
+The database is seeded with enough cards that the planner prefers an index
+wherever there's one to use. See database/query_plans.py.
+"""
+import re
+
+import pytest
+
+from conftest import empty_tables
+from database.db_interface import db
+from database.query_plans import ENDPOINTS, call_endpoints, explain_statements, seed, sorts
+
+
+@pytest.fixture(scope='module')
+def statements(app):
+    """The statements every endpoint runs, against a seeded database"""
+    with app.app_context():
+        user_id = seed(users=20, groups=100, cards=5000, subscriptions=10)
+    try:
+        yield call_endpoints(app, user_id)
+    finally:
+        empty_tables(app)
+
+
+def test_every_endpoint_succeeds(statements):
+    _, errors = statements
+    assert errors == []
+
+
+def test_every_endpoint_runs_statements(app, statements):
+    recorded, _ = statements
+    explained = {endpoint for endpoint, _, _ in explain_statements(app, recorded)}
+    expected = {method + " " + re.sub(r'{\w+}', '<id>', path.split('?')[0]) for method, path in ENDPOINTS}
+    assert explained == expected
+
+
+def test_no_full_table_scans(app, statements):
+    recorded, _ = statements
+    scans = [
+        f"{endpoint}: FULL SCAN of {', '.join(sorted(tables))}\n    {' '.join(statement.split())[:160]}"
+        for endpoint, statement, tables in explain_statements(app, recorded)
+        if tables
+    ]
+    assert not scans, "\n".join(scans)
+
+
+def test_review_batches_are_picked_a_batch_at_a_time(app, statements):
+    """Each query picking a review batch stops at the batch size, rather than sorting every card the user has"""
+    recorded, _ = statements
+    picks = [
+        (statement, parameters) for endpoint, statement, parameters in recorded
+        if endpoint == "GET /api/cards/session" and "user_card_data" in statement
+    ]
+    assert picks
+    with app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in picks:
+            assert "LIMIT" in statement.upper()
+            # Cards the user has answered come in schedule order, straight off the (user_id, due_at)
+            # index. Unseen ones are only ever sorted by card_id, within the user's own groups.
+            if not statement.split("ORDER BY")[-1].lstrip().startswith("card.card_id"):
+                assert not sorts(connection, statement, parameters), " ".join(statement.split())
@@ -0,0 +1,172 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_imports.google_sheets as google_sheets
+import data_imports.sheet_scheduler as sheet_scheduler
+from data_imports.sheet_scheduler import (
+    acquire_sync_lock, parse_cron_string, reload_sheet_syncs, release_sync_lock, run_on_one_replica,
+    run_sheet_sync, sheet_sync_scheduler_id,
+)
+from database.db_interface import db
+from database.db_types import Group, SheetSyncJob
+
+
+def test_interval_jobs_run_on_one_replica_per_interval(app_context, monkeypatch):
+    runs = []
+
+    def job():
+        runs.append(sheet_scheduler.LOCK_OWNER)
+        return "done"
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    assert run_on_one_replica("test_job", timedelta(minutes=5), job) == "done"
+
+    # Another replica firing the same job within the interval skips it
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert run_on_one_replica("test_job", timedelta(minutes=5), job) is None
+
+    # A different job has a lock of its own
+    assert run_on_one_replica("other_job", timedelta(minutes=5), job) == "done"
+
+    assert runs == ["replica-a", "replica-b"]
+
+
+def test_interval_job_lock_is_held_even_if_the_job_fails(app_context, monkeypatch):
+    def failing_job():
+        raise RuntimeError("model is down")
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    with pytest.raises(RuntimeError):
+        run_on_one_replica("test_job", timedelta(minutes=5), failing_job)
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert run_on_one_replica("test_job", timedelta(minutes=5), lambda: "done") is None
+
+
+def test_interval_job_runs_again_once_the_interval_has_passed(app_context, monkeypatch):
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    run_on_one_replica("test_job", timedelta(seconds=0), lambda: "done")
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert run_on_one_replica("test_job", timedelta(seconds=0), lambda: "done") == "done"
+
+
+class FakeScheduler:
+    """Just enough of the app's APScheduler to see what gets scheduled"""
+
+    def __init__(self, app):
+        self.app = app
+        self.jobs = {}
+
+    def add_job(self, id, **options):
+        self.jobs[id] = options
+
+    def get_job(self, id):
+        return self.jobs.get(id)
+
+    def remove_job(self, id):
+        del self.jobs[id]
+
+
+@pytest.fixture
+def scheduler(app, monkeypatch):
+    scheduler = FakeScheduler(app)
+    monkeypatch.setattr(sheet_scheduler, 'scheduler', scheduler)
+    monkeypatch.setattr(sheet_scheduler, '_scheduled_cron_strings', {})
+    return scheduler
+
+
+@pytest.fixture
+def add_sync_job(app_context, make_user):
+    user_id, _ = make_user()
+    group = Group(group_name="Synced", creator_id=user_id)
+    db.session.add(group)
+    db.session.commit()
+
+    def add_sync_job(cron_string):
+        job = SheetSyncJob(
+            group_id=group.group_id, creator_id=user_id, sheet_id="sheet", sheet_range="A:B", cron_string=cron_string,
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    return add_sync_job
+
+
+def test_cron_strings_are_parsed_with_jitter():
+    trigger = parse_cron_string("*/5 9-17 * * 0")
+    fields = {field.name: str(field) for field in trigger.fields}
+
+    assert (fields['minute'], fields['hour'], fields['day_of_week']) == ("*/5", "9-17", "0")
+    assert trigger.jitter == sheet_scheduler.SHEET_SYNC_JITTER
+
+
+@pytest.mark.parametrize('cron_string', ["*/5 * * *", "*/5 * * * * *", "61 * * * *", "every five minutes"])
+def test_bad_cron_strings_are_rejected(cron_string):
+    with pytest.raises(ValueError):
+        parse_cron_string(cron_string)
+
+
+def test_stored_jobs_are_scheduled_on_their_own_pool(scheduler, add_sync_job):
+    jobs = [add_sync_job("*/5 * * * *"), add_sync_job("0 * * * *"), add_sync_job(None), add_sync_job("never")]
+
+    assert reload_sheet_syncs() == 2
+    scheduled = scheduler.get_job(sheet_sync_scheduler_id(jobs[0].job_id))
+    assert scheduled['args'] == [jobs[0].job_id]
+    assert scheduled['executor'] == sheet_scheduler.SHEET_SYNC_EXECUTOR
+    assert scheduled['max_instances'] == 1
+
+
+def test_reloads_pick_up_changed_and_deleted_jobs(scheduler, add_sync_job):
+    changed, deleted = add_sync_job("*/5 * * * *"), add_sync_job("*/5 * * * *")
+    reload_sheet_syncs()
+
+    changed.cron_string = "0 9 * * *"
+    db.session.delete(deleted)
+    db.session.commit()
+    assert reload_sheet_syncs() == 1
+
+    trigger = scheduler.get_job(sheet_sync_scheduler_id(changed.job_id))['trigger']
+    assert {field.name: str(field) for field in trigger.fields}['hour'] == "9"
+    assert scheduler.get_job(sheet_sync_scheduler_id(deleted.job_id)) is None
+
+
+def test_sync_locks_are_only_held_by_one_replica(app_context, monkeypatch):
+    job_id = uuid.uuid4()
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    assert acquire_sync_lock(job_id)
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert not acquire_sync_lock(job_id)
+
+    # Until the holder lets it go
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    release_sync_lock(job_id, locked_until=datetime.now() - timedelta(seconds=1))
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert acquire_sync_lock(job_id)
+
+
+def test_expired_sync_locks_are_taken_over(app_context, monkeypatch):
+    job_id = uuid.uuid4()
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    assert acquire_sync_lock(job_id, ttl=timedelta(seconds=-1))
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    assert acquire_sync_lock(job_id)
+
+
+def test_syncs_are_skipped_while_another_replica_runs_them(scheduler, add_sync_job, monkeypatch):
+    job = add_sync_job("*/5 * * * *")
+    synced = []
+    monkeypatch.setattr(google_sheets, 'sync_cards_from_sheet', lambda job_id: synced.append(job_id))
+
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-a")
+    run_sheet_sync(job.job_id)
+    # The finished sync holds the lock for the length of the jitter, so another replica's run is skipped
+    monkeypatch.setattr(sheet_scheduler, 'LOCK_OWNER', "replica-b")
+    run_sheet_sync(job.job_id)
+
+    assert synced == [job.job_id]
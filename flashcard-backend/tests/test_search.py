@@ -0,0 +1,90 @@
+"""Group and card search.
+
+These run against whatever database the tests do, so on SQLite they check the
+in-process fallback index matches what MySQL's FULLTEXT search returns: every
+term required, each matched against the start of words.
+"""
+import pytest
+
+from search.inverted_index import InvertedIndex
+
+GROUPS = {
+    "Photosynthesis basics": ["How do chloroplasts capture light", "What does photosynthesis produce"],
+    "Cell photography": ["Which microscope gives sharper images", "What stains nuclei"],
+    "DNA replication": ["Which enzyme unwinds DNA", "What joins Okazaki fragments"],
+}
+
+
+@pytest.fixture
+def library(client, make_user):
+    """A user subscribed to every group in GROUPS, and another user subscribed to none"""
+    _, headers = make_user()
+    for name, questions in GROUPS.items():
+        group_id = client.post("/api/groups", json={'group_name': name}, headers=headers).get_json()['group_id']
+        for question in questions:
+            client.post("/api/cards", json={'question': question, 'correct_answer': "answer", 'group_id': group_id},
+                        headers=headers)
+    return headers
+
+
+def search_groups(client, headers, text):
+    response = client.get("/api/groups/search", query_string={'group_name': text}, headers=headers)
+    if response.status_code == 204:
+        return set()
+    return {group['group_name'] for group in response.get_json()}
+
+
+def search_cards(client, headers, text):
+    response = client.get("/api/cards/search", query_string={'q': text}, headers=headers)
+    return {card['question'] for card in response.get_json()}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("photo", {"Photosynthesis basics", "Cell photography"}),
+    ("PHOTOSYNTHESIS", {"Photosynthesis basics"}),
+    ("photo cell", {"Cell photography"}),
+    ("photo dna", set()),
+    ("dn", {"DNA replication"}),
+    ("replication", {"DNA replication"}),
+    ("synthesis", set()),
+])
+def test_groups_match_every_term_as_a_prefix(client, library, text, expected):
+    assert search_groups(client, library, text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("chloro", {"How do chloroplasts capture light"}),
+    ("which", {"Which microscope gives sharper images", "Which enzyme unwinds DNA"}),
+    ("which enzyme", {"Which enzyme unwinds DNA"}),
+    ("okazaki fragment", {"What joins Okazaki fragments"}),
+    ("answer", {question for questions in GROUPS.values() for question in questions}),
+])
+def test_cards_match_their_question_or_answer(client, library, text, expected):
+    assert search_cards(client, library, text) == expected
+
+
+def test_cards_only_come_from_the_users_groups(client, library, make_user):
+    _, headers = make_user()
+    assert search_cards(client, headers, "which") == set()
+
+
+def test_new_and_renamed_groups_are_found(client, library):
+    assert search_groups(client, library, "genetics") == set()
+    group_id = client.post("/api/groups", json={'group_name': "Genetics"}, headers=library).get_json()['group_id']
+    assert search_groups(client, library, "genetics") == {"Genetics"}
+
+    client.put(f"/api/groups/{group_id}", json={'group_name': "Heredity"}, headers=library)
+    assert search_groups(client, library, "genetics") == set()
+    assert search_groups(client, library, "hered") == {"Heredity"}
+
+
+def test_whole_words_outrank_prefixes_and_shorter_documents_win_ties():
+    index = InvertedIndex()
+    index.build([
+        (1, "cells and cell walls", None),
+        (2, "cellular respiration", None),
+        (3, "cell", None),
+    ])
+
+    assert [doc_id for doc_id, _ in index.search("cell")] == [3, 1, 2]
+    assert index.search("cell", doc_filter=lambda extra: False) == []
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+import data_imports.google_sheets as google_sheets
+from data_imports.sheet_sync import FakeSheetSource, sync_sheet
+from database.db_interface import db
+from database.db_types import (
+    Card, CardDistractor, CardTombstone, Group, SheetSyncJob, SheetSyncRow, card_content_hash
+)
+
+
+@pytest.fixture
+def job(app_context, make_user):
+    user_id, _ = make_user()
+    group = Group(group_name="Synced", creator_id=user_id)
+    db.session.add(group)
+    db.session.flush()
+    job = SheetSyncJob(group_id=group.group_id, creator_id=user_id, sheet_id="fake", sheet_range="A:B")
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def group_cards(job):
+    cards = Card.query.filter_by(group_id=job.group_id).all()
+    return {card.question: card.correct_answer for card in cards}
+
+
+def test_first_sync_inserts_every_row(job):
+    source = FakeSheetSource([("one", "1"), ("two", "2")], revision="r1")
+
+    result = sync_sheet(job, source)
+
+    assert result == {'skipped': False, 'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    assert group_cards(job) == {"one": "1", "two": "2"}
+    assert SheetSyncRow.query.filter_by(job_id=job.job_id).count() == 2
+    assert job.last_revision == "r1"
+
+
+def test_unchanged_revision_skips_reading_the_sheet(job):
+    source = FakeSheetSource([("one", "1")], revision="r1")
+    sync_sheet(job, source)
+
+    result = sync_sheet(job, source)
+
+    assert result['skipped']
+    assert source.fetches == 1
+    assert group_cards(job) == {"one": "1"}
+
+
+def test_force_syncs_an_unchanged_revision(job):
+    source = FakeSheetSource([("one", "1")], revision="r1")
+    sync_sheet(job, source)
+
+    result = sync_sheet(job, source, force=True)
+
+    assert not result['skipped']
+    assert result['unchanged'] == 1
+    assert source.fetches == 2
+
+
+def test_changed_answers_update_their_cards(job):
+    source = FakeSheetSource([("one", "1"), ("two", "2")], revision="r1")
+    sync_sheet(job, source)
+    card_ids = {card.question: card.card_id for card in Card.query.filter_by(group_id=job.group_id)}
+
+    source.set_rows([("one", "1"), ("two", "zwei")], revision="r2")
+    result = sync_sheet(job, source)
+
+    assert (result['inserted'], result['updated'], result['deleted'], result['unchanged']) == (0, 1, 0, 1)
+    assert group_cards(job) == {"one": "1", "two": "zwei"}
+    # Edited in place, not replaced
+    assert {card.question: card.card_id for card in Card.query.filter_by(group_id=job.group_id)} == card_ids
+
+
+def test_removed_rows_delete_their_cards(job):
+    source = FakeSheetSource([("one", "1"), ("two", "2")], revision="r1")
+    sync_sheet(job, source)
+    removed_card_id = Card.query.filter_by(group_id=job.group_id, question="two").one().card_id
+
+    source.set_rows([("one", "1")], revision="r2")
+    result = sync_sheet(job, source)
+
+    assert result['deleted'] == 1
+    assert group_cards(job) == {"one": "1"}
+    assert SheetSyncRow.query.filter_by(job_id=job.job_id).count() == 1
+    assert db.session.get(CardTombstone, removed_card_id) is not None
+
+
+def test_cards_added_by_hand_are_left_alone(job):
+    source = FakeSheetSource([("one", "1")], revision="r1")
+    sync_sheet(job, source)
+    db.session.add(Card(question="by hand", correct_answer="x", group_id=job.group_id, creator_id=job.creator_id))
+    db.session.commit()
+
+    source.set_rows([], revision="r2")
+    sync_sheet(job, source)
+
+    assert group_cards(job) == {"by hand": "x"}
+
+
+def test_updates_only_clear_each_cards_own_stale_distractors(job):
+    source = FakeSheetSource([("one", "1"), ("two", "2")], revision="r1")
+    sync_sheet(job, source)
+    cards = {card.question: card for card in Card.query.filter_by(group_id=job.group_id)}
+    one_new_hash = card_content_hash("one", "uno")
+    two_new_hash = card_content_hash("two", "dos")
+    db.session.add_all([
+        # Stale once "one" changes, even though "two" ends up with this hash
+        CardDistractor(card_id=cards["one"].card_id, content_hash=two_new_hash, incorrect_answer="stale"),
+        # Already matches what "one" is about to become
+        CardDistractor(card_id=cards["one"].card_id, content_hash=one_new_hash, incorrect_answer="current"),
+        CardDistractor(card_id=cards["two"].card_id, content_hash=cards["two"].content_hash, incorrect_answer="old"),
+    ])
+    db.session.commit()
+
+    source.set_rows([("one", "uno"), ("two", "dos")], revision="r2")
+    sync_sheet(job, source)
+
+    remaining = {
+        (distractor.card_id, distractor.incorrect_answer)
+        for distractor in CardDistractor.query.filter(CardDistractor.card_id.in_([c.card_id for c in cards.values()]))
+    }
+    assert remaining == {(cards["one"].card_id, "current")}
+
+
+def test_rows_must_have_two_columns(job):
+    with pytest.raises(ValueError):
+        sync_sheet(job, FakeSheetSource([("one", "1", "extra")]))
+
+
+def test_tokens_without_drive_access_download_every_time(job, tmp_path, monkeypatch):
+    # As authorized before the Drive metadata scope was asked for
+    token = tmp_path / "token.json"
+    token.write_text(Credentials(
+        "token", refresh_token="refresh", client_id="id", client_secret="secret",
+        token_uri="https://oauth2.googleapis.com/token", scopes=google_sheets.SCOPES[:1],
+        expiry=datetime.utcnow() + timedelta(hours=1),
+    ).to_json())
+    monkeypatch.setattr(google_sheets, 'GOOGLE_OAUTH2_CREDS_FILE', str(token))
+    creds = google_sheets.get_google_creds()
+    assert creds.scopes == google_sheets.SCOPES[:1]
+
+    source = google_sheets.GoogleSheetSource(job, creds)
+    monkeypatch.setattr(source, '_spreadsheet', object())
+    assert source.revision() is None
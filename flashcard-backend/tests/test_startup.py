@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+from conftest import TEST_DATABASE_URI
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_create_app(arguments, report, database_uri='sqlite://', **env):
+    """Create the app in a fresh interpreter, and return what `report` prints after"""
+    script = (
+        "import sys, threading\n"
+        "import database.db_interface as db_interface\n"
+        f"db_interface.DATABASE_URI = {database_uri!r}\n"
+        "from app import create_app\n"
+        f"create_app({arguments})\n"
+        f"print({report})\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split())
+
+
+def modules_imported_by_create_app(role, **env):
+    """Top-level packages imported by creating the app"""
+    return run_create_app(repr(role), "' '.join(sorted({name.split('.')[0] for name in sys.modules}))", **env)
+
+
+def threads_started_by_create_app(arguments):
+    return run_create_app(arguments, "' '.join(thread.name for thread in threading.enumerate())") - {'MainThread'}
+
+
+def test_web_processes_start_their_background_threads():
+    assert 'answer-buffer' in threads_started_by_create_app("'web'")
+
+
+def test_cli_apps_start_no_threads():
+    assert threads_started_by_create_app("'none'") == set()
+
+
+def test_preloaded_apps_leave_threads_to_the_workers():
+    # As gunicorn builds it in the master, before forking. post_fork starts them in each worker.
+    assert threads_started_by_create_app("'web', background_workers=False") == set()
+
+
+def test_schedulers_run_the_jobs_and_nothing_else(app):
+    # Loading the sheet sync jobs needs the tables, which the app fixture has set up
+    jobs_and_threads = run_create_app(
+        "'scheduler'",
+        "' '.join([job.id for job in __import__('scheduler').scheduler.get_jobs()] + "
+        "[thread.name for thread in threading.enumerate()])",
+        database_uri=TEST_DATABASE_URI,
+    )
+
+    assert {'backfill_distractors', 'prune_sync_log'} <= jobs_and_threads
+    assert 'answer-buffer' not in jobs_and_threads
+
+
+def test_web_processes_dont_import_the_model_sdk_on_startup():
+    modules = modules_imported_by_create_app('web', OPENAI_API_KEY="sk-test", LLM_PROVIDER="openai")
+    assert 'openai' not in modules
+    assert 'gspread' not in modules
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_interface import db
+from database.db_types import Card, Group, UserCardData, user_group
+from study.sessions import new_session_id, next_batch
+
+
+@pytest.fixture
+def deck(app_context, make_user):
+    """A user subscribed to a group of six cards: two overdue, two never answered, and two not due yet"""
+    user_id, _ = make_user()
+    group = Group(group_name="Session", creator_id=user_id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(user_group.insert().values(user_id=user_id, group_id=group.group_id))
+    cards = [Card(question=f"q{i}", correct_answer="a", group_id=group.group_id, creator_id=user_id) for i in range(6)]
+    db.session.add_all(cards)
+    db.session.flush()
+
+    now = datetime.now()
+    due = {
+        cards[0]: now - timedelta(days=1),
+        cards[1]: now - timedelta(days=3),
+        cards[2]: now + timedelta(days=2),
+        cards[3]: now + timedelta(days=1),
+    }
+    db.session.add_all(
+        UserCardData(user_id=user_id, card_id=card.card_id, times_answered=1, due_at=due_at)
+        for card, due_at in due.items()
+    )
+    db.session.commit()
+
+    overdue = [cards[1].card_id, cards[0].card_id]
+    unseen = sorted([cards[4].card_id, cards[5].card_id])
+    upcoming = [cards[3].card_id, cards[2].card_id]
+    return user_id, overdue + unseen + upcoming
+
+
+def card_ids(batch):
+    return [row.card_id for row, _ in batch]
+
+
+def test_review_batches_come_overdue_then_unseen_then_upcoming(deck):
+    user_id, expected = deck
+    assert card_ids(next_batch(user_id, new_session_id(), 10)) == expected
+
+
+def test_review_batches_dont_repeat_within_a_session(deck):
+    user_id, expected = deck
+    session_id = new_session_id()
+
+    batches = [card_ids(next_batch(user_id, session_id, 4)) for _ in range(3)]
+
+    assert batches == [expected[:4], expected[4:], []]
+
+
+def test_review_batches_skip_excluded_cards(deck):
+    user_id, expected = deck
+    batch = next_batch(user_id, new_session_id(), 3, exclude_card_ids=expected[:2])
+    assert card_ids(batch) == expected[2:5]
@@ -0,0 +1,146 @@
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_interface import db
+from database.db_types import Card, CardTombstone, MembershipEvent
+from database.sync_log import SYNC_LOG_RETENTION_DAYS, make_cursor, prune_sync_log
+
+
+@pytest.fixture
+def library(client, make_user, app):
+    """A user with a group of three cards, all of it an hour old, and a cursor from half an hour ago"""
+    _, headers = make_user()
+    group_id = client.post("/api/groups", json={'group_name': "Synced"}, headers=headers).get_json()['group_id']
+    card_ids = [
+        client.post("/api/cards", json={'question': f"q{i}", 'correct_answer': "a", 'group_id': group_id},
+                    headers=headers).get_json()['card_id']
+        for i in range(3)
+    ]
+    backdate(app, timedelta(hours=1))
+    return {
+        'headers': headers, 'group_id': group_id, 'card_ids': card_ids,
+        'cursor': make_cursor(datetime.now() - timedelta(minutes=30)),
+    }
+
+
+def backdate(app, by):
+    """Move everything already in the sync log, and every card's last change, back in time"""
+    with app.app_context():
+        for card in Card.query:
+            card.time_updated -= by
+        for event in MembershipEvent.query:
+            event.time -= by
+        for tombstone in CardTombstone.query:
+            tombstone.time_deleted -= by
+        db.session.commit()
+
+
+def sync(client, headers, since=None):
+    response = client.get("/api/sync", query_string={'since': since} if since else {}, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def card_ids(changes):
+    return sorted(card['card_id'] for card in changes['cards'])
+
+
+def test_first_sync_sends_everything(client, library):
+    changes = sync(client, library['headers'])
+
+    assert changes['full'] is True
+    assert card_ids(changes) == sorted(library['card_ids'])
+    assert changes['memberships'] == {'joined': [library['group_id']], 'left': []}
+
+
+def test_nothing_changed_sends_nothing(client, library):
+    changes = sync(client, library['headers'], library['cursor'])
+
+    assert changes['full'] is False
+    assert (changes['cards'], changes['deleted_cards']) == ([], [])
+    assert changes['memberships'] == {'joined': [], 'left': []}
+
+
+def test_deleted_cards_are_sent_as_tombstones(client, library):
+    headers, deleted = library['headers'], library['card_ids'][0]
+    assert client.delete(f"/api/cards/{deleted}", headers=headers).status_code == 200
+
+    changes = sync(client, headers, library['cursor'])
+    assert changes['deleted_cards'] == [deleted]
+    assert changes['cards'] == []
+
+
+def test_only_changed_cards_are_sent(client, library):
+    headers, edited = library['headers'], library['card_ids'][1]
+    client.put(f"/api/cards/{edited}", json={'question': "edited"}, headers=headers)
+    added = client.post(
+        "/api/cards", json={'question': "new", 'correct_answer': "a", 'group_id': library['group_id']}, headers=headers,
+    ).get_json()['card_id']
+
+    changes = sync(client, headers, library['cursor'])
+    assert card_ids(changes) == sorted([edited, added])
+
+
+def test_joined_groups_are_sent_whole_and_left_groups_named(client, library, make_user, app):
+    _, headers = make_user()
+    left_group_id = client.post("/api/groups", json={'group_name': "Left"}, headers=headers).get_json()['group_id']
+    backdate(app, timedelta(hours=1))
+    cursor = make_cursor(datetime.now() - timedelta(minutes=30))
+
+    client.post(f"/api/groups/{library['group_id']}/join", headers=headers)
+    client.post(f"/api/groups/{left_group_id}/leave", headers=headers)
+
+    # None of the joined group's cards changed since the cursor, but they're all new to this user
+    changes = sync(client, headers, cursor)
+    assert changes['memberships'] == {'joined': [library['group_id']], 'left': [left_group_id]}
+    assert card_ids(changes) == sorted(library['card_ids'])
+
+
+def test_deleted_groups_are_left_by_their_subscribers(client, library, make_user):
+    _, headers = make_user()
+    client.post(f"/api/groups/{library['group_id']}/join", headers=headers)
+    cursor = make_cursor(datetime.now() - timedelta(minutes=1))
+
+    assert client.delete(f"/api/groups/{library['group_id']}", headers=library['headers']).status_code == 200
+
+    changes = sync(client, headers, cursor)
+    assert changes['memberships']['left'] == [library['group_id']]
+
+
+def test_cursors_older_than_the_sync_log_get_everything(client, library):
+    cursor = make_cursor(datetime.now() - timedelta(days=SYNC_LOG_RETENTION_DAYS + 1))
+    changes = sync(client, library['headers'], cursor)
+
+    assert changes['full'] is True
+    assert card_ids(changes) == sorted(library['card_ids'])
+
+
+def test_each_sync_hands_out_the_next_cursor(client, library):
+    changes = sync(client, library['headers'])
+    client.delete(f"/api/cards/{library['card_ids'][0]}", headers=library['headers'])
+
+    assert sync(client, library['headers'], changes['cursor'])['deleted_cards'] == [library['card_ids'][0]]
+
+
+def test_malformed_cursors_are_rejected(client, library):
+    wrong_version = base64.urlsafe_b64encode(f"v0:{datetime.now().isoformat()}".encode()).decode()
+    not_a_time = base64.urlsafe_b64encode(b"v1:yesterday").decode()
+    for cursor in ("not-a-cursor", wrong_version, not_a_time):
+        response = client.get("/api/sync", query_string={'since': cursor}, headers=library['headers'])
+        assert response.status_code == 400
+
+
+def test_pruning_drops_only_what_no_cursor_needs(client, library, app):
+    for card_id in library['card_ids'][:2]:
+        client.delete(f"/api/cards/{card_id}", headers=library['headers'])
+    backdate(app, timedelta(days=SYNC_LOG_RETENTION_DAYS + 1))
+    client.delete(f"/api/cards/{library['card_ids'][2]}", headers=library['headers'])
+
+    with app.app_context():
+        tombstones, _ = prune_sync_log()
+        remaining = db.session.scalars(db.select(CardTombstone.card_id)).all()
+
+    assert tombstones == 2
+    assert [str(card_id) for card_id in remaining] == [library['card_ids'][2]]
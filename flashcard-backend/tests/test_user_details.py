@@ -0,0 +1,46 @@
+import uuid
+
+import database.query_count as query_count
+from database.query_count import count_queries
+from database.profiles import PROFILE_QUERY_CHUNK_SIZE, invalidate_profile
+
+
+def post_user_details(client, headers, user_ids):
+    return client.post("/api/user/details", json={'user_ids': user_ids}, headers=headers)
+
+
+def test_user_details_takes_a_chunk_of_ids_in_one_query(client, make_user, monkeypatch):
+    monkeypatch.setattr(query_count, 'QUERY_BUDGET_STRICT', True)
+    user_id, headers = make_user()
+    invalidate_profile()
+    user_ids = [str(user_id)] + [str(uuid.uuid4()) for _ in range(PROFILE_QUERY_CHUNK_SIZE - 1)]
+
+    with count_queries() as counter:
+        response = post_user_details(client, headers, user_ids)
+
+    assert response.status_code == 200
+    assert list(response.get_json()) == [str(user_id)]
+    assert counter.count == 1
+
+
+def test_user_details_takes_more_ids_than_one_query_can_fetch(client, make_user, monkeypatch):
+    monkeypatch.setattr(query_count, 'QUERY_BUDGET_STRICT', True)
+    user_id, headers = make_user()
+    other_user_id, _ = make_user()
+    invalidate_profile()
+    user_ids = [str(user_id)] + [str(uuid.uuid4()) for _ in range(2 * PROFILE_QUERY_CHUNK_SIZE)] + [str(other_user_id)]
+
+    with count_queries() as counter:
+        response = post_user_details(client, headers, user_ids)
+
+    assert response.status_code == 200
+    assert set(response.get_json()) == {str(user_id), str(other_user_id)}
+    assert counter.count == 3
+
+
+def test_user_details_rejects_malformed_bodies(client, make_user):
+    _, headers = make_user()
+
+    assert client.post("/api/user/details", json=["x"], headers=headers).status_code == 400
+    assert client.post("/api/user/details", json={'user_ids': "abc"}, headers=headers).status_code == 400
+    assert client.post("/api/user/details", json={'user_ids': ["not-a-uuid"]}, headers=headers).status_code == 400
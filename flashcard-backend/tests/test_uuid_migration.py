@@ -0,0 +1,145 @@
+"""Migration b7d4e2f9a015, which moves MySQL's UUID columns from CHAR(32) to BINARY(16).
+
+Only MySQL has anything to convert, so these are skipped unless
+TEST_DATABASE_URI points at one. CI runs them against MySQL 8.
+"""
+import pytest
+import sqlalchemy as sa
+from flask_migrate import downgrade, upgrade
+
+import database.uuid_migration as uuid_migration
+from conftest import TEST_DATABASE_URI
+from database.db_interface import db
+from database.db_types import Card, CardDistractor, Group, User, UserCardData, card_content_hash, user_group
+from database.uuid_migration import (
+    BINARY, FOREIGN_KEYS, UUID_COLUMNS, backfill, cutover, drop_foreign_keys, existing_foreign_keys,
+    prepare, rebuild_table, rename_columns,
+)
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URI.startswith('mysql'), reason="Only MySQL stores UUIDs as CHAR(32)"
+)
+
+BEFORE = 'e61f0b7c2d94'
+
+
+@pytest.fixture
+def library(app_context):
+    """A few rows in the tables with foreign keys. Puts the schema back as it was afterwards."""
+    user = User(username="migrated", email="migrated@example.com", password_hash="-")
+    db.session.add(user)
+    db.session.flush()
+    group = Group(group_name="Migrated", creator_id=user.id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(user_group.insert().values(user_id=user.id, group_id=group.group_id))
+    card = Card(question="q", correct_answer="a", group_id=group.group_id, creator_id=user.id, updated_by_id=user.id)
+    db.session.add(card)
+    db.session.flush()
+    db.session.add_all([
+        CardDistractor(card_id=card.card_id, content_hash=card_content_hash("q", "a"), incorrect_answer="b"),
+        UserCardData(user_id=user.id, card_id=card.card_id, times_answered=1),
+    ])
+    db.session.commit()
+    ids = {'user': user.id, 'group': group.group_id, 'card': card.card_id}
+    db.session.remove()
+
+    yield ids
+
+    db.session.remove()
+    upgrade()
+    with db.engine.connect() as connection:
+        cutover(connection, BINARY)
+
+
+def column_types(connection):
+    return {
+        (table, column): uuid_migration.data_type(connection, table, column)
+        for table, columns in UUID_COLUMNS.items()
+        for column in columns
+    }
+
+
+def foreign_key_count(connection):
+    return sum(len(names) for names in existing_foreign_keys(connection).values())
+
+
+def assert_converted(library, data_type):
+    with db.engine.connect() as connection:
+        assert set(column_types(connection).values()) == {data_type}
+        assert foreign_key_count(connection) == sum(len(keys) for keys in FOREIGN_KEYS.values())
+        leftovers = connection.execute(sa.text(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+            "AND (COLUMN_NAME LIKE '%\\_new' OR COLUMN_NAME LIKE '%\\_old')"
+        )).scalars().all()
+        assert leftovers == []
+        triggers = connection.execute(sa.text(
+            "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE()"
+        )).scalars().all()
+        assert triggers == []
+
+        if data_type == 'char':
+            card_ids = connection.execute(sa.text("SELECT card_id FROM card")).scalars().all()
+            assert card_ids == [library['card'].hex]
+
+
+def assert_readable(library):
+    card = db.session.get(Card, library['card'])
+    assert (card.group_id, card.creator_id) == (library['group'], library['user'])
+    assert db.session.get(UserCardData, (library['user'], library['card'])) is not None
+    assert db.session.get(CardDistractor, (library['card'], card.content_hash)) is not None
+    db.session.remove()
+
+
+def test_downgrade_and_upgrade(library):
+    downgrade(revision=BEFORE)
+    assert_converted(library, 'char')
+
+    upgrade()
+    assert_converted(library, 'binary')
+    assert_readable(library)
+
+
+def test_upgrade_after_a_backfill(library):
+    downgrade(revision=BEFORE)
+    with db.engine.connect() as connection:
+        prepare(connection)
+        connection.commit()
+        assert backfill(connection, batch_size=1) > 0
+
+    upgrade()
+    assert_converted(library, 'binary')
+    assert_readable(library)
+
+
+def test_cutover_carries_on_after_a_failure(library):
+    downgrade(revision=BEFORE)
+    with db.engine.connect() as connection:
+        prepare(connection)
+        backfill(connection)
+        # As if the cutover failed part way through: every foreign key gone, the user table
+        # converted, and the card table's columns swapped over but not rebuilt
+        drop_foreign_keys(connection)
+        rename_columns(connection, 'user')
+        rebuild_table(connection, 'user', BINARY)
+        rename_columns(connection, 'card')
+
+    upgrade()
+    assert_converted(library, 'binary')
+    assert_readable(library)
+
+
+def test_foreign_key_checks_come_back_on_when_a_foreign_key_fails(library, monkeypatch):
+    monkeypatch.setitem(FOREIGN_KEYS, 'card', FOREIGN_KEYS['card'] + [('question', 'user', 'id')])
+    with db.engine.connect() as connection:
+        with pytest.raises(sa.exc.DatabaseError):
+            cutover(connection, BINARY)
+        assert connection.execute(sa.text("SELECT @@foreign_key_checks")).scalar() == 1
+
+
+def test_cutover_puts_back_missing_foreign_keys(library):
+    with db.engine.connect() as connection:
+        drop_foreign_keys(connection)
+        assert foreign_key_count(connection) == 0
+        cutover(connection, BINARY)
+        assert foreign_key_count(connection) == sum(len(keys) for keys in FOREIGN_KEYS.values())
@@ -0,0 +1,82 @@
+"""Conditional GETs, and a cache of rendered responses.
+
+A view works out a version for what it's about to return - usually from
+time_updated columns, which are cheap to read - and derives an ETag from it.
+If the client already has that version (If-None-Match, or If-Modified-Since
+when there's no ETag to compare), it gets a 304 without the response being
+built. Otherwise the response body can be kept in render_cache, keyed by the
+version, so the next client asking for the same version gets it from memory.
+
+Timestamps are only stored to the second, so a version read within a second or
+so of its last change might change again without its timestamp moving. Those
+versions aren't settled: they're sent without validators and not cached.
+
+Responses are sent with "Cache-Control: private, no-cache": they need a token,
+and browsers must check back before reusing them.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from flask import Response, current_app, request
+
+from utils.cache import TTLCache
+
+RENDER_CACHE_TTL = float(os.getenv('RENDER_CACHE_TTL', 600))
+# Responses can be large (a whole deck), so this is kept small
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 256))
+
+# How old the latest change has to be before a version can be cached. Covers the
+# timestamp resolution, and clock differences between servers.
+CACHE_SETTLE_SECONDS = float(os.getenv('CACHE_SETTLE_SECONDS', 2))
+
+render_cache = TTLCache(maxsize=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL)
+
+
+def is_settled(last_modified):
+    """Whether a version last changed at last_modified (naive local time, like time_updated) is safe to cache"""
+    if last_modified is None:
+        return True
+    return last_modified < datetime.now() - timedelta(seconds=CACHE_SETTLE_SECONDS)
+
+
+def make_etag(*parts):
+    """An ETag (without quotes) for a version, made of any values that identify it"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def is_not_modified(etag=None, last_modified=None):
+    """Whether the client's copy is current, going by its If-None-Match or If-Modified-Since"""
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates only go to the second
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def cached_response(body, etag=None, last_modified=None, status=200):
+    """A JSON response with caching headers. body is bytes, or anything jsonify takes."""
+    if not isinstance(body, bytes):
+        body = render_json(body)
+
+    response = Response(body, status=status, mimetype='application/json')
+    return add_cache_headers(response, etag, last_modified)
+
+
+def not_modified_response(etag=None, last_modified=None):
+    return add_cache_headers(Response(status=304), etag, last_modified)
+
+
+def add_cache_headers(response, etag=None, last_modified=None):
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def render_json(data):
+    """What jsonify would send for data, as bytes"""
+    return current_app.json.dumps(data).encode() + b'\n'
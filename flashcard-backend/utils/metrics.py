@@ -0,0 +1,288 @@
+"""Prometheus-style metrics, kept in memory.
+
+Metrics are created at module level where they're recorded, and register
+themselves with the process-wide registry:
+
+    SYNC_SECONDS = Histogram('sheet_sync_duration_seconds', 'Time taken by sheet syncs', ['outcome'])
+    SYNC_SECONDS.observe(1.2, outcome='synced')
+
+Each process (every gunicorn worker, and the scheduler) counts for itself.
+When METRICS_DIR is set, each process writes a snapshot of its metrics there
+every METRICS_WRITE_INTERVAL seconds, and a scrape adds up the snapshots of
+every process that's still running. Without it, a scrape only sees the
+process that served it.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from logging import getLogger
+
+logger = getLogger()
+
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', 5))
+
+# Seconds, from a fast query up to a slow model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"A metric called {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def snapshot(self):
+        """Everything this process has recorded, as plain data that can be merged and rendered"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        snapshot = {}
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.debug(f"Couldn't collect metric {metric.name}: {e}")
+                continue
+            snapshot[metric.name] = {
+                'type': metric.type,
+                'help': metric.help,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': samples,
+            }
+        return snapshot
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(label values, value)]"""
+        with self._lock:
+            return [(list(key), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    """A count that only goes up. Names should end in _total."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Counts of observations by bucket, plus their sum"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Counts per bucket (not cumulative, the last one is +Inf), then the sum
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [(list(key), list(entry)) for key, entry in self._values.items()]
+
+
+class Callback(Metric):
+    """Value read from a function on collection, for things that are already counted elsewhere.
+
+    The function returns a number, or {label values tuple: number} if there are labels.
+    """
+
+    def __init__(self, name, help, function, labelnames=(), type='gauge', registry=REGISTRY):
+        self.type = type
+        self.function = function
+        super().__init__(name, help, labelnames, registry)
+
+    def samples(self):
+        values = self.function()
+        if not self.labelnames:
+            return [([], values)]
+        return [([str(label) for label in key], value) for key, value in values.items()]
+
+
+def merge(snapshots):
+    """Add up snapshots from several processes"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if key not in target['samples']:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    target['samples'][key] = [a + b for a, b in zip(target['samples'][key], value)]
+                else:
+                    target['samples'][key] += value
+
+    for metric in merged.values():
+        metric['samples'] = list(metric['samples'].items())
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snapshot):
+    """The Prometheus text exposition format"""
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        names = metric['labelnames']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        for labels, value in sorted(metric['samples'], key=lambda sample: list(sample[0])):
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_format_labels(names, labels)} {_format_value(value)}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(names, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(names, labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(names, labels)} {cumulative}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(directory=METRICS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    # Write then rename, so readers never see half a file
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshots(directory=METRICS_DIR):
+    """Snapshots of every live process. Files left by processes that have exited are removed."""
+    snapshots = []
+    for filename in os.listdir(directory):
+        pid, extension = os.path.splitext(filename)
+        if extension != '.json' or not pid.isdigit():
+            continue
+        path = os.path.join(directory, filename)
+        if int(pid) == os.getpid():
+            continue
+        if not _process_alive(int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.debug(f"Skipping unreadable metrics snapshot {path}: {e}")
+    return snapshots
+
+
+def collect():
+    """Metrics for the whole deployment if METRICS_DIR is set, otherwise for this process"""
+    snapshots = [REGISTRY.snapshot()]
+    if METRICS_DIR:
+        snapshots += read_snapshots()
+    return render(merge(snapshots))
+
+
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def start_snapshot_writer():
+    """Start writing this process's snapshots to METRICS_DIR, if it's set. Safe to call repeatedly, and after a fork."""
+    global _writer_pid
+    if not METRICS_DIR or _writer_pid == os.getpid():
+        return
+
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+        threading.Thread(target=_write_snapshots, name="metrics-writer", daemon=True).start()
+
+
+def _write_snapshots():
+    while True:
+        try:
+            write_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to write metrics snapshot to {METRICS_DIR}: {e}")
+        time.sleep(METRICS_WRITE_INTERVAL)
@@ -11,15 +11,29 @@ export const fetchGroupData = async (groupId: string): Promise<GroupData> => {
     return response.data;
 };
 
+// Ids per request, to keep the URL well under server limits
+const USER_DETAILS_CHUNK_SIZE = 100;
+
 export const fetchUserDetails = async (userIds: Array<string> | Set<string>): Promise<UserIdMapping> => {
-    if (userIds instanceof Set) {
-        userIds = Array.from(userIds)
+    const uniqueIds = Array.from(new Set(userIds));
+
+    // GET, so the browser can cache the responses
+    const chunks: Array<Array<string>> = [];
+    for (let i = 0; i < uniqueIds.length; i += USER_DETAILS_CHUNK_SIZE) {
+        chunks.push(uniqueIds.slice(i, i + USER_DETAILS_CHUNK_SIZE));
     }
-    const response = await axiosInstance.post("/user/details", { user_ids: userIds });
-    if (response.status !== 200) {
-        throw new Error("Failed to fetch user details");
+    const responses = await Promise.all(chunks.map((chunk) =>
+        axiosInstance.get("/user/details", { params: { user_ids: chunk.join(",") } })
+    ));
+
+    let userDetails: UserIdMapping = {};
+    for (const response of responses) {
+        if (response.status !== 200) {
+            throw new Error("Failed to fetch user details");
+        }
+        userDetails = { ...userDetails, ...response.data };
     }
-    return response.data;
+    return userDetails;
 };
 
 export const searchGroupData = async (groupName: string): Promise<Array<GroupSearchData>> => {
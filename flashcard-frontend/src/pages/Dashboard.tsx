@@ -20,6 +20,7 @@ import Grid from "@mui/material/Grid";
 import { AuthContext } from "../context/AuthContext";
 
 import axiosInstance from "../helpers/axiosInstance";
+import { fetchUserDetails } from "../helpers/utils";
 import { GroupData, UserIdMapping } from "../helpers/types";
 
 import LogoutButton from "../components/LogoutButton";
@@ -71,26 +72,21 @@ export default function Dashboard() {
 
     // When the groups are loaded, fetch the user details corresponding to the creator_id
     useEffect(() => {
-        const fetchUserDetails = async () => {
+        const fetchCreatorDetails = async () => {
             if (groups.length > 0) {
                 const creatorIds = groups.map((group: GroupData) => group.creator_id);
 
-                // Remove duplicates
-                const uniqueCreatorIds = Array.from(new Set(creatorIds));
-
                 try {
-                    const response = await axiosInstance.post("/user/details", {
-                        user_ids: uniqueCreatorIds,
-                    });
-                    setUserIdMapping(response.data);
-                    console.log("Got user details:", response.data);
+                    const userDetails = await fetchUserDetails(creatorIds);
+                    setUserIdMapping(userDetails);
+                    console.log("Got user details:", userDetails);
                 } catch (err) {
                     console.error("Failed to fetch user details:", err);
                 }
             }
         };
 
-        fetchUserDetails();
+        fetchCreatorDetails();
     }, [groups]);
 
     const handleCardClick = (groupId: string) => {
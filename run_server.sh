@@ -4,10 +4,18 @@
 echo "Starting Nginx..."
 nginx &
 
-# run database migrations (if any)
-echo "Running flask db migrations..."
-flask db migrate
-flask db upgrade
+# Bring the database schema up to date. This happens once here, not in every server process.
+echo "Setting up database..."
+flask setup-db
 
-echo "Starting flask server..."
-flask run --host=0.0.0.0
+# Scheduled jobs run in a process of their own. Every replica can run one: sheet syncs, the
+# distractor backfill and sync log pruning each take a lock in the database first, so only one
+# replica runs each of them at a time. Set RUN_SCHEDULER=false to leave it to the others.
+if [ "${RUN_SCHEDULER:-true}" = "true" ]; then
+    echo "Starting scheduler..."
+    flask run-scheduler &
+fi
+
+# Workers, threads and worker class are set by the GUNICORN_* variables, see gunicorn.conf.py
+echo "Starting gunicorn..."
+exec gunicorn -c gunicorn.conf.py "app:create_app(background_workers=False)"